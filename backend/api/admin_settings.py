@@ -4,6 +4,13 @@ from typing import Dict, List, Optional
 from backend.services import crud
 from backend.models import schemas
 from backend.services import rag_processor
+from backend.services import generation_cache
+from backend.services import ai_providers
+from backend.services import image_scheduler
+from backend.services import offload
+from backend.services import timeline_analyzer
+from backend.services import job_queue
+from backend.services import portrait_library
 from backend.middleware.auth import verify_admin_credentials
 
 router = APIRouter()
@@ -16,7 +23,7 @@ router = APIRouter()
 )
 async def get_admin_settings(username: str = Depends(verify_admin_credentials)):
     try:
-        settings = crud.read_settings()
+        settings = await crud.read_settings_async()
         return settings
     except Exception as e:
         raise HTTPException(
@@ -35,9 +42,9 @@ async def update_model_settings_endpoint(
     username: str = Depends(verify_admin_credentials)
 ):
     try:
-        success = crud.update_model_settings(schemas.ModelSettings(**model_update.model_dump()))
+        success = await offload.run_io(crud.update_model_settings, schemas.ModelSettings(**model_update.model_dump()))
         if success:
-            return crud.read_settings()
+            return await crud.read_settings_async()
         else:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -61,9 +68,9 @@ async def update_char_limits_endpoint(
 ):
     try:
         new_limits = char_limit_update.limits
-        success = crud.update_char_limits(new_limits)
+        success = await offload.run_io(crud.update_char_limits, new_limits)
         if success:
-            return crud.read_settings()
+            return await crud.read_settings_async()
         else:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -75,6 +82,138 @@ async def update_char_limits_endpoint(
             detail=f"An error occurred while updating character limits: {str(e)}"
         )
 
+@router.get(
+    "/api/admin/generation-cache",
+    summary="Get persona generation cache statistics",
+    tags=["Admin Settings"]
+)
+async def get_generation_cache_stats(username: str = Depends(verify_admin_credentials)):
+    try:
+        return await offload.run_io(generation_cache.get_stats)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to read generation cache stats: {str(e)}"
+        )
+
+@router.delete(
+    "/api/admin/generation-cache",
+    summary="Invalidate cached persona generations",
+    tags=["Admin Settings"]
+)
+async def invalidate_generation_cache(
+    model: Optional[str] = None,
+    username: str = Depends(verify_admin_credentials)
+):
+    try:
+        deleted = await offload.run_io(generation_cache.invalidate, model)
+        return {"deleted": deleted, "model": model}
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to invalidate generation cache: {str(e)}"
+        )
 
+@router.get(
+    "/api/admin/ai-providers/health",
+    summary="Get AI provider circuit breaker and latency status",
+    tags=["Admin Settings"]
+)
+async def get_ai_provider_health(username: str = Depends(verify_admin_credentials)):
+    try:
+        return ai_providers.get_provider_health()
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to read AI provider health: {str(e)}"
+        )
 
+@router.get(
+    "/api/admin/image-scheduler",
+    summary="Get image generation queue depth and wait times",
+    tags=["Admin Settings"]
+)
+async def get_image_scheduler_stats(username: str = Depends(verify_admin_credentials)):
+    try:
+        return image_scheduler.get_stats()
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to read image scheduler stats: {str(e)}"
+        )
 
+@router.get(
+    "/api/admin/offload",
+    summary="Get thread/process pool settings and event loop stalls",
+    tags=["Admin Settings"]
+)
+async def get_offload_stats(username: str = Depends(verify_admin_credentials)):
+    try:
+        return offload.get_stats()
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to read offload stats: {str(e)}"
+        )
+
+@router.get(
+    "/api/admin/timeline-cache",
+    summary="Get search timeline cache size, hits, misses and evictions",
+    tags=["Admin Settings"]
+)
+async def get_timeline_cache_stats(username: str = Depends(verify_admin_credentials)):
+    try:
+        return timeline_analyzer.get_cache_stats()
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to read timeline cache stats: {str(e)}"
+        )
+
+@router.get(
+    "/api/admin/jobs",
+    summary="Get persona generation job queue statistics",
+    tags=["Admin Settings"]
+)
+async def get_job_queue_stats(username: str = Depends(verify_admin_credentials)):
+    try:
+        return await offload.run_io(job_queue.get_stats)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to read job queue stats: {str(e)}"
+        )
+
+@router.get(
+    "/api/admin/portraits",
+    summary="Get portrait library statistics",
+    tags=["Admin Settings"]
+)
+async def get_portrait_library_stats(username: str = Depends(verify_admin_credentials)):
+    try:
+        return await offload.run_io(portrait_library.get_stats)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to read portrait library stats: {str(e)}"
+        )
+
+@router.delete(
+    "/api/admin/portraits",
+    summary="Delete portraits from the library",
+    tags=["Admin Settings"]
+)
+async def delete_portraits(
+    age_bucket: Optional[str] = None,
+    gender: Optional[str] = None,
+    occupation_class: Optional[str] = None,
+    username: str = Depends(verify_admin_credentials)
+):
+    try:
+        deleted = await offload.run_io(portrait_library.delete, age_bucket, gender, occupation_class)
+        return {"deleted": deleted}
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to delete portraits: {str(e)}"
+        )
@@ -1,6 +1,6 @@
 from fastapi import FastAPI, HTTPException, Request, Depends
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse, Response, FileResponse, RedirectResponse
+from fastapi.responses import JSONResponse, Response, FileResponse, RedirectResponse, StreamingResponse
 from pathlib import Path
 import json
 import os
@@ -14,6 +14,7 @@ from urllib.parse import quote
 from urllib.request import urlopen
 import base64
 import asyncio
+import hashlib
 import logging
 import aiohttp
 
@@ -42,31 +43,6 @@ except ImportError:
     print("Warning: matplotlib not installed. Graph generation disabled.")
     GRAPH_ENABLED = False
 
-# For AI clients
-try:
-    from openai import OpenAI
-except ImportError:
-    OpenAI = None
-
-# New Gemini SDK (preferred)
-try:
-    from google import genai as google_genai_sdk # Alias to avoid conflict
-    from google.genai import types as google_genai_types
-except ImportError:
-    google_genai_sdk = None
-    google_genai_types = None
-
-# Old Gemini SDK (fallback)
-try:
-    import google.generativeai as old_gemini_sdk
-except ImportError:
-    old_gemini_sdk = None
-    
-try:
-    from anthropic import Anthropic
-except ImportError:
-    Anthropic = None
-
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -77,12 +53,12 @@ logger = logging.getLogger(__name__)
 # Import from backend structure (fixed import issue - v2)
 from backend.api import admin_settings, config
 from backend.services import timeline_analyzer
-from backend.services import crud, rag_processor
+from backend.services import crud, rag_processor, ai_providers, generation_cache, single_flight, job_queue, image_store, offload
 from backend.services.async_image_generator import generate_image_async
 from backend.services.cache_manager import get_chief_complaints, preload_cache, load_chief_complaints_data
 from backend.services.competitive_analysis_service import CompetitiveAnalysisService
 from backend.services.google_maps_service import GoogleMapsService
-from backend.middleware.auth import verify_admin_credentials, verify_department_credentials, verify_any_credentials
+from backend.middleware.auth import verify_admin_credentials, verify_department_credentials, verify_any_credentials, is_admin_username
 from backend.models import schemas as models
 from backend.utils import config_loader, prompt_builder
 
@@ -99,6 +75,9 @@ app = FastAPI(
     version="0.1.0"
 )
 
+# 処理中のリクエストを記録（イベントループが止まった際にどのリクエストが原因かをログに出す）
+app.add_middleware(offload.InFlightRequestsMiddleware)
+
 # Log API keys status on startup
 @app.on_event("startup")
 async def startup_event():
@@ -429,14 +408,12 @@ async def startup_event():
         print("[RAG] Initializing database with lazy loading mode...")
         rag_processor.init_rag_database()
         
-        # データベースファイルの存在確認
-        from pathlib import Path
-        import os
-        
-        # 実際のRAGプロセッサーと同じパスを使用
-        rag_db_path = Path("./app_settings/rag_data.db")
+        # データベースファイルの存在確認（読み取り専用DBがあればそちらを使用）
+        rag_db_path = rag_processor.active_database_path()
         
-        if rag_db_path.exists():
+        if rag_processor.use_artifact():
+            print(f"[RAG] Using prebuilt database: {rag_db_path}")
+        elif rag_db_path.exists():
             print(f"[RAG] Database initialized at: {rag_db_path}")
             print("[RAG] CSV data will be loaded on-demand for each department")
         else:
@@ -450,52 +427,30 @@ async def startup_event():
             # 他のエラーの場合はログに記録して続行
             print(f"[RAG] Continuing without RAG database: {e}")
 
-# --- AI Client Initialization Helper --- 
+@app.on_event("startup")
+async def start_loop_monitor():
+    # イベントループを OFFLOAD_LOOP_BLOCK_MS 以上止めた処理を検出する（0以下で無効）
+    if offload.LOOP_BLOCK_MS > 0:
+        app.state.loop_monitor_task = asyncio.create_task(offload.monitor_event_loop())
+
+@app.on_event("startup")
+async def start_job_workers():
+    # ジョブキューのバックグラウンド実行タスクを起動
+    job_queue.start()
+
+@app.on_event("shutdown")
+async def shutdown_ai_clients():
+    # 実行中のジョブを止めてから、プールしているAIクライアントのHTTP接続を閉じる
+    await job_queue.stop()
+    await ai_providers.close_clients()
+
+# --- AI Client Initialization Helper ---
 def get_ai_client(model_name, api_key):
-    """Initializes and returns the correct AI client based on model name."""
-    if model_name.startswith("gpt"):
-        if not OpenAI: raise ValueError("OpenAI library not loaded.")
-        if not api_key: raise ValueError("OpenAI APIキーが設定されていません。")
-        try: return OpenAI(api_key=api_key, timeout=120.0)  # タイムアウトを120秒に設定
-        except Exception as e: raise ValueError(f"OpenAI Client Error: {e}")
-    elif model_name.startswith("claude"):
-        if not Anthropic: 
-            raise ValueError("Anthropic library not loaded.")
-        if not api_key: 
-            raise ValueError("Anthropic APIキーが設定されていません。")
-        try: 
-            import httpx
-            
-            client = Anthropic(
-                api_key=api_key,
-                timeout=120.0,  # タイムアウトを120秒に設定
-                max_retries=2,  # SDK レベルでのリトライ
-            )
-            return client
-        except Exception as e: 
-            raise ValueError(f"Anthropic Client Error: {e}")
-    elif model_name.startswith("gemini"):
-        if not api_key: raise ValueError("Google APIキーが設定されていません。")
-        # Prefer new SDK
-        if google_genai_sdk:
-            try:
-                return google_genai_sdk.Client(api_key=api_key)
-            except Exception as e:
-                pass  # エラーが発生した場合は古いSDKにフォールバック
-        # Fallback to old SDK
-        if old_gemini_sdk:
-            try:
-                old_gemini_sdk.configure(api_key=api_key)
-                # For the old SDK, GenerativeModel is returned, not a 'Client' instance
-                return old_gemini_sdk.GenerativeModel(model_name) 
-            except Exception as e_old:
-                raise ValueError(f"Google Client Error (old SDK): {e_old}")
-        raise ValueError("Google AI SDK (new or old) not available or failed to initialize.")
-    else:
-        raise ValueError(f"未対応のモデルです: {model_name}")
+    """Returns the pooled async AI client for the model (created once, reused afterwards)."""
+    return ai_providers.get_async_client(model_name, api_key)
 
 # --- Function to generate text using AI ---
-async def generate_text_response(prompt_text, model_name, api_key):
+async def generate_text_response(prompt_text, model_name, api_key, prompt_prefix=None):
     """
     Generate text using the specified AI model.
     
@@ -503,232 +458,48 @@ async def generate_text_response(prompt_text, model_name, api_key):
         prompt_text (str): The prompt to send to the AI model
         model_name (str): The model name (e.g., "gpt-4", "claude-3-opus", "gemini-pro")
         api_key (str): The API key for the AI service
+        prompt_prefix (str): Shared leading part of prompt_text to mark as cacheable
         
     Returns:
         str: The generated text response, or None if generation fails
-    """
-    import time
-    import socket
-    import ssl
     
+    Raises:
+        CircuitOpenError / provider errors: the provider is unavailable and every fallback failed
+    """
     try:
-        # Initialize AI client
-        client = get_ai_client(model_name, api_key)
-        
-        if model_name.startswith("gpt"):
-            # OpenAI API call
-            # GPT-5の判定とAPI選択
-            if "gpt-5" in model_name:
-                try:
-                    # GPT-5の新しいresponses APIを使用（最小実装）
-                    response = client.responses.create(
-                        model="gpt-5",
-                        input=prompt_text,
-                        reasoning={"effort": "high"}  # ペルソナ生成は詳細な推論が必要
-                    )
-                    return response.output_text
-                except Exception as e:
-                    print(f"[ERROR] GPT-5 responses API error: {str(e)}")
-                    print("[INFO] Trying GPT-5 with chat.completions API")
-                    
-                    # chat.completions APIでリトライ
-                    try:
-                        completion = client.chat.completions.create(
-                            model=model_name,
-                            messages=[{"role": "user", "content": prompt_text}],
-                            temperature=1.0,  # GPT-5はデフォルト値のみサポート
-                            max_completion_tokens=128000  # GPT-5最大値
-                        )
-                        return completion.choices[0].message.content
-                    except Exception as e2:
-                        print(f"[ERROR] GPT-5 chat API error: {str(e2)}")
-                        return None
-            else:
-                # GPT-4以前のモデル
-                completion = client.chat.completions.create(
-                    model=model_name,
-                    messages=[{"role": "user", "content": prompt_text}],
-                    temperature=0.7,
-                    max_tokens=128000  # 最大値に設定
-                )
-                return completion.choices[0].message.content
-            
-        elif model_name.startswith("claude"):
-            # Anthropic API call with retry logic
-            print(f"[DEBUG] Calling Claude API with model: {model_name}")
-            
-            # Network diagnostics (optional, can be removed in production)
-            if os.environ.get("DEBUG_NETWORK", "false").lower() == "true":
-                try:
-                    api_host = "api.anthropic.com"
-                    print(f"[DEBUG] DNS resolution test: {api_host}")
-                    ip_addresses = socket.gethostbyname_ex(api_host)
-                    print(f"[DEBUG] DNS resolution successful: IP addresses = {ip_addresses[2]}")
-                except Exception as net_error:
-                    print(f"[ERROR] Network diagnostic error: {type(net_error).__name__}: {net_error}")
-            
-            # Retry configuration
-            max_retries = 3
-            base_delay = 2  # Base delay in seconds
-            
-            messages_to_send = [{"role": "user", "content": prompt_text}]
-            
-            # Use direct HTTP if specified in environment
-            use_direct_http = os.environ.get("USE_DIRECT_HTTP_FOR_CLAUDE", "false").lower() == "true"
-            
-            if use_direct_http:
-                # Direct HTTP request implementation
-                import httpx
-                for attempt in range(max_retries):
-                    try:
-                        if attempt > 0:
-                            wait_time = base_delay * (2 ** (attempt - 1))
-                            print(f"[INFO] Retry attempt {attempt + 1}/{max_retries} for Claude API after {wait_time}s delay")
-                            time.sleep(wait_time)
-                        
-                        async with httpx.AsyncClient(timeout=httpx.Timeout(120.0)) as http_client:  # タイムアウトを120秒に延長
-                            http_response = await http_client.post(
-                                "https://api.anthropic.com/v1/messages",
-                                headers={
-                                    "x-api-key": api_key,
-                                    "anthropic-version": "2023-06-01",
-                                    "content-type": "application/json"
-                                },
-                                json={
-                                    "model": model_name,
-                                    "max_tokens": 2500,  # 502エラー対策で削減
-                                    "messages": messages_to_send,
-                                    "temperature": 0.7
-                                }
-                            )
-                            
-                            if http_response.status_code == 200:
-                                response_data = http_response.json()
-                                if response_data.get("content") and len(response_data["content"]) > 0:
-                                    return response_data["content"][0].get("text", "")
-                            else:
-                                error_detail = http_response.text
-                                print(f"[ERROR] Claude API HTTP error: {http_response.status_code} - {error_detail}")
-                                if http_response.status_code in [401, 403, 404]:
-                                    raise ValueError(f"Claude API error (status {http_response.status_code}): {error_detail}")
-                                
-                    except Exception as e:
-                        if attempt == max_retries - 1:
-                            raise
-            else:
-                # SDK-based approach with retries
-                for attempt in range(max_retries):
-                    try:
-                        if attempt > 0:
-                            wait_time = base_delay * (2 ** (attempt - 1))
-                            print(f"[INFO] Retry attempt {attempt + 1}/{max_retries} for Claude API after {wait_time}s delay")
-                            time.sleep(wait_time)
-                        
-                        response = client.messages.create(
-                            model=model_name,
-                            max_tokens=64000,  # Claude Sonnet 4最大値
-                            messages=messages_to_send,
-                            temperature=0.7
-                        )
-                        
-                        # Extract text from response
-                        if response.content and len(response.content) > 0:
-                            if hasattr(response.content[0], 'text'):
-                                return response.content[0].text
-                                
-                    except Exception as e:
-                        print(f"[ERROR] Claude API call failed (attempt {attempt + 1}): {type(e).__name__}: {e}")
-                        
-                        # Check for non-retryable errors
-                        if hasattr(e, 'status_code') and e.status_code in [401, 403, 404]:
-                            raise
-                        
-                        # Re-raise on last attempt
-                        if attempt == max_retries - 1:
-                            raise
-                            
-        elif model_name.startswith("gemini"):
-            # Google AI API call
-            if hasattr(client, 'models'):
-                # New SDK
-                print(f"[DEBUG] Using new Gemini SDK with model: {model_name}")
-                response = client.models.generate_content(
-                    model=model_name,
-                    contents=prompt_text,
-                    config=google_genai_types.GenerateContentConfig(
-                        temperature=0.7,
-                        max_output_tokens=64000  # Gemini 2.5 Pro最大値
-                    )
-                )
-                print(f"[DEBUG] Gemini response received: {response}")
-                if response.candidates and response.candidates[0].content.parts:
-                    generated_text = response.candidates[0].content.parts[0].text
-                else:
-                    print(f"[ERROR] Gemini response has no candidates or parts")
-                    return f"Gemini APIからの応答が空でした。別のモデルを試してください。"
-            else:
-                # Old SDK
-                print(f"[DEBUG] Using old Gemini SDK")
-                generation_config = {
-                    "temperature": 0.7,
-                    "max_output_tokens": 64000,  # Gemini 2.5 Pro最大値
-                }
-                response = client.generate_content(prompt_text, generation_config=generation_config)
-                generated_text = response.text
-            
-            # Remove Gemini-specific character count annotations
-            if generated_text:
-                generated_text = re.sub(r'[（(]\d+文字程度[）)]\s*', '', generated_text)
-                generated_text = re.sub(r'\d+文字程度[\s、。]', '', generated_text)
-            
-            return generated_text
-            
-        else:
-            raise ValueError(f"Unsupported model: {model_name}")
+        # プロバイダー障害時はサーキットブレーカーの状態に応じて健全なモデルへ切り替える
+        return await ai_providers.generate_text_with_fallback(prompt_text, model_name, api_key, prompt_prefix)
             
     except Exception as e:
         print(f"[ERROR] Text generation failed: {type(e).__name__}: {e}")
-        
-        # Try fallback to Gemini if Claude fails with connection error
-        if model_name.startswith("claude") and ("APIConnectionError" in str(e) or "Connection error" in str(e)):
-            try:
-                google_api_key = os.getenv("GOOGLE_API_KEY", "").strip()
-                if google_api_key:
-                    print("[INFO] Falling back to Gemini due to Claude connection error")
-                    fallback_model = "gemini-2.0-flash-exp"
-                    return await generate_text_response(prompt_text, fallback_model, google_api_key)
-            except Exception as fallback_error:
-                print(f"[ERROR] Fallback to Gemini also failed: {fallback_error}")
-                return f"AI生成に失敗しました（フォールバックも失敗）: {str(fallback_error)}"
-        
+        # プロバイダー障害（サーキットが開いている・フォールバックも失敗）は呼び出し元でエラーレスポンスにする
+        if is_provider_unavailable(e):
+            raise
         return f"AI生成に失敗しました: {str(e)}"
 
-# --- Function to build prompts ---
-def build_prompt(data, limit_personality="100", limit_reason="100", limit_behavior="100", 
-                 limit_reviews="100", limit_values="100", limit_demands="100", rag_context=""):
+def is_provider_unavailable(e):
+    """テキスト生成がプロバイダー障害で失敗したか（生成結果として扱わず、キャッシュ・共有もしない）"""
+    return isinstance(e, ai_providers.CircuitOpenError) or ai_providers.is_provider_failure(e)
+
+# --- Patient Type Descriptions ---
+PATIENT_TYPE_DETAILS = {
+    '利便性重視型': { "description": 'アクセスの良さ、待ち時間の短さ、診療時間の柔軟性など、便利さを最優先', "example": '忙しいビジネスパーソン、オンライン診療を好む患者' },
+    '専門医療追求型': { "description": '専門医や高度専門医療機関での治療を希望し、医師の経歴や実績を重視', "example": '難病患者、複雑な症状を持つ患者' },
+    '予防健康管理型': { "description": '病気になる前の予防や早期発見、健康維持に関心が高い', "example": '定期健診を欠かさない人、予防接種に積極的な人' },
+    '代替医療志向型': { "description": '漢方、鍼灸、ホメオパシーなど、西洋医学以外の選択肢を積極的に取り入れる', "example": '自然療法愛好者、慢性疾患の患者' },
+    '経済合理型': { "description": '自己負担額、保険適用の有無、費用対効果を重視', "example": '経済的制約のある患者、医療費控除を意識する人' },
+    '情報探求型': { "description": '徹底的な情報収集、セカンドオピニオン取得、比較検討を行う', "example": '高学歴層、慎重な意思決定を好む患者' },
+    '革新技術指向型': { "description": '最先端の医療技術、新薬、臨床試験などに積極的に関心を持つ', "example": '既存治療で効果が出なかった患者、医療イノベーションに関心がある人' },
+    '対話重視型': { "description": '医師からの丁寧な説明や対話を求め、質問が多い', "example": '不安を感じやすい患者、医療従事者' },
+    '信頼基盤型': { "description": 'かかりつけ医との長期的な関係や医療機関の評判を重視', "example": '地域密着型の患者、同じ医師に長期通院する患者' },
+    '緊急解決型': { "description": '症状の即時改善を求め、緊急性を重視', "example": '急性疾患患者、痛みに耐性が低い患者' },
+    '受動依存型': { "description": '医師の判断に全面的に依存し、自らの決定より医師の指示を優先', "example": '高齢者、医療知識が少ない患者' },
+    '自律決定型': { "description": '自分の治療に主体的に関わり、最終決定権を持ちたいと考える', "example": '医療リテラシーが高い患者、自己管理を好む慢性疾患患者' }
+}
 
-    # --- Patient Type Descriptions ---
-    patient_type_details_map = {
-        '利便性重視型': { "description": 'アクセスの良さ、待ち時間の短さ、診療時間の柔軟性など、便利さを最優先', "example": '忙しいビジネスパーソン、オンライン診療を好む患者' },
-        '専門医療追求型': { "description": '専門医や高度専門医療機関での治療を希望し、医師の経歴や実績を重視', "example": '難病患者、複雑な症状を持つ患者' },
-        '予防健康管理型': { "description": '病気になる前の予防や早期発見、健康維持に関心が高い', "example": '定期健診を欠かさない人、予防接種に積極的な人' },
-        '代替医療志向型': { "description": '漢方、鍼灸、ホメオパシーなど、西洋医学以外の選択肢を積極的に取り入れる', "example": '自然療法愛好者、慢性疾患の患者' },
-        '経済合理型': { "description": '自己負担額、保険適用の有無、費用対効果を重視', "example": '経済的制約のある患者、医療費控除を意識する人' },
-        '情報探求型': { "description": '徹底的な情報収集、セカンドオピニオン取得、比較検討を行う', "example": '高学歴層、慎重な意思決定を好む患者' },
-        '革新技術指向型': { "description": '最先端の医療技術、新薬、臨床試験などに積極的に関心を持つ', "example": '既存治療で効果が出なかった患者、医療イノベーションに関心がある人' },
-        '対話重視型': { "description": '医師からの丁寧な説明や対話を求め、質問が多い', "example": '不安を感じやすい患者、医療従事者' },
-        '信頼基盤型': { "description": 'かかりつけ医との長期的な関係や医療機関の評判を重視', "example": '地域密着型の患者、同じ医師に長期通院する患者' },
-        '緊急解決型': { "description": '症状の即時改善を求め、緊急性を重視', "example": '急性疾患患者、痛みに耐性が低い患者' },
-        '受動依存型': { "description": '医師の判断に全面的に依存し、自らの決定より医師の指示を優先', "example": '高齢者、医療知識が少ない患者' },
-        '自律決定型': { "description": '自分の治療に主体的に関わり、最終決定権を持ちたいと考える', "example": '医療リテラシーが高い患者、自己管理を好む慢性疾患患者' }
-    }
-
-    prompt_parts = [
-        "以下の情報に基づいて、医療系のペルソナを作成してください。",
-        "各項目は自然な文章で記述し、**日本語で、指定されたおおよその文字数制限に従ってください**。",
-        "",
-        "# 利用者からの入力情報"
-    ]
+def _build_profile_lines(data, include_patient_type_details=True):
+    """利用者の入力情報（基本情報・追加情報）をプロンプト用の行リストに整形"""
+    lines = []
 
     # 基本情報
     basic_info = {
@@ -752,16 +523,16 @@ def build_prompt(data, limit_personality="100", limit_reason="100", limit_behavi
 
     for key, value in basic_info.items():
         if value: # 値が存在する場合のみプロンプトに追加
-            prompt_parts.append(f"- {key}: {value}")
-            if key == "患者タイプ" and value in patient_type_details_map:
-                details = patient_type_details_map[value]
-                prompt_parts.append(f"  - 患者タイプの特徴: {details['description']}")
-                prompt_parts.append(f"  - 患者タイプの例: {details['example']}")
+            lines.append(f"- {key}: {value}")
+            if key == "患者タイプ" and include_patient_type_details and value in PATIENT_TYPE_DETAILS:
+                details = PATIENT_TYPE_DETAILS[value]
+                lines.append(f"  - 患者タイプの特徴: {details['description']}")
+                lines.append(f"  - 患者タイプの例: {details['example']}")
         # 「選択された患者タイプ」の(自動生成)条件から patient_type を除外 (「患者タイプ」で処理されるため)
         elif key in ["名前", "性別", "年齢", "都道府県", "市区町村", "家族構成", "職業", "年収", "趣味", "ライフイベント"] and key != "患者タイプ": 
-             prompt_parts.append(f"- {key}: (自動生成)")
+             lines.append(f"- {key}: (自動生成)")
         elif key == "患者タイプ" and not value and data.get('setting_type') == 'patient_type': # setting_typeがpatient_typeで患者タイプが未選択の場合
-             prompt_parts.append(f"- {key}: (指定なし/自動生成)")
+             lines.append(f"- {key}: (指定なし/自動生成)")
 
     # Step 4の固定追加項目
     fixed_additional_info = {
@@ -776,10 +547,10 @@ def build_prompt(data, limit_personality="100", limit_reason="100", limit_behavi
     }
     has_fixed_additional_info = any(fixed_additional_info.values())
     if has_fixed_additional_info:
-        prompt_parts.append("\n## 追加情報（固定項目）")
+        lines.append("\n## 追加情報（固定項目）")
         for key, value in fixed_additional_info.items():
             if value:
-                prompt_parts.append(f"- {key}: {value}")
+                lines.append(f"- {key}: {value}")
 
     # Step 4の動的追加項目
     additional_field_names = data.get('additional_field_name', [])
@@ -794,8 +565,23 @@ def build_prompt(data, limit_personality="100", limit_reason="100", limit_behavi
                 dynamic_additional_info.append(f"- {field_name}: {field_value}")
     
     if dynamic_additional_info:
-        prompt_parts.append("\n## 追加情報（自由入力項目）")
-        prompt_parts.extend(dynamic_additional_info)
+        lines.append("\n## 追加情報（自由入力項目）")
+        lines.extend(dynamic_additional_info)
+
+    return lines
+
+# --- Function to build prompts ---
+def build_prompt(data, limit_personality="100", limit_reason="100", limit_behavior="100", 
+                 limit_reviews="100", limit_values="100", limit_demands="100", rag_context=""):
+
+    prompt_parts = [
+        "以下の情報に基づいて、医療系のペルソナを作成してください。",
+        "各項目は自然な文章で記述し、**日本語で、指定されたおおよその文字数制限に従ってください**。",
+        "",
+        "# 利用者からの入力情報"
+    ]
+
+    prompt_parts.extend(_build_profile_lines(data))
 
     prompt_parts.append("\n# 生成項目")
     prompt_parts.append("以下の項目について、上記情報に基づいた自然な文章を生成してください。")
@@ -824,119 +610,259 @@ def build_prompt(data, limit_personality="100", limit_reason="100", limit_behavi
     
     return "\n".join(prompt_parts)
 
+# 全リクエストで同一の指示を先頭にまとめ、プロバイダー側のプロンプトキャッシュを効かせる
+PROMPT_PREFIX_CACHING = os.getenv("PROMPT_PREFIX_CACHING", "false").lower() == "true"
+# 6項目を3回の小さな呼び出しに分けて並列生成する（リクエストの "section_parallel" で個別指定も可）
+SECTION_PARALLEL_ENABLED = os.getenv("SECTION_PARALLEL_ENABLED", "false").lower() == "true"
+
+# キャッシュ用プロンプトの6項目の見出し（番号・見出しは PersonaSectionParser が認識する形式）
+PROMPT_SECTION_HEADERS = {
+    "personality": "1. **個性（価値観・人生観）**",
+    "reason": "2. **病院に行く理由（入力情報の主訴を踏まえて）**",
+    "behavior": "3. **症状のパターンや受診頻度**",
+    "reviews": "4. **口コミを見る際に重要視すること**",
+    "values": "5. **医療機関に対する価値観や行動傾向**",
+    "demands": "6. **医療機関に求めるもの**",
+}
+# セクション並列生成で1回の呼び出しにまとめる項目
+SECTION_GROUPS = [
+    ("personality", "values"),
+    ("reason", "behavior"),
+    ("reviews", "demands"),
+]
+
+def _section_header_line(section, char_limits):
+    return f"{PROMPT_SECTION_HEADERS[section]}: {char_limits[section]}文字程度の内容をここに記述"
+
+def build_prompt_prefix(char_limits):
+    """
+    キャッシュ用プロンプトの共通プレフィックス（患者タイプ定義・出力形式・6項目の見出し）
+    
+    入力値を含めないため、文字数制限の設定が変わらない限りバイト単位で同一になる
+    """
+    prompt_parts = [
+        "あなたは医療系のペルソナ作成専門家です。",
+        "最後に示す「利用者からの入力情報」に基づいて、医療系のペルソナを作成してください。",
+        "各項目は自然な文章で記述し、**日本語で、指定されたおおよその文字数制限に従ってください**。",
+        "",
+        "# 患者タイプの定義",
+        "入力情報に患者タイプがある場合は、以下の特徴を踏まえてください。"
+    ]
+    for patient_type, details in PATIENT_TYPE_DETAILS.items():
+        prompt_parts.append(f"- {patient_type}: {details['description']}（例: {details['example']}）")
+    
+    prompt_parts.append("\n# 生成項目")
+    prompt_parts.append("以下の項目について、入力情報に基づいた自然な文章を生成してください。")
+    prompt_parts.append("\n## 出力形式の重要な指示:")
+    prompt_parts.append("- 必ず以下の形式で出力してください")
+    prompt_parts.append("- 各項目は「番号. **項目名**: 内容」の形式で記述")
+    prompt_parts.append("- 内容は項目名の後のコロン（:）の直後に続けて記述")
+    prompt_parts.append("- 文字数の指定（例：「100文字程度」）は出力に含めない")
+    prompt_parts.append("- ペルソナ名などの余分なヘッダーは含めない")
+    prompt_parts.append("")
+    prompt_parts.append("## 生成する項目（各項目を指定文字数で）:")
+    for section in PROMPT_SECTION_HEADERS:
+        prompt_parts.append(_section_header_line(section, char_limits))
+    
+    prompt_parts.append("\n注意事項:")
+    prompt_parts.append("- 入力情報の主訴を必ず反映させてください")
+    prompt_parts.append("- 各項目は指定された文字数で簡潔に記述してください")
+    prompt_parts.append("- 具体的でリアルな内容にしてください")
+    return "\n".join(prompt_parts) + "\n\n"
+
+def build_cacheable_prompt(data, char_limits, rag_context=""):
+    """
+    プレフィックス（全リクエスト共通）と入力情報（リクエストごと）に分けてプロンプトを作成する
+    
+    Returns:
+        (prefix, prompt_text): prompt_text は prefix で始まる完全なプロンプト
+    """
+    prefix = build_prompt_prefix(char_limits)
+    prompt_text = prefix + _build_request_context(data, rag_context)
+    prompt_text += "\n\n上記の入力情報に基づいて、指定の形式で6つの項目を出力してください。"
+    return prefix, prompt_text
+
+def _build_request_context(data, rag_context=""):
+    """キャッシュ用プロンプトの末尾に置くリクエストごとの入力情報"""
+    prompt_parts = ["# 利用者からの入力情報"]
+    prompt_parts.append(f"- 主訴: {data.get('chief_complaint')}")
+    prompt_parts.extend(_build_profile_lines(data, include_patient_type_details=False))
+    if rag_context:
+        prompt_parts.append(rag_context.rstrip())
+    return "\n".join(prompt_parts)
+
+def build_section_prompts(data, char_limits, rag_context=""):
+    """
+    セクション並列生成用のプロンプトを作成する
+    
+    3つの呼び出しは共通プレフィックスと入力情報までが同一で、末尾の出力項目の指示だけが異なる
+    
+    Returns:
+        (shared_prefix, prompts): prompts は SECTION_GROUPS と同じ順のプロンプト
+    """
+    shared_prefix = build_prompt_prefix(char_limits) + _build_request_context(data, rag_context) + "\n\n"
+    prompts = []
+    for group in SECTION_GROUPS:
+        prompt_parts = [f"上記の入力情報に基づいて、今回は次の{len(group)}項目のみを指定の形式（番号も同じ）で出力してください。他の項目は出力しないでください。"]
+        prompt_parts.extend(_section_header_line(section, char_limits) for section in group)
+        prompts.append(shared_prefix + "\n".join(prompt_parts))
+    return shared_prefix, prompts
+
 # --- Function to parse AI response ---
+class PersonaSectionParser:
+    """AI応答を1行ずつ解析し、6つのセクションに振り分ける"""
+
+    def __init__(self):
+        self.sections = {
+            "personality": "",
+            "reason": "",
+            "behavior": "",
+            "reviews": "",
+            "values": "",
+            "demands": ""
+        }
+        self.current_section = None
+
+    def _start_section(self, section, line, cleanup_patterns):
+        """セクション見出し行を処理し、閉じられたセクション名を返す"""
+        closed_section = self.current_section if self.current_section != section else None
+        self.current_section = section
+        # Check if content is on the same line after colon
+        content = line.split(':', 1)[1].strip() if ':' in line else ""
+        if content:
+            for pattern in cleanup_patterns:
+                content = re.sub(pattern, '', content)
+            self.sections[section] = content
+        return closed_section
+
+    def feed_line(self, line):
+        """
+        1行を処理する
+
+        Returns:
+            新しいセクションが始まったことで閉じられたセクション名（なければNone）
+        """
+        line = line.strip()
+        if not line:
+            return None
+            
+        # Skip persona name headers (e.g., **ペルソナ：本田 瑞季**)
+        if line.startswith("**") and "ペルソナ" in line and line.endswith("**"):
+            return None
+            
+        # Check if this is a section header for personality section
+        # Support both numbered format and **header** format
+        # Also support formats without colons and with content on next line
+        if (line.startswith("1.") and ("個性" in line or "価値観" in line or "人生観" in line)) or \
+           (line.startswith("**1.") and ("個性" in line or "価値観" in line or "人生観" in line)) or \
+           (line.startswith("**") and ("個性" in line or "価値観" in line or "人生観" in line) and line.endswith("**")):
+            # 「(100文字程度)」のような文字数指定を削除
+            return self._start_section("personality", line, [r'[（(]\d+文字程度[）)]\s*', r'\d+文字程度\s*'])
+            
+        # Check for reason section
+        elif (line.startswith("2.") and "病院に行く理由" in line) or \
+             (line.startswith("**2.") and "病院に行く理由" in line) or \
+             (line.startswith("**") and "病院に行く理由" in line and line.endswith("**")):
+            return self._start_section("reason", line, [r'\(\d+文字程度\)\s*'])
+            
+        # Check for behavior section
+        elif (line.startswith("3.") and ("症状" in line or "通院頻度" in line or "行動パターン" in line)) or \
+             (line.startswith("**3.") and ("症状" in line or "通院頻度" in line or "行動パターン" in line)) or \
+             (line.startswith("**") and ("症状" in line or "通院頻度" in line or "行動パターン" in line) and line.endswith("**")):
+            return self._start_section("behavior", line, [r'\(\d+文字程度\)\s*'])
+            
+        # Check for reviews section
+        elif (line.startswith("4.") and ("口コミ" in line or "重視ポイント" in line)) or \
+             (line.startswith("**4.") and ("口コミ" in line or "重視ポイント" in line)) or \
+             (line.startswith("**") and ("口コミ" in line or "重視ポイント" in line) and line.endswith("**")):
+            return self._start_section("reviews", line, [r'\(\d+文字程度\)\s*'])
+            
+        # Check for values section
+        elif (line.startswith("5.") and ("医療機関" in line or "価値観" in line or "行動傾向" in line)) or \
+             (line.startswith("**5.") and ("医療機関" in line or "価値観" in line or "行動傾向" in line)) or \
+             (line.startswith("**") and ("医療機関" in line and ("価値観" in line or "行動傾向" in line)) and line.endswith("**")):
+            return self._start_section("values", line, [r'\(\d+文字程度\)\s*'])
+            
+        # Check for demands section
+        elif (line.startswith("6.") and ("医療機関" in line or "求めるもの" in line)) or \
+             (line.startswith("**6.") and ("医療機関" in line or "求めるもの" in line)) or \
+             (line.startswith("**") and ("医療機関" in line and "求めるもの" in line) and line.endswith("**")):
+            return self._start_section("demands", line, [r'\(\d+文字程度\)\s*'])
+            
+        # If we're in a section, append text (skip headers and numbered lines)
+        if self.current_section and not line.startswith(("#", "##", "###", "**")) and not re.match(r'^\d+\.', line):
+            # 「(100文字程度)」のような文字数指定を削除
+            cleaned_line = re.sub(r'[（(]\d+文字程度[）)]\s*', '', line)
+            cleaned_line = re.sub(r'\d+文字程度\s*', '', cleaned_line)
+            # Remove extra asterisks that might be in the content
+            cleaned_line = cleaned_line.strip('*').strip()
+            if cleaned_line:
+                if self.sections[self.current_section]:
+                    self.sections[self.current_section] += " " + cleaned_line
+                else:
+                    self.sections[self.current_section] = cleaned_line
+        return None
+
+
+class StreamingSectionParser:
+    """ストリームで届くテキスト断片を受け取り、閉じたセクションを順次返す"""
+
+    def __init__(self):
+        self._parser = PersonaSectionParser()
+        self._buffer = ""
+        self._emitted = set()
+        self._chunks = []
+
+    @property
+    def text(self):
+        """これまでに受け取った全文"""
+        return "".join(self._chunks)
+
+    def _closed(self, section):
+        if section and section not in self._emitted and self._parser.sections[section]:
+            self._emitted.add(section)
+            return [(section, self._parser.sections[section])]
+        return []
+
+    def feed(self, chunk):
+        """テキスト断片を追加し、確定したセクションの (名前, 内容) のリストを返す"""
+        self._chunks.append(chunk)
+        self._buffer += chunk
+        closed = []
+        while "\n" in self._buffer:
+            line, self._buffer = self._buffer.split("\n", 1)
+            closed.extend(self._closed(self._parser.feed_line(line)))
+        return closed
+
+    def feed_complete(self, text):
+        """それだけで完結したテキスト（セクション並列生成の1グループ分）を追加し、含まれるセクションをすべて確定させる"""
+        closed = self.feed(text if text.endswith("\n") else text + "\n")
+        closed.extend(self._closed(self._parser.current_section))
+        self._parser.current_section = None
+        return closed
+
+    def finish(self):
+        """ストリーム終了時に残りのバッファと最後のセクションを確定させる"""
+        closed = []
+        if self._buffer:
+            closed.extend(self._closed(self._parser.feed_line(self._buffer)))
+            self._buffer = ""
+        closed.extend(self._closed(self._parser.current_section))
+        return closed
+
+
 def parse_ai_response(text):
     """Extract sections from AI-generated text response."""
-    sections = {
-        "personality": "",
-        "reason": "",
-        "behavior": "",
-        "reviews": "",
-        "values": "",
-        "demands": ""
-    }
+    parser = PersonaSectionParser()
+    sections = parser.sections
     
     if not text:
         return sections
     
     # Try to parse structured output
     try:
-        lines = text.strip().split('\n')
-        current_section = None
-        
-        
-        for i, line in enumerate(lines):
-            line = line.strip()
-            if not line:
-                continue
-                
-            # Skip persona name headers (e.g., **ペルソナ：本田 瑞季**)
-            if line.startswith("**") and "ペルソナ" in line and line.endswith("**"):
-                continue
-                
-            # Check if this is a section header for personality section
-            # Support both numbered format and **header** format
-            # Also support formats without colons and with content on next line
-            if (line.startswith("1.") and ("個性" in line or "価値観" in line or "人生観" in line)) or \
-               (line.startswith("**1.") and ("個性" in line or "価値観" in line or "人生観" in line)) or \
-               (line.startswith("**") and ("個性" in line or "価値観" in line or "人生観" in line) and line.endswith("**")):
-                current_section = "personality"
-                # Check if content is on the same line after colon
-                content = line.split(':', 1)[1].strip() if ':' in line else ""
-                if content:
-                    # 「(100文字程度)」のような文字数指定を削除
-                    content = re.sub(r'[（(]\d+文字程度[）)]\s*', '', content)
-                    content = re.sub(r'\d+文字程度\s*', '', content)
-                    sections[current_section] = content
-                continue
-                
-            # Check for reason section
-            elif (line.startswith("2.") and "病院に行く理由" in line) or \
-                 (line.startswith("**2.") and "病院に行く理由" in line) or \
-                 (line.startswith("**") and "病院に行く理由" in line and line.endswith("**")):
-                current_section = "reason"
-                content = line.split(':', 1)[1].strip() if ':' in line else ""
-                if content:
-                    content = re.sub(r'\(\d+文字程度\)\s*', '', content)
-                    sections[current_section] = content
-                continue
-                
-            # Check for behavior section
-            elif (line.startswith("3.") and ("症状" in line or "通院頻度" in line or "行動パターン" in line)) or \
-                 (line.startswith("**3.") and ("症状" in line or "通院頻度" in line or "行動パターン" in line)) or \
-                 (line.startswith("**") and ("症状" in line or "通院頻度" in line or "行動パターン" in line) and line.endswith("**")):
-                current_section = "behavior"
-                content = line.split(':', 1)[1].strip() if ':' in line else ""
-                if content:
-                    content = re.sub(r'\(\d+文字程度\)\s*', '', content)
-                    sections[current_section] = content
-                continue
-                
-            # Check for reviews section
-            elif (line.startswith("4.") and ("口コミ" in line or "重視ポイント" in line)) or \
-                 (line.startswith("**4.") and ("口コミ" in line or "重視ポイント" in line)) or \
-                 (line.startswith("**") and ("口コミ" in line or "重視ポイント" in line) and line.endswith("**")):
-                current_section = "reviews"
-                content = line.split(':', 1)[1].strip() if ':' in line else ""
-                if content:
-                    content = re.sub(r'\(\d+文字程度\)\s*', '', content)
-                    sections[current_section] = content
-                continue
-                
-            # Check for values section
-            elif (line.startswith("5.") and ("医療機関" in line or "価値観" in line or "行動傾向" in line)) or \
-                 (line.startswith("**5.") and ("医療機関" in line or "価値観" in line or "行動傾向" in line)) or \
-                 (line.startswith("**") and ("医療機関" in line and ("価値観" in line or "行動傾向" in line)) and line.endswith("**")):
-                current_section = "values"
-                content = line.split(':', 1)[1].strip() if ':' in line else ""
-                if content:
-                    content = re.sub(r'\(\d+文字程度\)\s*', '', content)
-                    sections[current_section] = content
-                continue
-                
-            # Check for demands section
-            elif (line.startswith("6.") and ("医療機関" in line or "求めるもの" in line)) or \
-                 (line.startswith("**6.") and ("医療機関" in line or "求めるもの" in line)) or \
-                 (line.startswith("**") and ("医療機関" in line and "求めるもの" in line) and line.endswith("**")):
-                current_section = "demands"
-                content = line.split(':', 1)[1].strip() if ':' in line else ""
-                if content:
-                    content = re.sub(r'\(\d+文字程度\)\s*', '', content)
-                    sections[current_section] = content
-                continue
-                
-            # If we're in a section, append text (skip headers and numbered lines)
-            if current_section and not line.startswith(("#", "##", "###", "**")) and not re.match(r'^\d+\.', line):
-                # 「(100文字程度)」のような文字数指定を削除
-                cleaned_line = re.sub(r'[（(]\d+文字程度[）)]\s*', '', line)
-                cleaned_line = re.sub(r'\d+文字程度\s*', '', cleaned_line)
-                # Remove extra asterisks that might be in the content
-                cleaned_line = cleaned_line.strip('*').strip()
-                if cleaned_line:
-                    if sections[current_section]:
-                        sections[current_section] += " " + cleaned_line
-                    else:
-                        sections[current_section] = cleaned_line
+        for line in text.strip().split('\n'):
+            parser.feed_line(line)
     
     except Exception as e:
         print(f"Error parsing AI response: {e}")
@@ -976,186 +902,216 @@ def parse_ai_response(text):
     
     return sections
 
-@app.post("/api/generate")
-async def generate_persona(request: Request, username: str = Depends(verify_any_credentials)):
-    import time
-    request_start_time = time.time()
-    print("="*60)
-    print(f"[PERF] Request started at {time.strftime('%H:%M:%S')}")
-    print("="*60)
-    
+def _age_to_rag_group(age):
+    """年齢入力（"45", "45y3m" など）をRAG検索用の年代グループに変換"""
+    if not age:
+        return None
     try:
-        data = await request.json()
-        
-        # --- 設定をcrudから読み込む ---
+        age_str = str(age)
+        # 年齢を数値に変換
+        if 'y' in age_str:
+            # "45y3m" -> 45
+            age_num = int(age_str.split('y')[0])
+        elif age_str.isdigit():
+            # "45" -> 45
+            age_num = int(age_str)
+        else:
+            age_num = None
+        
+        if age_num is not None:
+            if age_num < 20:
+                return "10s"
+            elif age_num < 30:
+                return "20s"
+            elif age_num < 40:
+                return "30s"
+            elif age_num < 50:
+                return "40s"
+            elif age_num < 60:
+                return "50s"
+            elif age_num < 70:
+                return "60s"
+            else:
+                return "70s"
+    except (ValueError, AttributeError):
+        print(f"Warning: Could not parse age '{age}' for RAG search")
+    return None
+
+def _build_rag_context(department, chief_complaint, rag_results):
+    """RAG検索結果をプロンプト用の参考情報テキストに整形"""
+    if not rag_results:
+        return ""
+    rag_context = "\n\n# 参考情報（この診療科・主訴の患者が検索するキーワード）\n"
+    if chief_complaint:
+        rag_context += f"以下は、{department}で「{chief_complaint}」に関連し、同じ年代・性別の患者がよく検索するキーワードです。ペルソナ作成の参考にしてください：\n"
+    else:
+        rag_context += "以下は、同じ診療科・年代・性別の患者がよく検索するキーワードです。ペルソナ作成の参考にしてください：\n"
+    for i, result in enumerate(rag_results, 1):
+        rag_context += f"{i}. {result['keyword']} (検索数: {result['search_volume']}人)\n"
+        # カテゴリーフィールドは削除（CSVに存在しないため）
+    return rag_context
+
+def _fallback_persona_details():
+    """AI生成失敗またはスキップ時のフォールバック"""
+    return {
+        "personality": "真面目で責任感が強く、家族を大切にする。健康意識が高く、予防医療に関心がある。",
+        "reason": "定期的な健康診断と、軽度の高血圧の管理のため。",
+        "behavior": "3ヶ月に一度の定期検診に欠かさず通院。処方された降圧剤を規則正しく服用している。",
+        "reviews": "医師の説明がわかりやすいこと、待ち時間が短いこと、スタッフの対応が丁寧であることを重視する。",
+        "values": "信頼できる医師との長期的な関係を望む。予防医療に前向きで、医師のアドバイスを真摯に受け止める。",
+        "demands": "わかりやすい説明と、必要に応じて専門医への適切な紹介。予防医療のアドバイスも欲しい。"
+    }
+
+def prepare_persona_generation(data, username=None, app_settings=None, rag_search=None):
+    """
+    ペルソナ生成の準備（設定・APIキー・文字数制限・RAG検索・プロンプト構築）を行う
+    
+    /api/generate と /api/generate/stream で共有する
+    バッチ生成では読み込み済みの設定と、結果を使い回すRAG検索関数を渡す
+    
+    Returns:
+        dict: モデル名、APIキー、プロンプト、RAG情報などを含む生成コンテキスト
+    """
+    # --- 設定をcrudから読み込む ---
+    if app_settings is None:
         app_settings = crud.read_settings() # AdminSettings インスタンスが返る
-        
-        selected_text_model = app_settings.models.text_api_model if app_settings.models else "gpt-5" # デフォルト値をGPT-5に
-        selected_image_model = app_settings.models.image_api_model if app_settings.models else "dall-e-3" # デフォルト値
-        
-        # ===== モデル使用ログ =====
+    if rag_search is None:
+        rag_search = rag_processor.search_rag_data
+    
+    selected_text_model = app_settings.models.text_api_model if app_settings.models else "gpt-5" # デフォルト値をGPT-5に
+    selected_image_model = app_settings.models.image_api_model if app_settings.models else "dall-e-3" # デフォルト値
+    
+    # ===== モデル使用ログ =====
+    print("="*60)
+    print("[MODEL] ===== AI MODEL SELECTION =====")
+    print(f"[MODEL] Text Generation Model: {selected_text_model}")
+    print(f"[MODEL] Image Generation Model: {selected_image_model}")
+    print("="*60)
+
+    # --- APIキーの取得 ---
+    openai_api_key = os.environ.get("OPENAI_API_KEY", "").strip()
+    anthropic_api_key = os.environ.get("ANTHROPIC_API_KEY", "").strip()
+    google_api_key = os.environ.get("GOOGLE_API_KEY", "").strip()
+
+    # テキスト生成用APIキーの選択
+    text_api_key_to_use = None
+    if selected_text_model.startswith("gpt"):
+        text_api_key_to_use = openai_api_key
+    elif selected_text_model.startswith("claude"):
+        text_api_key_to_use = anthropic_api_key
+    elif selected_text_model.startswith("gemini"):
+        text_api_key_to_use = google_api_key
+    
+    # テスト用ダミーデータ (テキスト生成) - APIキーがない場合
+    if not text_api_key_to_use and not (selected_text_model.startswith("gemini") and google_api_key): # Geminiはキーがなくてもgenai.configureされるため別途判定
+         if selected_text_model != "dummy": # "dummy" モデル選択時以外でキーがない場合
+            print(f"Warning: API key for {selected_text_model} not found. Text generation might fail or use defaults.")
+            # ここでエラーを返すか、ダミーデータを返すかは設計次第
+            # 今回はget_ai_clientやAPI呼び出しでエラーになることを許容
+
+
+    # 文字数制限を取得（管理画面の設定を優先）
+    if app_settings.limits:
+        limit_personality = app_settings.limits.get("personality", "100")
+        limit_reason = app_settings.limits.get("reason", "100")
+        limit_behavior = app_settings.limits.get("behavior", "100")
+        limit_reviews = app_settings.limits.get("reviews", "100")
+        limit_values = app_settings.limits.get("values", "100")
+        limit_demands = app_settings.limits.get("demands", "100")
+    else:
+        # フォールバック：環境変数から取得
+        limit_personality = os.environ.get("LIMIT_PERSONALITY", "100")
+        limit_reason = os.environ.get("LIMIT_REASON", "100")
+        limit_behavior = os.environ.get("LIMIT_BEHAVIOR", "100")
+        limit_reviews = os.environ.get("LIMIT_REVIEWS", "100")
+        limit_values = os.environ.get("LIMIT_VALUES", "100")
+        limit_demands = os.environ.get("LIMIT_DEMANDS", "100")
+    
+    # RAGデータベースは起動時に一度だけ初期化されているので、ここでは不要
+    # rag_processor.init_rag_database()  # コメントアウト - 遅延読み込みのため不要
+    
+    # RAGデータの検索
+    rag_context = ""
+    rag_results = []
+    department = data.get('department')
+    age = data.get('age')
+    gender = data.get('gender')
+    chief_complaint = data.get('chief_complaint')  # 主訴を取得
+    
+    if department:
+        # 年齢グループの判定
+        age_group = _age_to_rag_group(age)
+        
+        # RAGデータの検索（主訴を含めて検索）
         print("="*60)
-        print("[MODEL] ===== AI MODEL SELECTION =====")
-        print(f"[MODEL] Text Generation Model: {selected_text_model}")
-        print(f"[MODEL] Image Generation Model: {selected_image_model}")
+        print("[RAG] ===== STARTING RAG DATA SEARCH =====")
+        print(f"[RAG] Department: {department}")
+        print(f"[RAG] Chief Complaint: {chief_complaint}")
+        print(f"[RAG] Age Group: {age_group}")
+        print(f"[RAG] Gender: {gender}")
         print("="*60)
-
-        # --- APIキーの取得 ---
-        openai_api_key = os.environ.get("OPENAI_API_KEY", "").strip()
-        anthropic_api_key = os.environ.get("ANTHROPIC_API_KEY", "").strip()
-        google_api_key = os.environ.get("GOOGLE_API_KEY", "").strip()
-
-        # テキスト生成用APIキーの選択
-        text_api_key_to_use = None
-        if selected_text_model.startswith("gpt"):
-            text_api_key_to_use = openai_api_key
-        elif selected_text_model.startswith("claude"):
-            text_api_key_to_use = anthropic_api_key
-        elif selected_text_model.startswith("gemini"):
-            text_api_key_to_use = google_api_key
-        
-        # テスト用ダミーデータ (テキスト生成) - APIキーがない場合
-        if not text_api_key_to_use and not (selected_text_model.startswith("gemini") and google_api_key): # Geminiはキーがなくてもgenai.configureされるため別途判定
-             if selected_text_model != "dummy": # "dummy" モデル選択時以外でキーがない場合
-                print(f"Warning: API key for {selected_text_model} not found. Text generation might fail or use defaults.")
-                # ここでエラーを返すか、ダミーデータを返すかは設計次第
-                # 今回はget_ai_clientやAPI呼び出しでエラーになることを許容
-
-
-        # 文字数制限を取得（管理画面の設定を優先）
-        if app_settings.limits:
-            limit_personality = app_settings.limits.get("personality", "100")
-            limit_reason = app_settings.limits.get("reason", "100")
-            limit_behavior = app_settings.limits.get("behavior", "100")
-            limit_reviews = app_settings.limits.get("reviews", "100")
-            limit_values = app_settings.limits.get("values", "100")
-            limit_demands = app_settings.limits.get("demands", "100")
-        else:
-            # フォールバック：環境変数から取得
-            limit_personality = os.environ.get("LIMIT_PERSONALITY", "100")
-            limit_reason = os.environ.get("LIMIT_REASON", "100")
-            limit_behavior = os.environ.get("LIMIT_BEHAVIOR", "100")
-            limit_reviews = os.environ.get("LIMIT_REVIEWS", "100")
-            limit_values = os.environ.get("LIMIT_VALUES", "100")
-            limit_demands = os.environ.get("LIMIT_DEMANDS", "100")
-        
-        # RAGデータベースは起動時に一度だけ初期化されているので、ここでは不要
-        # rag_processor.init_rag_database()  # コメントアウト - 遅延読み込みのため不要
-        
-        # RAGデータの検索
-        rag_context = ""
-        rag_results = []
-        department = data.get('department')
-        age = data.get('age')
-        gender = data.get('gender')
-        chief_complaint = data.get('chief_complaint')  # 主訴を取得
         
-        if department:
-            # 年齢グループの判定
-            age_group = None
-            if age:
-                try:
-                    age_str = str(age)
-                    # 年齢を数値に変換
-                    if 'y' in age_str:
-                        # "45y3m" -> 45
-                        age_num = int(age_str.split('y')[0])
-                    elif age_str.isdigit():
-                        # "45" -> 45
-                        age_num = int(age_str)
-                    else:
-                        age_num = None
-                    
-                    if age_num is not None:
-                        if age_num < 20:
-                            age_group = "10s"
-                        elif age_num < 30:
-                            age_group = "20s"
-                        elif age_num < 40:
-                            age_group = "30s"
-                        elif age_num < 50:
-                            age_group = "40s"
-                        elif age_num < 60:
-                            age_group = "50s"
-                        elif age_num < 70:
-                            age_group = "60s"
-                        else:
-                            age_group = "70s"
-                except (ValueError, AttributeError):
-                    print(f"Warning: Could not parse age '{age}' for RAG search")
+        rag_results = rag_search(
+            specialty=department,
+            age_group=age_group,
+            gender=gender,
+            chief_complaint=chief_complaint,  # 主訴を追加
+            limit=5
+        )
+        print(f"[RAG] Search completed: {len(rag_results)} results found")
+        
+        if rag_results:
+            rag_context = _build_rag_context(department, chief_complaint, rag_results)
             
-            # RAGデータの検索（主訴を含めて検索）
+            # RAGデータ使用の詳細ログ
             print("="*60)
-            print("[RAG] ===== STARTING RAG DATA SEARCH =====")
-            print(f"[RAG] Department: {department}")
-            print(f"[RAG] Chief Complaint: {chief_complaint}")
-            print(f"[RAG] Age Group: {age_group}")
-            print(f"[RAG] Gender: {gender}")
+            print("[RAG] ===== RAG DATA SUCCESSFULLY LOADED =====")
+            print(f"[RAG] Using data for:")
+            print(f"[RAG]   - Department: {department}")
+            print(f"[RAG]   - Chief Complaint: {chief_complaint if chief_complaint else 'Not specified'}")
+            print(f"[RAG]   - Age Group: {age_group if age_group else 'All ages'}")
+            print(f"[RAG]   - Gender: {gender if gender else 'All genders'}")
+            print(f"[RAG] Top {len(rag_results)} Keywords Found:")
+            for i, result in enumerate(rag_results, 1):
+                print(f"[RAG]   {i}. {result['keyword']} (検索数: {result['search_volume']}人)")
+            print("[RAG] This data will be included in the AI prompt")
             print("="*60)
-            
-            rag_results = rag_processor.search_rag_data(
-                specialty=department,
-                age_group=age_group,
-                gender=gender,
-                chief_complaint=chief_complaint,  # 主訴を追加
-                limit=5
-            )
-            print(f"[RAG] Search completed: {len(rag_results)} results found")
-            
-            if rag_results:
-                rag_context = "\n\n# 参考情報（この診療科・主訴の患者が検索するキーワード）\n"
-                if chief_complaint:
-                    rag_context += f"以下は、{department}で「{chief_complaint}」に関連し、同じ年代・性別の患者がよく検索するキーワードです。ペルソナ作成の参考にしてください：\n"
-                else:
-                    rag_context += "以下は、同じ診療科・年代・性別の患者がよく検索するキーワードです。ペルソナ作成の参考にしてください：\n"
-                for i, result in enumerate(rag_results, 1):
-                    rag_context += f"{i}. {result['keyword']} (検索数: {result['search_volume']}人)\n"
-                    # カテゴリーフィールドは削除（CSVに存在しないため）
-                
-                # RAGデータ使用の詳細ログ
-                print("="*60)
-                print("[RAG] ===== RAG DATA SUCCESSFULLY LOADED =====")
-                print(f"[RAG] Using data for:")
-                print(f"[RAG]   - Department: {department}")
-                print(f"[RAG]   - Chief Complaint: {chief_complaint if chief_complaint else 'Not specified'}")
-                print(f"[RAG]   - Age Group: {age_group if age_group else 'All ages'}")
-                print(f"[RAG]   - Gender: {gender if gender else 'All genders'}")
-                print(f"[RAG] Top {len(rag_results)} Keywords Found:")
-                for i, result in enumerate(rag_results, 1):
-                    print(f"[RAG]   {i}. {result['keyword']} (検索数: {result['search_volume']}人)")
-                print("[RAG] This data will be included in the AI prompt")
-                print("="*60)
-            else:
-                print("="*60)
-                print(f"[RAG] ⚠️ WARNING: No RAG data found")
-                print(f"[RAG] Searched for: {department} / {chief_complaint}")
-                print("[RAG] Proceeding without RAG context")
-                print("="*60)
-        
-        # RAGデータベース情報を追加（フロントエンドで表示するため）
-        rag_info = {
-            "database_path": str(rag_processor.RAG_DB_PATH),
-            "is_local": "app_settings" in str(rag_processor.RAG_DB_PATH),
-            "results_count": len(rag_results) if rag_results else 0,
-            "department": department
-        }
-        
-        # 入力データの内容をログ出力
-        print(f"[DEBUG] Input data keys: {list(data.keys())}")
-        print(f"[DEBUG] Input data sample:")
-        for key in ['department', 'purpose', 'name', 'gender', 'age', 'occupation']:
-            if key in data:
-                print(f"  - {key}: {data[key]}")
-        
-        # プロンプト構築（RAGコンテキストを含む）
-        char_limits = {
-            "personality": limit_personality,
-            "reason": limit_reason,
-            "behavior": limit_behavior,
-            "reviews": limit_reviews,
-            "values": limit_values,
-            "demands": limit_demands
-        }
+        else:
+            print("="*60)
+            print(f"[RAG] ⚠️ WARNING: No RAG data found")
+            print(f"[RAG] Searched for: {department} / {chief_complaint}")
+            print("[RAG] Proceeding without RAG context")
+            print("="*60)
+    
+    # RAGデータベース情報を追加（フロントエンドで表示するため）
+    rag_info = {
+        "database_path": str(rag_processor.active_database_path()),
+        "is_local": "app_settings" in str(rag_processor.active_database_path()),
+        "results_count": len(rag_results) if rag_results else 0,
+        "department": department
+    }
+    
+    # 入力データの内容をログ出力
+    print(f"[DEBUG] Input data keys: {list(data.keys())}")
+    print(f"[DEBUG] Input data sample:")
+    for key in ['department', 'purpose', 'name', 'gender', 'age', 'occupation']:
+        if key in data:
+            print(f"  - {key}: {data[key]}")
+    
+    # プロンプト構築（RAGコンテキストを含む）
+    char_limits = {
+        "personality": limit_personality,
+        "reason": limit_reason,
+        "behavior": limit_behavior,
+        "reviews": limit_reviews,
+        "values": limit_values,
+        "demands": limit_demands
+    }
+    prompt_prefix = None
+    if PROMPT_PREFIX_CACHING:
+        # 共通部分を先頭に置き、入力情報は末尾に置く（プロバイダー側でプレフィックスがキャッシュされる）
+        prompt_prefix, prompt_text = build_cacheable_prompt(data, char_limits, rag_context)
+    else:
         # build_prompt関数を使用（主訴対応済み）
         prompt_text = build_prompt(
             data,
@@ -1167,43 +1123,293 @@ async def generate_persona(request: Request, username: str = Depends(verify_any_
             limit_demands=str(char_limits["demands"]),
             rag_context=rag_context
         )
-        
-        
-        # ===== 非同期処理開始 =====
-        # 画像生成タスクを先に開始（バックグラウンドで実行）
-        image_start_time = time.time()
-        print("[Async] Starting image generation task in background")
-        image_generation_task = asyncio.create_task(
-            generate_image_async(
-                data=data,
-                selected_image_model=selected_image_model,
-                openai_api_key=openai_api_key,
-                google_api_key=google_api_key
+    
+    section_prefix, section_prompts = None, None
+    if data.get("section_parallel", SECTION_PARALLEL_ENABLED):
+        section_prefix, section_prompts = build_section_prompts(data, char_limits, rag_context)
+    
+    # AIクライアント初期化 (テキスト生成用)
+    text_generation_client = None
+    client_init_error = None
+    if text_api_key_to_use or (selected_text_model.startswith("gemini") and google_api_key):
+        try:
+            text_generation_client = get_ai_client(selected_text_model, text_api_key_to_use)
+        except Exception as e:
+            client_init_error = str(e)
+    
+    # 生成キャッシュ（bypass_cacheは管理者のみ有効）
+    cache_key = generation_cache.make_cache_key(prompt_text, selected_text_model, char_limits)
+    bypass_cache = bool(data.get("bypass_cache")) and is_admin_username(username)
+    
+    return {
+        "selected_text_model": selected_text_model,
+        "selected_image_model": selected_image_model,
+        "openai_api_key": openai_api_key,
+        "google_api_key": google_api_key,
+        "text_api_key_to_use": text_api_key_to_use,
+        "char_limits": char_limits,
+        "rag_context": rag_context,
+        "rag_info": rag_info,
+        "prompt_text": prompt_text,
+        "prompt_prefix": prompt_prefix,
+        "section_prefix": section_prefix,
+        "section_prompts": section_prompts,
+        "text_generation_client": text_generation_client,
+        "client_init_error": client_init_error,
+        "cache_key": cache_key,
+        "bypass_cache": bypass_cache,
+        # バッチ生成時のプロバイダーごとの同時実行数制限（asyncio.Semaphore）
+        "text_limit": None,
+        "image_limit": None
+    }
+
+async def lookup_cached_generation(generation):
+    """キャッシュ済みの生成テキストを取得（バイパス指定時・未登録時はNone。SQLiteの読み込みはイベントループ外で行う）"""
+    if generation["bypass_cache"]:
+        print("[GenCache] Cache bypassed by admin request")
+        return None
+    cached_text = await offload.run_io(generation_cache.get, generation["cache_key"])
+    if cached_text:
+        print(f"[GenCache] Cache hit: {generation['cache_key'][:12]}")
+    return cached_text
+
+def is_complete_persona_text(text):
+    """6つのセクションがすべて見出し付きで揃っているか（ログを出さずに判定）"""
+    if not text:
+        return False
+    parser = PersonaSectionParser()
+    for line in text.strip().split('\n'):
+        parser.feed_line(line)
+    return all(parser.sections.values())
+
+async def store_generation(generation, generated_text_str):
+    """全セクションが揃った生成結果のみキャッシュに保存（SQLiteの書き込みはイベントループ外で行う）"""
+    if is_complete_persona_text(generated_text_str):
+        await offload.run_io(
+            generation_cache.set, generation["cache_key"], generation["selected_text_model"], generated_text_str
+        )
+
+def _text_flight(generation):
+    """テキスト生成のsingle-flightキーと、他Workerの結果を取得する関数"""
+    cache_key = generation["cache_key"]
+    peer_result = (lambda: generation_cache.get(cache_key)) if generation_cache.CACHE_ENABLED else None
+    return f"text:{cache_key}", peer_result
+
+def merge_section_group_texts(group_texts):
+    """
+    グループごとの生成テキストから担当項目だけを取り出し、1回で生成した場合と同じ形式に並べる
+    
+    Args:
+        group_texts: [(SECTION_GROUPS の要素, 生成テキスト), ...]
+    
+    Returns:
+        str: 6項目形式のテキスト（1項目も取り出せなければNone）
+    """
+    sections = {}
+    for group, text in group_texts:
+        parser = PersonaSectionParser()
+        for line in (text or "").split("\n"):
+            parser.feed_line(line)
+        for section in group:
+            if parser.sections[section]:
+                sections[section] = parser.sections[section]
+    if not sections:
+        return None
+    return "\n".join(
+        f"{header}: {sections[section]}" for section, header in PROMPT_SECTION_HEADERS.items() if section in sections
+    )
+
+def _generate_section_group(generation, index):
+    return generate_text_response(
+        generation["section_prompts"][index], generation["selected_text_model"],
+        generation["text_api_key_to_use"], generation["section_prefix"]
+    )
+
+async def generate_sections_parallel(generation):
+    """SECTION_GROUPS ごとの呼び出しを並列に実行し、結果を6項目形式にまとめる"""
+    tasks = [asyncio.create_task(_generate_section_group(generation, index)) for index in range(len(SECTION_GROUPS))]
+    try:
+        texts = await asyncio.gather(*tasks)
+    finally:
+        # 1つが失敗（プロバイダー障害）・キャンセルされた場合は残りの呼び出しも止める
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+    return merge_section_group_texts(zip(SECTION_GROUPS, texts))
+
+async def iter_section_groups(generation):
+    """SECTION_GROUPS ごとの呼び出しを並列に実行し、完了した順に (グループ, 生成テキスト) を返す"""
+    async def run(index):
+        return SECTION_GROUPS[index], await _generate_section_group(generation, index)
+    
+    tasks = [asyncio.create_task(run(index)) for index in range(len(SECTION_GROUPS))]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+async def generate_persona_text(generation):
+    """
+    ペルソナ本文を生成する
+    同じプロンプトの同時リクエストは1回のAPI呼び出しにまとめ、結果を共有する
+    """
+    async def compute():
+        if generation["section_prompts"]:
+            generated_text_str = await generate_sections_parallel(generation)
+        else:
+            generated_text_str = await generate_text_response(
+                generation["prompt_text"], generation["selected_text_model"], generation["text_api_key_to_use"],
+                generation["prompt_prefix"]
             )
+        # 他Workerの待機側がキャッシュから取得できるよう、ロック解放前に保存する
+        await store_generation(generation, generated_text_str)
+        return generated_text_str
+    
+    if generation["bypass_cache"]:
+        return await _with_limit(generation["text_limit"], compute)
+    flight_key, peer_result = _text_flight(generation)
+    return await single_flight.coalesce(
+        flight_key, lambda: _with_limit(generation["text_limit"], compute), peer_result
+    )
+
+async def _with_limit(limit, factory):
+    """同時実行数制限（Semaphore）がある場合は枠を取得してから実行する"""
+    if limit is None:
+        return await factory()
+    async with limit:
+        return await factory()
+
+def _image_flight_key(data, generation):
+    """画像生成の入力（モデル・年齢・性別・職業）から single-flight キーを作成"""
+    image_inputs = json.dumps({
+        "model": generation["selected_image_model"],
+        "age": data.get("age"),
+        "gender": data.get("gender"),
+        "occupation": data.get("occupation"),
+    }, ensure_ascii=False, sort_keys=True)
+    return "image:" + hashlib.sha256(image_inputs.encode("utf-8")).hexdigest()
+
+def start_image_generation(data, generation):
+    """画像生成タスクを開始（バックグラウンドで実行）"""
+    print("[Async] Starting image generation task in background")
+    # 同じ入力の画像生成はWorker内で1回にまとめる
+    return asyncio.create_task(
+        single_flight.coalesce(
+            _image_flight_key(data, generation),
+            lambda: _with_limit(generation["image_limit"], lambda: generate_image_async(
+                data=data,
+                selected_image_model=generation["selected_image_model"],
+                openai_api_key=generation["openai_api_key"],
+                google_api_key=generation["google_api_key"]
+            ))
         )
-        
-        # AIクライアント初期化 (テキスト生成用)
-        text_generation_client = None
-        client_init_error = None
-        if text_api_key_to_use or (selected_text_model.startswith("gemini") and google_api_key):
-            try:
-                text_generation_client = get_ai_client(selected_text_model, text_api_key_to_use)
-            except Exception as e:
-                client_init_error = str(e)
-        
+    )
+
+async def wait_for_image(image_generation_task, image_start_time):
+    """画像生成の完了を待つ（失敗時はエラー用プレースホルダー）"""
+    import time
+    print("[Async] Waiting for image generation to complete")
+    try:
+        image_url = await image_generation_task
+        image_time = time.time() - image_start_time
+        print(f"[Async] Image generation completed successfully")
+        print(f"[PERF] Image generation time: {image_time:.2f} seconds")
+    except Exception as e:
+        print(f"[Async] Image generation task failed: {e}")
+        traceback.print_exc()
+        image_url = "https://placehold.jp/300x200/FF0000/FFFFFF?text=Async+Error"
+    return image_url
+
+def _generation_error_details(e, selected_text_model=None):
+    """生成エンドポイント共通のエラー内容（HTTPステータスコード, レスポンス本文）を作成"""
+    # エラーメッセージの詳細化
+    error_message = f"サーバーエラー: {str(e)}"
+    error_details = {
+        "error": error_message,
+        "error_type": type(e).__name__
+    }
+    
+    # HTTPステータスコードがある場合は502として返す
+    status_code = 500
+    if hasattr(e, 'status_code'):
+        if e.status_code == 502:
+            status_code = 502
+            error_details["error"] = "AI API サービスへの接続に失敗しました。しばらく待ってから再度お試しください。"
+            error_details["original_error"] = str(e)
+    
+    # プロバイダーのサーキットが開いている（障害中）
+    if isinstance(e, ai_providers.CircuitOpenError):
+        status_code = 503
+        error_details["error"] = "AI APIサービスが一時的に利用できません。しばらく待ってから再度お試しください。"
+        error_details["retry_after"] = round(e.retry_after)
+    
+    # Claude固有のエラーメッセージ
+    if selected_text_model and "claude" in selected_text_model.lower():
+        if "APIConnectionError" in str(e) or "Connection error" in str(e):
+            error_details["error"] = "Claude APIへの接続に失敗しました。Renderの無料プランを使用している場合、サービスがスピンダウンしている可能性があります。"
+            error_details["model"] = selected_text_model
+            error_details["suggestion"] = "数秒後に再試行するか、他のモデル（GPT、Gemini）を使用してください。"
+            error_details["render_note"] = "Renderの無料プランでは15分間アイドル後にサービスが停止し、次回リクエスト時に30-60秒の起動時間が必要です。"
+        elif "502" in str(e) or "Bad Gateway" in str(e):
+            error_details["error"] = "Claude APIのゲートウェイエラーが発生しました。"
+            error_details["model"] = selected_text_model
+            error_details["suggestion"] = "APIサービスが一時的に利用できない可能性があります。"
+    
+    return status_code, error_details
+
+def _generation_error_response(e, selected_text_model=None):
+    """生成エンドポイント共通のエラーレスポンスを作成"""
+    status_code, error_details = _generation_error_details(e, selected_text_model)
+    return JSONResponse(
+        status_code=status_code,
+        content=error_details
+    )
+
+async def run_persona_generation(data, username=None, generation=None):
+    """
+    ペルソナを1件生成する（RAG検索・テキスト生成・画像生成）
+    
+    /api/generate の同期モードとジョブキューで共有する
+    generation を省略した場合は prepare_persona_generation から行う
+    
+    Returns:
+        dict: profile / details / image_url / rag_info / cache_hit を含むレスポンスデータ
+    """
+    import time
+    request_start_time = time.time()
+    print("="*60)
+    print(f"[PERF] Request started at {time.strftime('%H:%M:%S')}")
+    print("="*60)
+    
+    if generation is None:
+        generation = await offload.run_io(prepare_persona_generation, data, username)
+    selected_text_model = generation["selected_text_model"]
+    text_api_key_to_use = generation["text_api_key_to_use"]
+    prompt_text = generation["prompt_text"]
+    
+    # ===== 非同期処理開始 =====
+    # 画像生成タスクを先に開始（バックグラウンドで実行）
+    image_start_time = time.time()
+    image_generation_task = start_image_generation(data, generation)
+    
+    try:
         # テキスト生成実行（画像生成と並列）
         text_start_time = time.time()
         print("="*60)
         print(f"[AI] ===== STARTING TEXT GENERATION =====")
         print(f"[AI] Model: {selected_text_model}")
-        print(f"[AI] RAG Context: {'Yes' if rag_context else 'No'}")
+        print(f"[AI] RAG Context: {'Yes' if generation['rag_context'] else 'No'}")
         print(f"[AI] Prompt Length: {len(prompt_text)} characters")
         print("="*60)
-        
-        generated_text_str = None
-        if text_generation_client:
+    
+        generated_text_str = await lookup_cached_generation(generation)
+        cache_hit = generated_text_str is not None
+        if not cache_hit and generation["text_generation_client"]:
             try:
-                generated_text_str = await generate_text_response(prompt_text, selected_text_model, text_api_key_to_use)
+                generated_text_str = await generate_persona_text(generation)
                 text_time = time.time() - text_start_time
                 print("="*60)
                 print(f"[AI] ✓ Text generation completed successfully")
@@ -1216,92 +1422,468 @@ async def generate_persona(request: Request, username: str = Depends(verify_any_
                 print(f"[AI] Error type: {type(e).__name__}")
                 print(f"[AI] Error message: {e}")
                 print("="*60)
+                # プロバイダー障害は代替のペルソナで返さず、呼び出し元で503/502にする
+                if is_provider_unavailable(e):
+                    raise
                 generated_text_str = None
-        
+    
         if generated_text_str is None: # AI生成失敗またはスキップ時のフォールバック
-            error_msg = "Text generation failed or was skipped."
-            if client_init_error:
-                error_msg += f" Client initialization error: {client_init_error}"
-            generated_details = {
-                "personality": "真面目で責任感が強く、家族を大切にする。健康意識が高く、予防医療に関心がある。",
-                "reason": "定期的な健康診断と、軽度の高血圧の管理のため。",
-                "behavior": "3ヶ月に一度の定期検診に欠かさず通院。処方された降圧剤を規則正しく服用している。",
-                "reviews": "医師の説明がわかりやすいこと、待ち時間が短いこと、スタッフの対応が丁寧であることを重視する。",
-                "values": "信頼できる医師との長期的な関係を望む。予防医療に前向きで、医師のアドバイスを真摯に受け止める。",
-                "demands": "わかりやすい説明と、必要に応じて専門医への適切な紹介。予防医療のアドバイスも欲しい。"
-            }
+            generated_details = _fallback_persona_details()
         else:
             # Debug: Log the raw AI response
             print(f"[DEBUG] Raw AI response from {selected_text_model}:")
             print(f"{generated_text_str[:500]}..." if len(generated_text_str) > 500 else generated_text_str)
             generated_details = parse_ai_response(generated_text_str)
-        
+    
         # 画像生成の完了を待つ
-        print("[Async] Waiting for image generation to complete")
-        try:
-            image_url = await image_generation_task
-            image_time = time.time() - image_start_time
-            print(f"[Async] Image generation completed successfully")
-            print(f"[PERF] Image generation time: {image_time:.2f} seconds")
-        except Exception as e:
-            print(f"[Async] Image generation task failed: {e}")
-            traceback.print_exc()
-            image_url = "https://placehold.jp/300x200/FF0000/FFFFFF?text=Async+Error"
-        
-        # ===== 非同期処理完了 =====
-        print(f"[Async] Both text and image generation completed")
-        
-        # レスポンスデータ作成
-        response_data = {
-            "profile": data, # フロントから送られてきた入力データをそのまま返す
-            "details": generated_details,
-            "image_url": image_url, # DALL-EならURL、GeminiならBase64 Data URI
-            "rag_info": rag_info if 'rag_info' in locals() else None # RAGデータベース情報
-        }
+        image_url = await wait_for_image(image_generation_task, image_start_time)
+    finally:
+        # 呼び出し元がキャンセルされた場合（バッチ中止・クライアント切断）は画像生成も中止する
+        if not image_generation_task.done():
+            image_generation_task.cancel()
+    
+    # ===== 非同期処理完了 =====
+    print(f"[Async] Both text and image generation completed")
+    
+    # レスポンスデータ作成
+    response_data = {
+        "profile": data, # フロントから送られてきた入力データをそのまま返す
+        "details": generated_details,
+        "image_url": image_url, # /api/images/{hash}（保存できなかった場合はBase64 Data URI）
+        "rag_info": generation["rag_info"], # RAGデータベース情報
+        "cache_hit": cache_hit
+    }
+    
+    # パフォーマンス測定
+    total_time = time.time() - request_start_time
+    print("="*60)
+    print(f"[PERF] ===== REQUEST COMPLETED =====")
+    print(f"[PERF] Total time: {total_time:.2f} seconds")
+    print(f"[PERF] Completed at {time.strftime('%H:%M:%S')}")
+    print("="*60)
+    
+    return response_data
+
+job_queue.register_handler("persona", run_persona_generation)
+
+@app.post("/api/generate")
+async def generate_persona(request: Request, username: str = Depends(verify_any_credentials)):
+    """
+    ペルソナを生成する
+    
+    "mode": "job" を指定した場合は生成をジョブキューに登録してジョブIDを即座に返す。
+    結果は GET /api/jobs/{job_id} または GET /api/jobs/{job_id}/events（SSE）で取得する。
+    """
+    selected_text_model = None
+    try:
+        data = await request.json()
         
-        # パフォーマンス測定
-        total_time = time.time() - request_start_time
-        print("="*60)
-        print(f"[PERF] ===== REQUEST COMPLETED =====")
-        print(f"[PERF] Total time: {total_time:.2f} seconds")
-        print(f"[PERF] Completed at {time.strftime('%H:%M:%S')}")
-        print("="*60)
+        if data.get("mode") == "job":
+            payload = {key: value for key, value in data.items() if key != "mode"}
+            job_id = await job_queue.submit("persona", payload, username)
+            return JSONResponse(
+                status_code=202,
+                content={
+                    "job_id": job_id,
+                    "status": job_queue.QUEUED,
+                    "status_url": f"/api/jobs/{job_id}",
+                    "events_url": f"/api/jobs/{job_id}/events"
+                }
+            )
         
-        return response_data
+        # 設定ファイルの読み込み・RAG検索を含むためイベントループ外で実行
+        generation = await offload.run_io(prepare_persona_generation, data, username)
+        selected_text_model = generation["selected_text_model"]
+        return await _run_until_disconnected(request, run_persona_generation(data, username, generation))
 
     except Exception as e:
-        
-        # エラーメッセージの詳細化
-        error_message = f"サーバーエラー: {str(e)}"
-        error_details = {
-            "error": error_message,
-            "error_type": type(e).__name__
+        return _generation_error_response(e, selected_text_model)
+
+DISCONNECT_CHECK_INTERVAL = float(os.getenv("DISCONNECT_CHECK_INTERVAL", "1.0"))
+
+async def _run_until_disconnected(request, coro):
+    """クライアントが切断したら処理を中止する（待ち行列中・生成中の画像生成もキャンセルされる）"""
+    task = asyncio.create_task(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_CHECK_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                print("[Async] Client disconnected, cancelling generation")
+                task.cancel()
+                return Response(status_code=499)
+    finally:
+        if not task.done():
+            task.cancel()
+
+async def _get_owned_job(job_id, username):
+    """ジョブを取得（投入したユーザーと管理者のみ参照可）"""
+    job = await job_queue.get_job_async(job_id)
+    if job is None or (job["username"] != username and not is_admin_username(username)):
+        raise HTTPException(status_code=404, detail="Job not found")
+    job.pop("username", None)
+    return job
+
+@app.get("/api/jobs/{job_id}")
+async def get_generation_job(job_id: str, username: str = Depends(verify_any_credentials)):
+    """生成ジョブの状態（完了時は result に /api/generate と同じレスポンスデータ）"""
+    return await _get_owned_job(job_id, username)
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_generation_job(job_id: str, username: str = Depends(verify_any_credentials)):
+    """
+    生成ジョブの状態を Server-Sent Events で通知する
+    
+    イベント:
+        status  - 状態・待ち順が変わるたびに送信
+        result  - 成功時のレスポンスデータ
+        error   - 失敗時のエラー
+        done    - 通知終了
+    """
+    job = await _get_owned_job(job_id, username)
+    
+    async def event_stream():
+        current = job
+        last_status = None
+        while True:
+            status = (current["status"], current["queue_position"])
+            if status != last_status:
+                last_status = status
+                yield _sse_event("status", {"status": current["status"], "queue_position": current["queue_position"]})
+            if current["status"] == job_queue.SUCCEEDED:
+                yield _sse_event("result", current["result"])
+                break
+            if current["status"] == job_queue.FAILED:
+                yield _sse_event("error", current["error"])
+                break
+            await asyncio.sleep(job_queue.POLL_INTERVAL)
+            current = await job_queue.get_job_async(job_id)
+            if current is None:
+                yield _sse_event("error", {"error": "Job expired"})
+                break
+        yield _sse_event("done", {"job_id": job_id})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/images/{image_hash}")
+async def get_stored_image(image_hash: str, request: Request, username: str = Depends(verify_any_credentials)):
+    """
+    生成画像を配信する（内容のハッシュがURLなので変更されず、ブラウザに無期限でキャッシュさせる）
+    
+    Acceptヘッダーが image/webp を含む場合はWebP版を返す
+    """
+    if request.headers.get("if-none-match") == f'"{image_hash}"':
+        return Response(status_code=304, headers={"ETag": f'"{image_hash}"'})
+    prefer_webp = "image/webp" in request.headers.get("accept", "")
+    path, media_type = image_store.resolve(image_hash, prefer_webp=prefer_webp)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return FileResponse(
+        path,
+        media_type=media_type,
+        headers={
+            "Cache-Control": "private, max-age=31536000, immutable",
+            "ETag": f'"{image_hash}"',
+            "Vary": "Accept",
         }
-        
-        # HTTPステータスコードがある場合は502として返す
-        status_code = 500
-        if hasattr(e, 'status_code'):
-            if e.status_code == 502:
-                status_code = 502
-                error_details["error"] = "AI API サービスへの接続に失敗しました。しばらく待ってから再度お試しください。"
-                error_details["original_error"] = str(e)
-        
-        # Claude固有のエラーメッセージ
-        if 'selected_text_model' in locals() and selected_text_model and "claude" in selected_text_model.lower():
-            if "APIConnectionError" in str(e) or "Connection error" in str(e):
-                error_details["error"] = "Claude APIへの接続に失敗しました。Renderの無料プランを使用している場合、サービスがスピンダウンしている可能性があります。"
-                error_details["model"] = selected_text_model
-                error_details["suggestion"] = "数秒後に再試行するか、他のモデル（GPT、Gemini）を使用してください。"
-                error_details["render_note"] = "Renderの無料プランでは15分間アイドル後にサービスが停止し、次回リクエスト時に30-60秒の起動時間が必要です。"
-            elif "502" in str(e) or "Bad Gateway" in str(e):
-                error_details["error"] = "Claude APIのゲートウェイエラーが発生しました。"
-                error_details["model"] = selected_text_model
-                error_details["suggestion"] = "APIサービスが一時的に利用できない可能性があります。"
-        
+    )
+
+def _sse_event(event, payload):
+    """Server-Sent Events 形式の1イベントを作成"""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+@app.post("/api/generate/stream")
+async def generate_persona_stream(request: Request, username: str = Depends(verify_any_credentials)):
+    """
+    /api/generate のストリーミング版（Server-Sent Events）
+    
+    イベント:
+        meta     - 入力プロファイルとRAG情報（最初に送信）
+        section  - 6つのセクションが確定するたびに {"name", "content"} を送信
+        details  - 全セクションの最終結果
+        image    - 画像生成完了時に {"image_url"} を送信
+        error    - テキスト生成のエラー
+        done     - 処理完了（合計時間）
+    """
+    import time
+    request_start_time = time.time()
+    print(f"[PERF] Streaming request started at {time.strftime('%H:%M:%S')}")
+    
+    selected_text_model = None
+    try:
+        data = await request.json()
+        generation = await offload.run_io(prepare_persona_generation, data, username)
+        selected_text_model = generation["selected_text_model"]
+    except Exception as e:
+        return _generation_error_response(e, selected_text_model)
+    
+    text_api_key_to_use = generation["text_api_key_to_use"]
+    prompt_text = generation["prompt_text"]
+    
+    async def event_stream():
+        image_start_time = time.time()
+        image_generation_task = start_image_generation(data, generation)
+        image_sent = False
+        try:
+            cached_text = await lookup_cached_generation(generation)
+            yield _sse_event("meta", {"profile": data, "rag_info": generation["rag_info"], "cache_hit": cached_text is not None})
+            
+            parser = StreamingSectionParser()
+            if cached_text is not None:
+                for name, content in parser.feed(cached_text) + parser.finish():
+                    yield _sse_event("section", {"name": name, "content": content})
+            elif generation["text_generation_client"]:
+                text_start_time = time.time()
+                # 同じプロンプトを生成中のリクエストがあれば、その結果を共有してもらう
+                flight, shared_text = None, None
+                if not generation["bypass_cache"]:
+                    flight_key, peer_result = _text_flight(generation)
+                    flight, shared_text = await single_flight.join(flight_key, peer_result)
+                if flight is None and shared_text:
+                    for name, content in parser.feed(shared_text):
+                        yield _sse_event("section", {"name": name, "content": content})
+                else:
+                    try:
+                        if generation["section_prompts"]:
+                            # セクション並列生成: 完了したグループのセクションから順に送信
+                            async for group, group_text in iter_section_groups(generation):
+                                merged_text = merge_section_group_texts([(group, group_text)])
+                                if merged_text:
+                                    for name, content in parser.feed_complete(merged_text):
+                                        yield _sse_event("section", {"name": name, "content": content})
+                                if not image_sent and image_generation_task.done():
+                                    image_url = await wait_for_image(image_generation_task, image_start_time)
+                                    image_sent = True
+                                    yield _sse_event("image", {"image_url": image_url})
+                        else:
+                            first_chunk_time = None
+                            try:
+                                async for chunk in ai_providers.stream_text(prompt_text, selected_text_model, text_api_key_to_use, generation["prompt_prefix"]):
+                                    if first_chunk_time is None:
+                                        first_chunk_time = time.time() - text_start_time
+                                        print(f"[PERF] Time to first token: {first_chunk_time:.2f} seconds")
+                                    for name, content in parser.feed(chunk):
+                                        yield _sse_event("section", {"name": name, "content": content})
+                                    # 画像が先に完成した場合はテキストの途中でも送信
+                                    if not image_sent and image_generation_task.done():
+                                        image_url = await wait_for_image(image_generation_task, image_start_time)
+                                        image_sent = True
+                                        yield _sse_event("image", {"image_url": image_url})
+                            except Exception as e:
+                                print(f"[AI] ✗ Streaming text generation failed: {type(e).__name__}: {e}")
+                                if first_chunk_time is None:
+                                    # 何も受信していない場合は通常生成（フォールバック付き）で再試行
+                                    generated_text_str = await generate_text_response(prompt_text, selected_text_model, text_api_key_to_use, generation["prompt_prefix"])
+                                    if generated_text_str:
+                                        for name, content in parser.feed(generated_text_str):
+                                            yield _sse_event("section", {"name": name, "content": content})
+                                else:
+                                    yield _sse_event("error", {"error": f"テキスト生成が途中で失敗しました: {str(e)}", "error_type": type(e).__name__})
+                    except Exception as e:
+                        # プロバイダー障害（サーキットが開いている・フォールバックも失敗）は /api/generate と同じ内容で返す
+                        print(f"[AI] ✗ Text generation failed: {type(e).__name__}: {e}")
+                        _, error_details = _generation_error_details(e, selected_text_model)
+                        yield _sse_event("error", error_details)
+                    finally:
+                        if flight is not None:
+                            # 待機中のリクエストへ結果を渡す（他Worker向けにキャッシュ保存を先に行う）
+                            # 切断・エラーで途中までしか生成できなかった場合は共有せず、待機側に生成し直してもらう
+                            if is_complete_persona_text(parser.text):
+                                await store_generation(generation, parser.text)
+                                flight.finish(parser.text)
+                            else:
+                                flight.finish(error=single_flight.FlightAbandoned("Streaming leader ended with incomplete text"))
+                for name, content in parser.finish():
+                    yield _sse_event("section", {"name": name, "content": content})
+                print(f"[PERF] Text streaming time: {time.time() - text_start_time:.2f} seconds")
+            
+            generated_text_str = parser.text
+            if not generated_text_str:
+                generated_details = _fallback_persona_details()
+            else:
+                generated_details = parse_ai_response(generated_text_str)
+            yield _sse_event("details", generated_details)
+            
+            if not image_sent:
+                image_url = await wait_for_image(image_generation_task, image_start_time)
+                image_sent = True
+                yield _sse_event("image", {"image_url": image_url})
+            
+            total_time = time.time() - request_start_time
+            print(f"[PERF] Streaming request completed in {total_time:.2f} seconds")
+            yield _sse_event("done", {"total_time": round(total_time, 2)})
+        finally:
+            # クライアント切断時は画像生成も中止する
+            if not image_generation_task.done():
+                image_generation_task.cancel()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+BATCH_MAX_PERSONAS = int(os.getenv("BATCH_MAX_PERSONAS", "50"))
+BATCH_TEXT_CONCURRENCY = int(os.getenv("BATCH_TEXT_CONCURRENCY", "3"))  # テキスト生成のプロバイダーごとの同時実行数
+BATCH_IMAGE_CONCURRENCY = int(os.getenv("BATCH_IMAGE_CONCURRENCY", "2"))  # 画像生成のプロバイダーごとの同時実行数
+
+def _image_provider(model_name):
+    """画像生成モデルのプロバイダー名（同時実行数制限のキー）"""
+    if model_name.startswith(("dall-e", "gpt-image")):
+        return "openai"
+    if model_name.startswith(("gemini", "imagen")):
+        return "google"
+    return model_name
+
+def batch_variation_axes(variations):
+    """
+    バリエーション指定を (項目, 値の一覧) の軸のリストにする
+    
+    例: {"patient_type": "all", "age": ["30", "50", "70"]}
+        → 有効な全患者タイプ × 3つの年齢
+    patient_type に "all" を指定すると config/patient_types.json の有効な患者タイプすべてを使う
+    """
+    axes = []
+    for field, values in (variations or {}).items():
+        if field == "patient_type" and values == "all":
+            values = [pt["value"] for pt in config_loader.load_patient_types()]
+        if not isinstance(values, list):
+            values = [values]
+        if values:
+            axes.append((field, values))
+    return axes
+
+def count_batch_profiles(axes):
+    """展開後のプロフィール数（直積を作らずに各軸の値の数を掛け合わせる）"""
+    count = 1
+    for _, values in axes:
+        count *= len(values)
+    return count
+
+def expand_batch_profiles(base, axes):
+    """基本プロフィールにバリエーション軸（batch_variation_axes の戻り値）の直積を適用したプロフィール一覧を作成する"""
+    profiles = [dict(base)]
+    for field, values in axes:
+        profiles = [{**profile, field: value} for profile in profiles for value in values]
+    return profiles
+
+def _memoized_rag_search():
+    """同じ（診療科・主訴・年代・性別）の検索結果をバッチ内で使い回すRAG検索関数"""
+    results = {}
+    def search(**kwargs):
+        key = tuple(sorted(kwargs.items()))
+        if key not in results:
+            results[key] = rag_processor.search_rag_data(**kwargs)
+        else:
+            print(f"[Batch] Reusing RAG results for {kwargs.get('specialty')} / {kwargs.get('chief_complaint')}")
+        return results[key]
+    return search
+
+@app.post("/api/generate/batch")
+async def generate_persona_batch(request: Request, username: str = Depends(verify_any_credentials)):
+    """
+    複数ペルソナの一括生成（Server-Sent Events）
+    
+    リクエスト:
+        base        - 全ペルソナ共通のプロフィール（/api/generate と同じ形式）
+        variations  - 変化させる項目と値の一覧（直積で展開）
+    
+    イベント:
+        meta     - 展開した件数と各プロフィール
+        persona  - 1件完成するたびに {"index", ...（/api/generate と同じレスポンスデータ）}
+        error    - 1件の生成失敗 {"index", "error", "error_type"}
+        done     - 処理完了（成功・失敗件数、合計時間）
+    
+    設定読み込みと同じ条件のRAG検索はバッチ内で1回だけ行い、テキスト・画像生成は
+    プロバイダーごとに BATCH_TEXT_CONCURRENCY / BATCH_IMAGE_CONCURRENCY 件まで同時に実行する
+    """
+    import time
+    request_start_time = time.time()
+    
+    try:
+        body = await request.json()
+        base = body.get("base") or {}
+        axes = batch_variation_axes(body.get("variations"))
+    except Exception as e:
+        return JSONResponse(status_code=400, content={"error": f"Invalid batch request: {str(e)}"})
+    # 上限を超える場合は直積を展開する前に断る（長い軸の組み合わせで大量のdictを作らない）
+    profile_count = count_batch_profiles(axes)
+    if profile_count > BATCH_MAX_PERSONAS:
         return JSONResponse(
-            status_code=status_code,
-            content=error_details
+            status_code=400,
+            content={"error": f"Too many personas in one batch: {profile_count} (max {BATCH_MAX_PERSONAS})"}
         )
+    profiles = expand_batch_profiles(base, axes)
+    
+    selected_text_model = None
+    try:
+        app_settings = await crud.read_settings_async()
+        rag_search = _memoized_rag_search()
+        limits = {}
+        generations = []
+        for profile in profiles:
+            generation = await offload.run_io(
+                prepare_persona_generation, profile, username, app_settings=app_settings, rag_search=rag_search
+            )
+            selected_text_model = generation["selected_text_model"]
+            try:
+                text_provider = ai_providers.get_provider(selected_text_model)
+            except ValueError:
+                text_provider = selected_text_model
+            image_provider = _image_provider(generation["selected_image_model"])
+            generation["text_limit"] = limits.setdefault(("text", text_provider), asyncio.Semaphore(BATCH_TEXT_CONCURRENCY))
+            generation["image_limit"] = limits.setdefault(("image", image_provider), asyncio.Semaphore(BATCH_IMAGE_CONCURRENCY))
+            generations.append(generation)
+    except Exception as e:
+        return _generation_error_response(e, selected_text_model)
+    
+    print(f"[Batch] Generating {len(profiles)} personas")
+    
+    async def run_one(index):
+        try:
+            return index, await run_persona_generation(profiles[index], username, generations[index]), None
+        except Exception as e:
+            return index, None, e
+    
+    async def event_stream():
+        tasks = [asyncio.create_task(run_one(index)) for index in range(len(profiles))]
+        succeeded = 0
+        try:
+            yield _sse_event("meta", {
+                "count": len(profiles),
+                "profiles": [{"index": index, "profile": profile} for index, profile in enumerate(profiles)]
+            })
+            for next_done in asyncio.as_completed(tasks):
+                index, response_data, error = await next_done
+                if error is None:
+                    succeeded += 1
+                    yield _sse_event("persona", {"index": index, **response_data})
+                else:
+                    print(f"[Batch] Persona {index} failed: {type(error).__name__}: {error}")
+                    yield _sse_event("error", {"index": index, "error": str(error), "error_type": type(error).__name__})
+            total_time = time.time() - request_start_time
+            print(f"[Batch] Completed {succeeded}/{len(profiles)} personas in {total_time:.2f} seconds")
+            yield _sse_event("done", {
+                "succeeded": succeeded,
+                "failed": len(profiles) - succeeded,
+                "total_time": round(total_time, 2)
+            })
+        finally:
+            # クライアント切断時は残りの生成を中止する
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # [削除済み] /api/generate-by-complaintエンドポイントは/api/generateに統合されました
 
@@ -1319,7 +1901,8 @@ async def download_pdf(request: Request, username: str = Depends(verify_any_cred
 
         # PDF生成
         try:
-            pdf_buffer = generate_pdf(data)
+            # CPU負荷が高いため別プロセスで作成（他のリクエストを止めない）
+            pdf_buffer = await offload.run_cpu(generate_pdf, data)
         except Exception as pdf_error:
             print(f"[ERROR] PDF generation failed: {pdf_error}")
             import traceback
@@ -1382,6 +1965,7 @@ async def download_ppt(request: Request, username: str = Depends(verify_any_cred
         # 画像URL
         image_url = data.get('image_url')
         image_path = None
+        image_is_temp = False  # image_path が削除すべき一時ファイルか
         
         # 診療科と目的の取得
         department_val = persona_data.get('department', '-')
@@ -1407,8 +1991,13 @@ async def download_ppt(request: Request, username: str = Depends(verify_any_cred
                 import requests
                 from PIL import Image
                 
+                stored_image_path = await offload.run_io(image_store.local_path, image_url)
+                # 画像ストアの画像の場合（内容で決まるパスで書き換えられないため、コピーせずそのまま使う）
+                if stored_image_path is not None:
+                    image_path = str(stored_image_path)
+                
                 # Data URLの場合
-                if image_url.startswith('data:'):
+                elif image_url.startswith('data:'):
                     # data:image/png;base64,xxxxx の形式から画像データを抽出
                     try:
                         header, base64_data = image_url.split(',', 1)
@@ -1426,13 +2015,16 @@ async def download_ppt(request: Request, username: str = Depends(verify_any_cred
                         with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as temp_file:
                             temp_file.write(image_data)
                             image_path = temp_file.name
+                            image_is_temp = True
                     except (ValueError, base64.binascii.Error) as e:
                         print(f"Error decoding base64 image: {e}")
                         image_path = None
                         
                 # HTTPSやHTTPのURLの場合
                 elif image_url.startswith(('http://', 'https://')):
-                    response = requests.get(image_url, timeout=10, headers={'User-Agent': 'Mozilla/5.0'})
+                    response = await offload.run_io(
+                        requests.get, image_url, timeout=10, headers={'User-Agent': 'Mozilla/5.0'}
+                    )
                     response.raise_for_status()
                     
                     # Content-Typeから拡張子を判定
@@ -1448,6 +2040,7 @@ async def download_ppt(request: Request, username: str = Depends(verify_any_cred
                     with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as temp_file:
                         temp_file.write(response.content)
                         image_path = temp_file.name
+                        image_is_temp = True
                 
             except Exception as e:
                 print(f"Error downloading image: {e}")
@@ -1455,7 +2048,8 @@ async def download_ppt(request: Request, username: str = Depends(verify_any_cred
         
         # PPTX生成
         try:
-            pptx_buffer = generate_ppt(persona_data, image_path, department_text, purpose_text)
+            # CPU負荷が高いため別プロセスで作成（他のリクエストを止めない）
+            pptx_buffer = await offload.run_cpu(generate_ppt, persona_data, image_path, department_text, purpose_text)
         except Exception as ppt_error:
             print(f"[ERROR] PPT generation failed: {ppt_error}")
             import traceback
@@ -1488,8 +2082,8 @@ async def download_ppt(request: Request, username: str = Depends(verify_any_cred
             content={"error": f"Failed to generate PPTX: {str(e)}"}
         )
     finally:
-        # 一時ファイルのクリーンアップ（エラーが発生しても必ず実行）
-        if 'image_path' in locals() and image_path and os.path.exists(image_path):
+        # 一時ファイルのクリーンアップ（エラーが発生しても必ず実行。画像ストアのファイルは削除しない）
+        if 'image_path' in locals() and image_is_temp and image_path and os.path.exists(image_path):
             try:
                 os.unlink(image_path)
             except Exception as e:
@@ -1522,16 +2116,26 @@ async def get_search_timeline(request: Request, username: str = Depends(verify_a
         gender = data.get('gender')
         age = data.get('age')
         
-        # 時系列データを分析
-        result = timeline_analyzer.analyze_search_timeline(
+        # 表示オプション（ヒストグラム・上位k件・項目の絞り込み・散布図の間引き。クエリ文字列でも指定可）
+        # 指定が無ければ全キーワードの全項目を返す
+        view = timeline_analyzer.parse_view_options({**request.query_params, **data})
+        
+        # 時系列データを分析（性別・年代・表示オプションごとに変換済みのJSONをそのまま返す）
+        body = await timeline_analyzer.analyze_search_timeline_json_async(
             department=department,
             chief_complaint=chief_complaint,
             gender=gender,
-            age=age
+            age=age,
+            view=view
         )
         
-        return result
+        return Response(content=body, media_type="application/json")
         
+    except ValueError as e:
+        return JSONResponse(
+            status_code=400,
+            content={"error": str(e)}
+        )
     except Exception as e:
         print(f"Error in search-timeline: {e}")
         return JSONResponse(
@@ -1681,6 +2285,8 @@ async def analyze_search_behavior(request: Request, username: str = Depends(veri
             
         except Exception as ai_error:
             print(f"AI analysis error: {ai_error}")
+            if isinstance(ai_error, ai_providers.CircuitOpenError):
+                return _generation_error_response(ai_error, selected_text_model)
             return JSONResponse(
                 status_code=500,
                 content={"error": f"AI analysis failed: {str(ai_error)}"}
@@ -1984,8 +2590,13 @@ def generate_pdf(data):
             import tempfile
             import os
             
+            stored_image_path = image_store.local_path(image_url)
+            # 画像ストアの画像の場合はローカルファイルを読む
+            if stored_image_path is not None:
+                image_data = stored_image_path.read_bytes()
+                print(f"[DEBUG] Read stored image, size: {len(image_data)} bytes")
             # Data URLの場合の処理
-            if image_url.startswith('data:'):
+            elif image_url.startswith('data:'):
                 # data:image/png;base64,... の形式から画像データを抽出
                 try:
                     header, encoded = image_url.split(',', 1)
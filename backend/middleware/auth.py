@@ -132,3 +132,10 @@ def verify_any_credentials(credentials: HTTPBasicCredentials = Depends(security)
         detail="Incorrect username or password",
         headers={"WWW-Authenticate": "Basic"},
     )
+
+def is_admin_username(username: str) -> bool:
+    """認証済みユーザー名が管理者アカウントかどうかを判定"""
+    if not username:
+        return False
+    admin_username = os.environ.get("ADMIN_USERNAME", "admin")
+    return secrets.compare_digest(username.encode("utf8"), admin_username.encode("utf8"))
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+RAG CSV取り込みのベンチマーク
+rag/各診療科 以下の全CSV（診療科全体・主訴別）を一時DBに取り込み、CSV読み込みとDB書き込みの行数/秒を記録する
+
+Usage:
+    python backend/scripts/benchmark_rag_ingest.py [--output results.json]
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+# プロジェクトのルートディレクトリをPythonパスに追加
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.services import rag_processor
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure RAG CSV ingestion throughput for the full corpus")
+    parser.add_argument("--rag-dir", default=str(project_root / "rag" / "各診療科"), help="RAG CSV root directory")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    base_dir = Path(args.rag_dir)
+    if not base_dir.exists():
+        print(f"RAG directory not found: {base_dir}")
+        sys.exit(1)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # 本番のDBには触れず、一時ディレクトリのDBに取り込む
+        rag_processor.PERSISTENT_DISK_MOUNT_PATH = Path(temp_dir)
+        rag_processor.RAG_DB_PATH = Path(temp_dir) / "rag_data.db"
+        rag_processor.RAG_ARTIFACT_PATH = Path(temp_dir) / "rag_data.prebuilt.db"
+        rag_processor.init_rag_database()
+
+        files = rows = inserted = skipped = failed = 0
+        read_seconds = write_seconds = 0.0
+        for specialty, csv_path in rag_processor.iter_rag_csv_files(base_dir):
+            start = time.perf_counter()
+            df = pd.read_csv(csv_path, encoding='utf-8-sig')
+            read_seconds += time.perf_counter() - start
+
+            start = time.perf_counter()
+            result = rag_processor._save_rag_data_internal(specialty, df, csv_path.name)
+            write_seconds += time.perf_counter() - start
+
+            files += 1
+            rows += len(df)
+            if result["success"]:
+                inserted += result["inserted_count"]
+                skipped += result["skipped_count"]
+            else:
+                failed += 1
+                print(f"  failed: {csv_path}: {result.get('error')}")
+
+    total_seconds = read_seconds + write_seconds
+    results = {
+        "files": files,
+        "rows": rows,
+        "inserted": inserted,
+        "skipped": skipped,
+        "failed_files": failed,
+        "read_seconds": round(read_seconds, 3),
+        "ingest_seconds": round(write_seconds, 3),
+        "total_seconds": round(total_seconds, 3),
+        "ingest_rows_per_second": round(rows / write_seconds) if write_seconds else None,
+        "total_rows_per_second": round(rows / total_seconds) if total_seconds else None,
+    }
+    print(f"Files: {files}  rows: {rows}  inserted: {inserted}  skipped: {skipped}  failed files: {failed}")
+    print(f"CSV read : {read_seconds:7.2f}s")
+    print(f"Ingest   : {write_seconds:7.2f}s  ({results['ingest_rows_per_second']} rows/s)")
+    print(f"Total    : {total_seconds:7.2f}s  ({results['total_rows_per_second']} rows/s)")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+セクション並列生成のベンチマーク
+同じ入力で「6項目を1回で生成」と「3グループを並列に生成」を交互に実行し、所要時間を比較する
+
+Usage:
+    python backend/scripts/benchmark_section_parallel.py [--runs 3] [--model gpt-4.1-2025-04-14]
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# プロジェクトのルートディレクトリをPythonパスに追加
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.main import (
+    SECTION_GROUPS,
+    build_cacheable_prompt,
+    build_section_prompts,
+    is_complete_persona_text,
+    merge_section_group_texts,
+)
+from backend.services import ai_providers, crud
+
+SAMPLE_PROFILE = {
+    "department": "内科",
+    "purpose": "新規患者の獲得",
+    "chief_complaint": "頭痛",
+    "gender": "女性",
+    "age": "42",
+    "occupation": "会社員",
+    "patient_type": "利便性重視型",
+}
+
+
+async def run_single(model_name, api_key, char_limits):
+    prefix, prompt_text = build_cacheable_prompt(SAMPLE_PROFILE, char_limits)
+    start = time.perf_counter()
+    text = await ai_providers.generate_text(prompt_text, model_name, api_key, prefix)
+    return time.perf_counter() - start, text
+
+
+async def run_parallel(model_name, api_key, char_limits):
+    shared_prefix, prompts = build_section_prompts(SAMPLE_PROFILE, char_limits)
+    start = time.perf_counter()
+    texts = await asyncio.gather(*(
+        ai_providers.generate_text(prompt, model_name, api_key, shared_prefix) for prompt in prompts
+    ))
+    elapsed = time.perf_counter() - start
+    return elapsed, merge_section_group_texts(zip(SECTION_GROUPS, texts))
+
+
+def summarize(label, results):
+    times = [elapsed for elapsed, _ in results]
+    complete = sum(1 for _, text in results if is_complete_persona_text(text))
+    chars = statistics.mean(len(text or "") for _, text in results)
+    print(f"{label:<10} median {statistics.median(times):6.2f}s  mean {statistics.mean(times):6.2f}s  "
+          f"min {min(times):6.2f}s  max {max(times):6.2f}s  complete {complete}/{len(results)}  chars {chars:.0f}")
+    return statistics.median(times)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Compare single-call and section-parallel persona generation")
+    parser.add_argument("--runs", type=int, default=3, help="number of runs per mode")
+    parser.add_argument("--model", help="text model (defaults to the admin setting)")
+    args = parser.parse_args()
+
+    settings = crud.read_settings()
+    model_name = args.model or settings.models.text_api_model
+    api_key = ai_providers.get_api_key(model_name)
+    if not api_key:
+        print(f"API key for {model_name} is not set")
+        sys.exit(1)
+    char_limits = {field: str(limit) for field, limit in (settings.limits or {}).items()}
+    for field in ("personality", "reason", "behavior", "reviews", "values", "demands"):
+        char_limits.setdefault(field, "100")
+
+    print(f"Model: {model_name}, runs: {args.runs}")
+    single, parallel = [], []
+    try:
+        for run in range(args.runs):
+            # 実行順による偏りを避けるため交互に先行させる
+            modes = [(single, run_single), (parallel, run_parallel)]
+            if run % 2:
+                modes.reverse()
+            for results, runner in modes:
+                results.append(await runner(model_name, api_key, char_limits))
+                print(f"  run {run + 1} {runner.__name__}: {results[-1][0]:.2f}s")
+    finally:
+        await ai_providers.close_clients()
+
+    single_median = summarize("single", single)
+    parallel_median = summarize("parallel", parallel)
+    print(f"Speedup (median): {single_median / parallel_median:.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
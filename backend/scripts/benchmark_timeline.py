@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+タイムライン分析のベンチマーク
+rag/各診療科 以下の全主訴CSVについて、性別・年代の組み合わせごとに analyze_search_timeline の処理時間を記録する
+（ファイル読み込みは初回のみのため、キャッシュ済みの状態で計測する）
+
+Usage:
+    python backend/scripts/benchmark_timeline.py [--repeat 3] [--output results.json]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# プロジェクトのルートディレクトリをPythonパスに追加
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+from backend.services import timeline_analyzer
+
+DEMOGRAPHICS = [
+    (None, None),
+    ("male", None),
+    ("female", None),
+    ("female", "30代"),
+    ("male", "50代"),
+    (None, "70代以上"),
+]
+
+
+def percentile(values, ratio):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * ratio), len(ordered) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure search timeline analysis latency over the full corpus")
+    parser.add_argument("--rag-dir", default=str(project_root / "rag" / "各診療科"), help="RAG CSV root directory")
+    parser.add_argument("--repeat", type=int, default=3, help="calls per file and demographic")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    files = sorted(Path(args.rag_dir).glob("*/主訴/*_全体.csv"))
+    if not files:
+        print(f"No chief complaint CSV files found under {args.rag_dir}")
+        sys.exit(1)
+
+    timings = []
+    largest = (0, None, 0.0)
+    errors = 0
+    for csv_path in files:
+        department = csv_path.parent.parent.name
+        chief_complaint = csv_path.stem.replace("_全体", "")
+        with contextlib.redirect_stdout(io.StringIO()):
+            # 初回の読み込み（キャッシュへの保存）は計測しない
+            first = timeline_analyzer.analyze_search_timeline(department, chief_complaint)
+        if "error" in first:
+            errors += 1
+            continue
+        file_timings = []
+        for gender, age in DEMOGRAPHICS:
+            for _ in range(args.repeat):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    start = time.perf_counter()
+                    timeline_analyzer.analyze_search_timeline(department, chief_complaint, gender, age)
+                    file_timings.append((time.perf_counter() - start) * 1000)
+        timings.extend(file_timings)
+        rows = first["summary"]["total_keywords"]
+        if rows > largest[0]:
+            largest = (rows, f"{department}/{chief_complaint}", statistics.mean(file_timings))
+
+    results = {
+        "files": len(files),
+        "failed_files": errors,
+        "calls": len(timings),
+        "mean_ms": round(statistics.mean(timings), 3),
+        "p95_ms": round(percentile(timings, 0.95), 3),
+        "max_ms": round(max(timings), 3),
+        "largest_file": {"name": largest[1], "keywords": largest[0], "mean_ms": round(largest[2], 3)},
+    }
+    print(f"Files: {results['files']}  calls: {results['calls']}  failed files: {errors}")
+    print(f"Latency  mean {results['mean_ms']:.2f}ms  p95 {results['p95_ms']:.2f}ms  max {results['max_ms']:.2f}ms")
+    print(f"Largest  {largest[1]} ({largest[0]} keywords): {largest[2]:.2f}ms")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
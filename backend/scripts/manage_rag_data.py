@@ -9,17 +9,20 @@ import os
 from pathlib import Path
 
 # プロジェクトのルートディレクトリをPythonパスに追加
-project_root = Path(__file__).parent.parent
+project_root = Path(__file__).parent.parent.parent
 sys.path.insert(0, str(project_root))
 
-from services.rag_processor import init_rag_database, reload_csv_data
+from backend.services.rag_processor import build_rag_artifact, init_rag_database, reload_csv_data
 
 def main():
     """メイン処理"""
     if len(sys.argv) < 2:
-        print("Usage: python manage_rag_data.py [init|reload]")
+        print("Usage: python manage_rag_data.py [init|reload [--full]|build [--force]]")
         print("  init   - Initialize database and load CSV data")
-        print("  reload - Clear existing data and reload from CSV files")
+        print("  reload - Load new/changed CSV files and remove data for deleted ones")
+        print("           (--full clears all existing data and reloads every CSV file)")
+        print("  build  - Compile all CSV files into the prebuilt read-only database")
+        print("           (skipped when the CSV hashes match; --force always rebuilds)")
         sys.exit(1)
     
     command = sys.argv[1].lower()
@@ -31,12 +34,17 @@ def main():
         
     elif command == "reload":
         print("Reloading RAG data from CSV files...")
-        reload_csv_data()
-        print("Done!")
+        result = reload_csv_data(full="--full" in sys.argv[2:])
+        print(f"Done! {result}")
+        
+    elif command == "build":
+        print("Building prebuilt RAG database from CSV files...")
+        result = build_rag_artifact(force="--force" in sys.argv[2:])
+        print(f"Done! {result}")
             
     else:
         print(f"Unknown command: {command}")
-        print("Use: init or reload")
+        print("Use: init, reload or build")
         sys.exit(1)
 
 if __name__ == "__main__":
@@ -0,0 +1,722 @@
+"""
+AIプロバイダー層
+非同期クライアントをアプリケーションの生存期間中保持し、HTTP接続を再利用する
+"""
+import asyncio
+import math
+import os
+import re
+import socket
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+import httpx
+
+from backend.services import circuit_breaker
+from backend.services.circuit_breaker import CircuitOpenError
+
+try:
+    from openai import AsyncOpenAI
+except ImportError:
+    AsyncOpenAI = None
+
+try:
+    from anthropic import AsyncAnthropic
+except ImportError:
+    AsyncAnthropic = None
+
+# New Gemini SDK (preferred)
+try:
+    from google import genai as google_genai_sdk
+    from google.genai import types as google_genai_types
+except ImportError:
+    google_genai_sdk = None
+    google_genai_types = None
+
+# Old Gemini SDK (fallback)
+try:
+    import google.generativeai as old_gemini_sdk
+except ImportError:
+    old_gemini_sdk = None
+
+REQUEST_TIMEOUT = 120.0  # タイムアウトを120秒に設定
+
+# プロバイダー障害時に順に試すモデル（サーキットが開いているプロバイダーは除外）
+FALLBACK_TEXT_MODELS = [
+    m.strip() for m in os.getenv("FALLBACK_TEXT_MODELS", "gemini-2.0-flash-exp").split(",") if m.strip()
+]
+
+# ヘッジ（遅い応答に対して別モデルへ同じプロンプトを並行送信）の設定
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_SECONDARY_MODEL = os.getenv("HEDGE_SECONDARY_MODEL", "gemini-2.0-flash-exp")
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))  # これ未満は HEDGE_DEFAULT_DELAY を使用
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "30"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "3"))
+LATENCY_WINDOW = 200
+
+# プロバイダーごとのクライアントを (provider, api_key[, model]) 単位で保持
+_clients: Dict[Tuple[str, ...], Any] = {}
+_http_client: Optional[httpx.AsyncClient] = None
+# モデルごとの直近の応答時間（秒）
+_latencies: Dict[str, Deque[float]] = {}
+
+
+def get_provider(model_name: str) -> str:
+    """モデル名からプロバイダー名を判定"""
+    if model_name.startswith(("gpt", "dall-e")):
+        return "openai"
+    if model_name.startswith("claude"):
+        return "anthropic"
+    if model_name.startswith("gemini"):
+        return "google"
+    raise ValueError(f"未対応のモデルです: {model_name}")
+
+
+def get_api_key(model_name: str) -> str:
+    """モデルに対応するAPIキーを環境変数から取得"""
+    env_name = {
+        "openai": "OPENAI_API_KEY",
+        "anthropic": "ANTHROPIC_API_KEY",
+        "google": "GOOGLE_API_KEY",
+    }[get_provider(model_name)]
+    return os.environ.get(env_name, "").strip()
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """全プロバイダーで共有するHTTPクライアント（コネクションプール）を取得"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(REQUEST_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("AI_HTTP_MAX_CONNECTIONS", "100")),
+                max_keepalive_connections=int(os.getenv("AI_HTTP_MAX_KEEPALIVE", "20")),
+                keepalive_expiry=60.0,
+            ),
+        )
+    return _http_client
+
+
+def get_async_client(model_name: str, api_key: str):
+    """モデルに対応する非同期クライアントを取得（初回のみ生成し、以降は再利用）"""
+    provider = get_provider(model_name)
+
+    if provider == "openai":
+        if not AsyncOpenAI: raise ValueError("OpenAI library not loaded.")
+        if not api_key: raise ValueError("OpenAI APIキーが設定されていません。")
+        cache_key = (provider, api_key)
+        if cache_key not in _clients:
+            try:
+                _clients[cache_key] = AsyncOpenAI(
+                    api_key=api_key,
+                    timeout=REQUEST_TIMEOUT,
+                    http_client=get_http_client(),
+                )
+            except Exception as e:
+                raise ValueError(f"OpenAI Client Error: {e}")
+        return _clients[cache_key]
+
+    if provider == "anthropic":
+        if not AsyncAnthropic:
+            raise ValueError("Anthropic library not loaded.")
+        if not api_key:
+            raise ValueError("Anthropic APIキーが設定されていません。")
+        cache_key = (provider, api_key)
+        if cache_key not in _clients:
+            try:
+                _clients[cache_key] = AsyncAnthropic(
+                    api_key=api_key,
+                    timeout=REQUEST_TIMEOUT,
+                    max_retries=0,  # 障害時はサーキットブレーカーとフォールバックで他プロバイダーへ切り替える
+                    http_client=get_http_client(),
+                )
+            except Exception as e:
+                raise ValueError(f"Anthropic Client Error: {e}")
+        return _clients[cache_key]
+
+    # Gemini
+    if not api_key: raise ValueError("Google APIキーが設定されていません。")
+    # Prefer new SDK
+    if google_genai_sdk:
+        cache_key = (provider, api_key)
+        if cache_key not in _clients:
+            try:
+                _clients[cache_key] = google_genai_sdk.Client(api_key=api_key)
+            except Exception:
+                pass  # エラーが発生した場合は古いSDKにフォールバック
+        if cache_key in _clients:
+            return _clients[cache_key]
+    # Fallback to old SDK
+    if old_gemini_sdk:
+        cache_key = (provider, api_key, model_name)
+        if cache_key not in _clients:
+            try:
+                old_gemini_sdk.configure(api_key=api_key)
+                # For the old SDK, GenerativeModel is returned, not a 'Client' instance
+                _clients[cache_key] = old_gemini_sdk.GenerativeModel(model_name)
+            except Exception as e_old:
+                raise ValueError(f"Google Client Error (old SDK): {e_old}")
+        return _clients[cache_key]
+    raise ValueError("Google AI SDK (new or old) not available or failed to initialize.")
+
+
+async def close_clients():
+    """保持しているクライアントと共有HTTPクライアントを閉じる（シャットダウン時）"""
+    global _http_client
+    for client in list(_clients.values()):
+        close = getattr(client, "close", None)
+        if close and asyncio.iscoroutinefunction(close):
+            try:
+                await close()
+            except Exception as e:
+                print(f"[AI] Failed to close client: {e}")
+    _clients.clear()
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+    _http_client = None
+
+
+def _clean_gemini_text(generated_text: Optional[str]) -> Optional[str]:
+    """Remove Gemini-specific character count annotations"""
+    if generated_text:
+        generated_text = re.sub(r'[（(]\d+文字程度[）)]\s*', '', generated_text)
+        generated_text = re.sub(r'\d+文字程度[\s、。]', '', generated_text)
+    return generated_text
+
+
+def _anthropic_content(prompt_text: str, prompt_prefix: Optional[str]):
+    """
+    Claude に送るメッセージ本文
+
+    共通プレフィックスがある場合は別ブロックにして cache_control を付け、プロンプトキャッシュの対象にする
+    """
+    if not prompt_prefix or not prompt_text.startswith(prompt_prefix):
+        return prompt_text
+    return [
+        {"type": "text", "text": prompt_prefix, "cache_control": {"type": "ephemeral"}},
+        {"type": "text", "text": prompt_text[len(prompt_prefix):]},
+    ]
+
+
+def _log_prompt_cache_usage(model_name: str, input_tokens: Optional[int], cached_tokens: Optional[int],
+                            cache_write_tokens: Optional[int] = None) -> None:
+    """プロバイダーが返したキャッシュ済み入力トークン数をログに出す"""
+    if input_tokens is None and cached_tokens is None:
+        return
+    message = f"[PromptCache] {model_name}: cached {cached_tokens or 0}/{input_tokens or 0} input tokens"
+    if cache_write_tokens:
+        message += f", wrote {cache_write_tokens} tokens to cache"
+    print(message)
+
+
+def _log_openai_usage(model_name: str, usage) -> None:
+    if usage is None:
+        return
+    # chat.completions は prompt_tokens_details、responses API は input_tokens_details
+    details = getattr(usage, "prompt_tokens_details", None) or getattr(usage, "input_tokens_details", None)
+    input_tokens = getattr(usage, "prompt_tokens", None)
+    if input_tokens is None:
+        input_tokens = getattr(usage, "input_tokens", None)
+    _log_prompt_cache_usage(model_name, input_tokens, getattr(details, "cached_tokens", None))
+
+
+def _log_anthropic_usage(model_name: str, usage) -> None:
+    if usage is None:
+        return
+    # input_tokens にはキャッシュから読んだ分・書き込んだ分は含まれない
+    cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+    cache_write = getattr(usage, "cache_creation_input_tokens", None) or 0
+    input_tokens = (getattr(usage, "input_tokens", None) or 0) + cache_read + cache_write
+    _log_prompt_cache_usage(model_name, input_tokens, cache_read, cache_write)
+
+
+def _log_gemini_usage(model_name: str, usage_metadata) -> None:
+    if usage_metadata is None:
+        return
+    _log_prompt_cache_usage(
+        model_name,
+        getattr(usage_metadata, "prompt_token_count", None),
+        getattr(usage_metadata, "cached_content_token_count", None)
+    )
+
+
+async def _generate_openai(client, prompt_text: str, model_name: str) -> Optional[str]:
+    # GPT-5の判定とAPI選択
+    if "gpt-5" in model_name:
+        try:
+            # GPT-5の新しいresponses APIを使用（最小実装）
+            response = await client.responses.create(
+                model="gpt-5",
+                input=prompt_text,
+                reasoning={"effort": "high"}  # ペルソナ生成は詳細な推論が必要
+            )
+            _log_openai_usage(model_name, getattr(response, "usage", None))
+            return response.output_text
+        except Exception as e:
+            print(f"[ERROR] GPT-5 responses API error: {str(e)}")
+            print("[INFO] Trying GPT-5 with chat.completions API")
+
+            # chat.completions APIでリトライ
+            try:
+                completion = await client.chat.completions.create(
+                    model=model_name,
+                    messages=[{"role": "user", "content": prompt_text}],
+                    temperature=1.0,  # GPT-5はデフォルト値のみサポート
+                    max_completion_tokens=128000  # GPT-5最大値
+                )
+                _log_openai_usage(model_name, getattr(completion, "usage", None))
+                return completion.choices[0].message.content
+            except Exception as e2:
+                print(f"[ERROR] GPT-5 chat API error: {str(e2)}")
+                return None
+
+    # GPT-4以前のモデル
+    completion = await client.chat.completions.create(
+        model=model_name,
+        messages=[{"role": "user", "content": prompt_text}],
+        temperature=0.7,
+        max_tokens=128000  # 最大値に設定
+    )
+    _log_openai_usage(model_name, getattr(completion, "usage", None))
+    return completion.choices[0].message.content
+
+
+async def _generate_anthropic(client, prompt_text: str, model_name: str, api_key: str,
+                              prompt_prefix: Optional[str] = None) -> Optional[str]:
+    print(f"[DEBUG] Calling Claude API with model: {model_name}")
+
+    # Network diagnostics (optional, can be removed in production)
+    if os.environ.get("DEBUG_NETWORK", "false").lower() == "true":
+        try:
+            api_host = "api.anthropic.com"
+            print(f"[DEBUG] DNS resolution test: {api_host}")
+            loop = asyncio.get_running_loop()
+            ip_addresses = await loop.run_in_executor(None, socket.gethostbyname_ex, api_host)
+            print(f"[DEBUG] DNS resolution successful: IP addresses = {ip_addresses[2]}")
+        except Exception as net_error:
+            print(f"[ERROR] Network diagnostic error: {type(net_error).__name__}: {net_error}")
+
+    messages_to_send = [{"role": "user", "content": _anthropic_content(prompt_text, prompt_prefix)}]
+
+    # Use direct HTTP if specified in environment
+    use_direct_http = os.environ.get("USE_DIRECT_HTTP_FOR_CLAUDE", "false").lower() == "true"
+
+    if use_direct_http:
+        http_response = await get_http_client().post(
+            "https://api.anthropic.com/v1/messages",
+            headers={
+                "x-api-key": api_key,
+                "anthropic-version": "2023-06-01",
+                "content-type": "application/json"
+            },
+            json={
+                "model": model_name,
+                "max_tokens": 2500,  # 502エラー対策で削減
+                "messages": messages_to_send,
+                "temperature": 0.7
+            }
+        )
+
+        if http_response.status_code != 200:
+            error_detail = http_response.text
+            print(f"[ERROR] Claude API HTTP error: {http_response.status_code} - {error_detail}")
+            if http_response.status_code in [401, 403, 404]:
+                raise ValueError(f"Claude API error (status {http_response.status_code}): {error_detail}")
+            http_response.raise_for_status()
+        response_data = http_response.json()
+        usage = response_data.get("usage") or {}
+        _log_prompt_cache_usage(
+            model_name,
+            (usage.get("input_tokens") or 0) + (usage.get("cache_read_input_tokens") or 0)
+            + (usage.get("cache_creation_input_tokens") or 0),
+            usage.get("cache_read_input_tokens"),
+            usage.get("cache_creation_input_tokens")
+        )
+        if response_data.get("content") and len(response_data["content"]) > 0:
+            return response_data["content"][0].get("text", "")
+        return None
+
+    response = await client.messages.create(
+        model=model_name,
+        max_tokens=64000,  # Claude Sonnet 4最大値
+        messages=messages_to_send,
+        temperature=0.7
+    )
+    _log_anthropic_usage(model_name, getattr(response, "usage", None))
+
+    # Extract text from response
+    if response.content and len(response.content) > 0:
+        if hasattr(response.content[0], 'text'):
+            return response.content[0].text
+    return None
+
+
+async def _generate_gemini(client, prompt_text: str, model_name: str) -> Optional[str]:
+    if hasattr(client, 'aio'):
+        # New SDK
+        print(f"[DEBUG] Using new Gemini SDK with model: {model_name}")
+        response = await client.aio.models.generate_content(
+            model=model_name,
+            contents=prompt_text,
+            config=google_genai_types.GenerateContentConfig(
+                temperature=0.7,
+                max_output_tokens=64000  # Gemini 2.5 Pro最大値
+            )
+        )
+        print(f"[DEBUG] Gemini response received: {response}")
+        _log_gemini_usage(model_name, getattr(response, "usage_metadata", None))
+        if response.candidates and response.candidates[0].content.parts:
+            generated_text = response.candidates[0].content.parts[0].text
+        else:
+            print(f"[ERROR] Gemini response has no candidates or parts")
+            return f"Gemini APIからの応答が空でした。別のモデルを試してください。"
+    else:
+        # Old SDK
+        print(f"[DEBUG] Using old Gemini SDK")
+        generation_config = {
+            "temperature": 0.7,
+            "max_output_tokens": 64000,  # Gemini 2.5 Pro最大値
+        }
+        response = await client.generate_content_async(prompt_text, generation_config=generation_config)
+        _log_gemini_usage(model_name, getattr(response, "usage_metadata", None))
+        generated_text = response.text
+
+    return _clean_gemini_text(generated_text)
+
+
+async def generate_text(prompt_text: str, model_name: str, api_key: str,
+                        prompt_prefix: Optional[str] = None) -> Optional[str]:
+    """
+    プールされた非同期クライアントでテキストを生成する
+
+    Args:
+        prompt_text: The prompt to send to the AI model
+        model_name: The model name (e.g., "gpt-4", "claude-3-opus", "gemini-pro")
+        api_key: The API key for the AI service
+        prompt_prefix: prompt_text の先頭にある全リクエスト共通部分（Claudeではキャッシュ対象として明示する。
+            OpenAI・Geminiは先頭一致で自動的にキャッシュされる）
+
+    Returns:
+        生成されたテキスト（取得できなかった場合はNone）
+
+    Raises:
+        プロバイダーのエラーはそのまま送出する（フォールバック判定は呼び出し側で行う）
+    """
+    provider = get_provider(model_name)
+    client = get_async_client(model_name, api_key)
+    breaker = _acquire_breaker(provider)
+
+    start = time.monotonic()
+    try:
+        if provider == "openai":
+            result = await _generate_openai(client, prompt_text, model_name)
+        elif provider == "anthropic":
+            result = await _generate_anthropic(client, prompt_text, model_name, api_key, prompt_prefix)
+        else:
+            result = await _generate_gemini(client, prompt_text, model_name)
+    except asyncio.CancelledError:
+        breaker.record_cancelled()
+        raise
+    except Exception as e:
+        _record_error(breaker, e, time.monotonic() - start)
+        raise
+    elapsed = time.monotonic() - start
+    if result:
+        record_latency(model_name, elapsed)
+        breaker.record_success(elapsed)
+    else:
+        breaker.record_cancelled()
+    return result
+
+
+def _acquire_breaker(provider: str) -> circuit_breaker.CircuitBreaker:
+    """プロバイダーのサーキットが通す状態か確認する（開いていれば CircuitOpenError）"""
+    breaker = circuit_breaker.get_breaker(provider)
+    if not breaker.allow_request():
+        raise CircuitOpenError(provider, breaker.retry_after())
+    return breaker
+
+
+def _error_status_code(error: BaseException) -> Optional[int]:
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def is_provider_failure(error: BaseException) -> bool:
+    """
+    プロバイダー側の障害とみなすエラーか
+
+    接続エラー・タイムアウト・5xx・429 は障害として扱う。
+    設定ミス（ValueError）や認証・リクエスト内容による 4xx はプロバイダーの健全性とは無関係。
+    """
+    if isinstance(error, (ValueError, CircuitOpenError)):
+        return False
+    status_code = _error_status_code(error)
+    if status_code is not None and 400 <= status_code < 500 and status_code not in (408, 429):
+        return False
+    return True
+
+
+def _record_error(breaker: circuit_breaker.CircuitBreaker, error: BaseException, latency: float) -> None:
+    if is_provider_failure(error):
+        breaker.record_failure(latency)
+    else:
+        breaker.record_cancelled()
+
+
+def record_latency(model_name: str, seconds: float) -> None:
+    """成功した呼び出しの応答時間を記録"""
+    _latencies.setdefault(model_name, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+
+def latency_percentile(model_name: str, percentile: float) -> Optional[float]:
+    """記録済みの応答時間のパーセンタイル値（サンプル不足ならNone）"""
+    samples = _latencies.get(model_name)
+    if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    ordered = sorted(samples)
+    index = max(0, math.ceil(percentile / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def get_hedge_delay(model_name: str) -> float:
+    """セカンダリモデルを追加で呼び出すまでの待ち時間"""
+    observed = latency_percentile(model_name, HEDGE_PERCENTILE)
+    if observed is None:
+        return HEDGE_DEFAULT_DELAY
+    return max(HEDGE_MIN_DELAY, observed)
+
+
+def get_latency_stats() -> Dict[str, Dict[str, Any]]:
+    """モデルごとの応答時間統計"""
+    stats = {}
+    for model_name, samples in _latencies.items():
+        stats[model_name] = {
+            "samples": len(samples),
+            "p50": latency_percentile(model_name, 50),
+            "p95": latency_percentile(model_name, 95),
+            "p99": latency_percentile(model_name, 99),
+        }
+    return stats
+
+
+async def generate_text_hedged(prompt_text: str, model_name: str, api_key: str,
+                               prompt_prefix: Optional[str] = None) -> Optional[str]:
+    """
+    ヘッジ付きでテキストを生成する
+
+    プライマリモデルが観測済み応答時間のパーセンタイル（HEDGE_PERCENTILE）を超えても
+    応答しない場合、同じプロンプトをセカンダリモデルにも送信し、先に返った結果を採用する。
+    負けた側のリクエストはキャンセルする。
+    """
+    secondary_model = HEDGE_SECONDARY_MODEL
+    secondary_key = get_api_key(secondary_model) if secondary_model else ""
+    if not HEDGE_ENABLED or not secondary_key or secondary_model == model_name:
+        return await generate_text(prompt_text, model_name, api_key, prompt_prefix)
+
+    primary = asyncio.create_task(generate_text(prompt_text, model_name, api_key, prompt_prefix))
+    tasks = [primary]
+    try:
+        delay = get_hedge_delay(model_name)
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if primary in done:
+            return primary.result()
+
+        print(f"[Hedge] {model_name} exceeded {delay:.1f}s, also sending to {secondary_model}")
+        secondary = asyncio.create_task(generate_text(prompt_text, secondary_model, secondary_key, prompt_prefix))
+        tasks.append(secondary)
+        names = {primary: model_name, secondary: secondary_model}
+        pending = {primary, secondary}
+        first_error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    print(f"[Hedge] {names[task]} failed: {type(task.exception()).__name__}: {task.exception()}")
+                    if task is primary or first_error is None:
+                        first_error = task.exception()
+                    continue
+                if task.result():
+                    print(f"[Hedge] Using response from {names[task]}")
+                    return task.result()
+        if first_error is not None:
+            raise first_error
+        return None
+    finally:
+        # 呼び出し元のキャンセル（クライアント切断・バッチ中止）を含め、終わっていない呼び出しはすべて止める
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+def _fallback_candidates(model_name: str) -> List[str]:
+    """プライマリと別プロバイダーで、APIキーがありサーキットが開いていないフォールバックモデル（健全な順）"""
+    primary_provider = get_provider(model_name)
+    candidates = []
+    for fallback_model in FALLBACK_TEXT_MODELS:
+        try:
+            provider = get_provider(fallback_model)
+        except ValueError:
+            continue
+        if provider == primary_provider or not get_api_key(fallback_model):
+            continue
+        breaker = circuit_breaker.get_breaker(provider)
+        if breaker.state == circuit_breaker.OPEN:
+            continue
+        candidates.append((breaker.health_score(), fallback_model))
+    # 健全性スコアの高い順（同点は設定順）
+    candidates.sort(key=lambda item: -item[0])
+    return [fallback_model for _, fallback_model in candidates]
+
+
+async def generate_text_with_fallback(prompt_text: str, model_name: str, api_key: str,
+                                      prompt_prefix: Optional[str] = None) -> Optional[str]:
+    """
+    サーキットブレーカーを考慮してテキストを生成する
+
+    プライマリのプロバイダーが障害中（サーキットが開いている、または接続エラー・5xx等）の場合は
+    待機や再試行をせず、FALLBACK_TEXT_MODELS のうち健全なプロバイダーへ切り替える。
+    設定・認証エラーなどプロバイダー障害ではないエラーはそのまま送出する。
+    """
+    try:
+        return await generate_text_hedged(prompt_text, model_name, api_key, prompt_prefix)
+    except Exception as e:
+        if not (isinstance(e, CircuitOpenError) or is_provider_failure(e)):
+            raise
+        primary_error = e
+
+    for fallback_model in _fallback_candidates(model_name):
+        print(f"[Circuit] {model_name} unavailable ({type(primary_error).__name__}), falling back to {fallback_model}")
+        try:
+            return await generate_text(prompt_text, fallback_model, get_api_key(fallback_model), prompt_prefix)
+        except Exception as fallback_error:
+            print(f"[ERROR] Fallback to {fallback_model} failed: {type(fallback_error).__name__}: {fallback_error}")
+    raise primary_error
+
+
+def get_provider_health() -> Dict[str, Any]:
+    """プロバイダーごとのサーキット状態とモデルごとの応答時間"""
+    return {
+        "circuits": circuit_breaker.get_all_status(),
+        "latency": get_latency_stats(),
+        "fallback_models": FALLBACK_TEXT_MODELS,
+    }
+
+
+async def stream_text(prompt_text: str, model_name: str, api_key: str,
+                      prompt_prefix: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    プロバイダーのトークンストリームをテキスト断片として順次返す
+
+    Args:
+        prompt_text: The prompt to send to the AI model
+        model_name: The model name
+        api_key: The API key for the AI service
+        prompt_prefix: prompt_text の先頭にある全リクエスト共通部分（generate_text と同じ）
+
+    Yields:
+        生成されたテキストの断片
+
+    Raises:
+        CircuitOpenError: プロバイダーのサーキットが開いている場合（ストリーム開始前）
+    """
+    provider = get_provider(model_name)
+    client = get_async_client(model_name, api_key)
+    breaker = _acquire_breaker(provider)
+
+    start = time.monotonic()
+    received = False
+    try:
+        async for text in _stream_provider(client, provider, prompt_text, model_name, prompt_prefix):
+            received = True
+            yield text
+    except (asyncio.CancelledError, GeneratorExit):
+        breaker.record_cancelled()
+        raise
+    except Exception as e:
+        _record_error(breaker, e, time.monotonic() - start)
+        raise
+    if received:
+        breaker.record_success(time.monotonic() - start)
+    else:
+        breaker.record_cancelled()
+
+
+async def _stream_provider(client, provider: str, prompt_text: str, model_name: str,
+                           prompt_prefix: Optional[str] = None) -> AsyncIterator[str]:
+    """プロバイダーごとのストリーミング呼び出し"""
+    if provider == "openai":
+        if "gpt-5" in model_name:
+            stream = await client.responses.create(
+                model="gpt-5",
+                input=prompt_text,
+                reasoning={"effort": "high"},
+                stream=True
+            )
+            async for event in stream:
+                event_type = getattr(event, "type", "")
+                if event_type == "response.output_text.delta":
+                    yield event.delta
+                elif event_type == "response.completed":
+                    _log_openai_usage(model_name, getattr(event.response, "usage", None))
+            return
+
+        stream = await client.chat.completions.create(
+            model=model_name,
+            messages=[{"role": "user", "content": prompt_text}],
+            temperature=0.7,
+            max_tokens=128000,
+            stream=True,
+            stream_options={"include_usage": True}  # 最後のチャンクでトークン使用量を受け取る
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if getattr(chunk, "usage", None):
+                _log_openai_usage(model_name, chunk.usage)
+        return
+
+    if provider == "anthropic":
+        async with client.messages.stream(
+            model=model_name,
+            max_tokens=64000,
+            messages=[{"role": "user", "content": _anthropic_content(prompt_text, prompt_prefix)}],
+            temperature=0.7
+        ) as stream:
+            async for text in stream.text_stream:
+                yield text
+            final_message = await stream.get_final_message()
+            _log_anthropic_usage(model_name, getattr(final_message, "usage", None))
+        return
+
+    # Gemini
+    if hasattr(client, 'aio'):
+        stream = await client.aio.models.generate_content_stream(
+            model=model_name,
+            contents=prompt_text,
+            config=google_genai_types.GenerateContentConfig(
+                temperature=0.7,
+                max_output_tokens=64000
+            )
+        )
+        usage_metadata = None
+        async for chunk in stream:
+            if chunk.text:
+                yield chunk.text
+            usage_metadata = getattr(chunk, "usage_metadata", None) or usage_metadata
+        _log_gemini_usage(model_name, usage_metadata)
+    else:
+        generation_config = {
+            "temperature": 0.7,
+            "max_output_tokens": 64000,
+        }
+        response = await client.generate_content_async(
+            prompt_text, generation_config=generation_config, stream=True
+        )
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
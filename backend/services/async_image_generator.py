@@ -1,11 +1,23 @@
 """
 非同期画像生成モジュール
 テキスト生成と並列して画像生成を実行するための関数
+（APIは ai_providers の非同期クライアントで呼び出し、image_scheduler でモデルごとの同時実行数を制限する）
 """
-import asyncio
 import base64
-import os
-from typing import Optional
+
+from backend.services import ai_providers, image_scheduler, image_store, offload, portrait_library
+
+
+async def _store_image(bucket, model_name: str, mime_type: str, image_data: bytes) -> str:
+    """生成画像を image_store に保存してライブラリに登録し、配信URLを返す（保存できない場合はData URI）"""
+    try:
+        image_hash = await offload.run_io(image_store.save, image_data, mime_type)
+    except Exception as e:
+        print(f"[Async] Failed to store generated image: {e}")
+        return f"data:{mime_type};base64,{base64.b64encode(image_data).decode('utf-8')}"
+    await offload.run_io(portrait_library.add, bucket, model_name, image_hash)
+    return image_store.url_for(image_hash)
+
 
 async def generate_image_async(
     data: dict,
@@ -17,7 +29,7 @@ async def generate_image_async(
     画像を非同期で生成する
     
     Args:
-        data: フォームデータ（name, age, gender, occupation を含む）
+        data: フォームデータ（name, age, gender, occupation を含む。fresh_image が真なら必ず新規生成）
         selected_image_model: 使用する画像生成モデル
         openai_api_key: OpenAI APIキー
         google_api_key: Google APIキー
@@ -26,6 +38,15 @@ async def generate_image_async(
         生成された画像のURL（エラー時はプレースホルダー）
     """
     try:
+        # 同じ区分の画像が十分にあれば、生成せずにライブラリから再利用
+        bucket = portrait_library.bucket_for(data)
+        if not data.get('fresh_image'):
+            # SQLiteの参照とファイルの存在確認はイベントループ外で行う
+            library_image = await offload.run_io(portrait_library.pick, bucket)
+            if library_image:
+                return library_image
+        
+
         # デフォルトプレースホルダー
         image_url = "https://placehold.jp/150x150.png"
         
@@ -70,6 +91,11 @@ async def generate_image_async(
                 img_prompt_parts.append("wearing a white coat,")
             elif '看護' in occupation or 'nurse' in occupation.lower():
                 img_prompt_parts.append("wearing medical scrubs,")
+            elif portrait_library.LIBRARY_ENABLED:
+                # ライブラリで区分内の他の職業にも再利用するため、職業区分の説明で指定
+                occupation_description = portrait_library.occupation_class(occupation)[1]
+                if occupation_description:
+                    img_prompt_parts.append(f"dressed appropriately for {occupation_description},")
             else:
                 img_prompt_parts.append(f"dressed appropriately for {occupation},")
         
@@ -83,15 +109,12 @@ async def generate_image_async(
         
         # DALL-E 3の場合
         if selected_image_model == "dall-e-3" and openai_api_key:
-            from openai import OpenAI
             try:
-                image_client = OpenAI(api_key=openai_api_key)
+                image_client = ai_providers.get_async_client(selected_image_model, openai_api_key)
                 print(f"[Async] Attempting DALL-E 3 image generation")
                 
-                # 非同期実行のためのラッパー
-                loop = asyncio.get_event_loop()
-                image_response = await loop.run_in_executor(
-                    None,
+                image_response = await image_scheduler.run(
+                    selected_image_model,
                     lambda: image_client.images.generate(
                         model="dall-e-3",
                         prompt=img_prompt,
@@ -99,10 +122,13 @@ async def generate_image_async(
                         quality="hd",
                         style="natural",
                         n=1,
+                        # サーバーに保存するため画像データで受け取る（URLは1時間で失効する）
+                        response_format="b64_json",
                     )
                 )
                 
-                image_url = image_response.data[0].url
+                image_data = base64.b64decode(image_response.data[0].b64_json)
+                image_url = await _store_image(bucket, selected_image_model, "image/png", image_data)
                 print(f"[Async] DALL-E 3 Image generated successfully")
                 
             except Exception as e:
@@ -112,17 +138,14 @@ async def generate_image_async(
         # Geminiの場合
         elif selected_image_model.startswith("gemini") and google_api_key:
             try:
-                from google import genai as google_genai_sdk
                 from google.genai import types as google_genai_types
                 
-                client = google_genai_sdk.Client(api_key=google_api_key)
+                client = ai_providers.get_async_client(selected_image_model, google_api_key)
                 print(f"[Async] Attempting Gemini image generation")
                 
-                # 非同期実行のためのラッパー
-                loop = asyncio.get_event_loop()
-                response = await loop.run_in_executor(
-                    None,
-                    lambda: client.models.generate_content(
+                response = await image_scheduler.run(
+                    selected_image_model,
+                    lambda: client.aio.models.generate_content(
                         model=selected_image_model,
                         contents=img_prompt,
                         config=google_genai_types.GenerateContentConfig(
@@ -140,8 +163,7 @@ async def generate_image_async(
                                 if hasattr(part.inline_data, 'data'):
                                     image_data = part.inline_data.data
                                     mime_type = getattr(part.inline_data, 'mime_type', 'image/png')
-                                    base64_image = base64.b64encode(image_data).decode('utf-8')
-                                    image_url = f"data:{mime_type};base64,{base64_image}"
+                                    image_url = await _store_image(bucket, selected_image_model, mime_type, image_data)
                                     print(f"[Async] Gemini image generated successfully")
                                     break
                                     
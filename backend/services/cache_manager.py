@@ -2,10 +2,11 @@
 改善版インメモリキャッシュマネージャー
 スレッドセーフティとメモリ管理を強化
 """
+from collections import OrderedDict
 from functools import lru_cache
 import json
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Any, Dict, Hashable, List, Optional, Tuple
 import time
 import threading
 from datetime import datetime, timedelta
@@ -114,6 +115,81 @@ class CacheManager:
                 "newest_entry": max(self._cache_timestamps.values()) if self._cache_timestamps else None
             }
 
+class SizedLRUCache:
+    """
+    合計バイト数で上限を決めるLRUキャッシュ（TTL付き、スレッドセーフ）
+
+    値ごとのバイト数は set の呼び出し側が渡す。上限を超えたら最後に使われた時刻が古い順に削除する
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int, float]]" = OrderedDict()  # key -> (値, バイト数, 保存時刻)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "rejected": 0}
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[2] >= self.ttl:
+                self._remove(key)
+                self._stats["expired"] += 1
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any, size: int) -> bool:
+        """保存する（1件で上限を超える値は保存せず False）"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                self._stats["rejected"] += 1
+                return False
+            while self._entries and self._bytes + size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+            self._entries[key] = (value, size, time.monotonic())
+            self._bytes += size
+            return True
+
+    def _remove(self, key: Hashable) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def cleanup_expired(self) -> int:
+        """期限切れの値を一括削除"""
+        now = time.monotonic()
+        with self._lock:
+            expired_keys = [key for key, (_, _, saved_at) in self._entries.items() if now - saved_at >= self.ttl]
+            for key in expired_keys:
+                self._remove(key)
+            self._stats["expired"] += len(expired_keys)
+        return len(expired_keys)
+
+    def clear(self) -> int:
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+        return count
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                **self._stats,
+            }
+
 # グローバルキャッシュインスタンス
 cache_manager = CacheManager()
 
@@ -0,0 +1,197 @@
+"""
+AIプロバイダーごとのサーキットブレーカー
+直近の一定時間のエラー率・応答時間から障害を検知し、回復するまでリクエストを遮断する
+"""
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """サーキットが開いているためリクエストを送信しなかった"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} is temporarily unavailable (circuit open, retry in {retry_after:.0f}s)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    ローリングウィンドウ方式のサーキットブレーカー
+
+    closed    - 通常状態。エラー率または遅延率がしきい値を超えたら open へ
+    open      - リクエストを即座に拒否。open_seconds 経過後に half_open へ
+    half_open - 1件だけ試験的に通し、成功なら closed、失敗なら再び open へ
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window_seconds: float = 60,
+        min_requests: int = 5,
+        error_threshold: float = 0.5,
+        slow_call_seconds: float = 60,
+        slow_call_threshold: float = 0.8,
+        open_seconds: float = 30
+    ):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_requests = min_requests
+        self.error_threshold = error_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_threshold = slow_call_threshold
+        self.open_seconds = open_seconds
+        self._events = deque()  # (timestamp, success, latency)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_started_at: Optional[float] = None
+        self._lock = threading.RLock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._update_state(time.time())
+            return self._state
+
+    def _update_state(self, now: float) -> None:
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probe_started_at = None
+            print(f"[Circuit] {self.name}: open -> half_open")
+
+    def _prune(self, now: float) -> None:
+        while self._events and self._events[0][0] <= now - self.window_seconds:
+            self._events.popleft()
+
+    def allow_request(self) -> bool:
+        """リクエストを送信してよいか（half_open中は試験リクエスト1件のみ許可）"""
+        with self._lock:
+            now = time.time()
+            self._update_state(now)
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                return False
+            # 試験リクエストが戻らないまま open_seconds を過ぎた場合は次を通す
+            if self._probe_started_at is None or now - self._probe_started_at >= self.open_seconds:
+                self._probe_started_at = now
+                return True
+            return False
+
+    def retry_after(self) -> float:
+        """再試行可能になるまでの秒数の目安"""
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(0.0, self.open_seconds - (time.time() - self._opened_at))
+
+    def record_success(self, latency: float) -> None:
+        with self._lock:
+            now = time.time()
+            if self._state == HALF_OPEN:
+                print(f"[Circuit] {self.name}: probe succeeded, half_open -> closed")
+                self._state = CLOSED
+                self._probe_started_at = None
+                self._events.clear()
+            self._events.append((now, True, latency))
+            self._evaluate(now)
+
+    def record_failure(self, latency: float = 0.0) -> None:
+        with self._lock:
+            now = time.time()
+            if self._state == HALF_OPEN:
+                self._open(now, "probe failed")
+                return
+            self._events.append((now, False, latency))
+            self._evaluate(now)
+
+    def record_cancelled(self) -> None:
+        """結果が出る前に取り消された呼び出し（健全性の判定には使わない）"""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probe_started_at = None
+
+    def _open(self, now: float, reason: str) -> None:
+        self._state = OPEN
+        self._opened_at = now
+        self._probe_started_at = None
+        print(f"[Circuit] {self.name}: opened ({reason}) for {self.open_seconds:.0f}s")
+
+    def _rates(self, now: float):
+        self._prune(now)
+        total = len(self._events)
+        if total == 0:
+            return 0, 0.0, 0.0
+        errors = sum(1 for _, success, _ in self._events if not success)
+        slow = sum(1 for _, _, latency in self._events if latency >= self.slow_call_seconds)
+        return total, errors / total, slow / total
+
+    def _evaluate(self, now: float) -> None:
+        if self._state != CLOSED:
+            return
+        total, error_rate, slow_rate = self._rates(now)
+        if total < self.min_requests:
+            return
+        if error_rate >= self.error_threshold:
+            self._open(now, f"error rate {error_rate:.0%}")
+        elif slow_rate >= self.slow_call_threshold:
+            self._open(now, f"slow call rate {slow_rate:.0%}")
+
+    def health_score(self) -> float:
+        """0.0（利用不可）〜1.0（正常）の健全性スコア"""
+        with self._lock:
+            now = time.time()
+            self._update_state(now)
+            if self._state == OPEN:
+                return 0.0
+            _, error_rate, slow_rate = self._rates(now)
+            score = (1.0 - error_rate) * (1.0 - 0.5 * slow_rate)
+            return score * 0.5 if self._state == HALF_OPEN else score
+
+    def get_status(self) -> Dict:
+        with self._lock:
+            now = time.time()
+            self._update_state(now)
+            total, error_rate, slow_rate = self._rates(now)
+            return {
+                "state": self._state,
+                "health_score": round(self.health_score(), 3),
+                "requests_in_window": total,
+                "error_rate": round(error_rate, 3),
+                "slow_call_rate": round(slow_rate, 3),
+                "retry_after": round(self.retry_after(), 1)
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """名前（プロバイダー名）ごとのサーキットブレーカーを取得"""
+    with _registry_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(
+                name,
+                window_seconds=float(os.getenv("CIRCUIT_WINDOW_SECONDS", "60")),
+                min_requests=int(os.getenv("CIRCUIT_MIN_REQUESTS", "5")),
+                error_threshold=float(os.getenv("CIRCUIT_ERROR_THRESHOLD", "0.5")),
+                slow_call_seconds=float(os.getenv("CIRCUIT_SLOW_CALL_SECONDS", "60")),
+                slow_call_threshold=float(os.getenv("CIRCUIT_SLOW_CALL_THRESHOLD", "0.8")),
+                open_seconds=float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+            )
+        return _breakers[name]
+
+
+def get_all_status() -> Dict[str, Dict]:
+    """全サーキットブレーカーの状態"""
+    with _registry_lock:
+        names = list(_breakers.keys())
+    return {name: get_breaker(name).get_status() for name in names}
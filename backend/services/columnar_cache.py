@@ -0,0 +1,191 @@
+"""
+RAG・タイムライン元データ（CSV/Excel）の列指向バイナリキャッシュ
+元ファイルのSHA-256ごとに列を型付きのバイナリ1ファイルに変換して保存し、2回目以降はメモリマップで読み込む
+（pd.read_csv / pd.read_excel の解析を省略する。読み込んだ列はDataFrameへコピーされ、Worker間では共有しない）
+元ファイルのSHA-256は (サイズ, 更新時刻) ごとにプロセス内で覚えておき、変わっていなければ元ファイルを読まない
+
+ファイル形式: MAGIC(8) + ヘッダー長(uint64) + ヘッダー(JSON) + 列データ（ALIGNMENT バイト境界）
+  数値・日時列はNumPy配列のバイト列（整数は値が収まる最小の型）、文字列列は "\\0" 区切りのUTF-8と欠損マスク(uint8)
+"""
+import hashlib
+import io
+import json
+import os
+import struct
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+MAGIC = b"NPCOL\x00\x00\x01"  # 保存形式を変えたら末尾の番号を上げる
+ALIGNMENT = 64
+CACHE_DIR = Path(os.getenv(
+    "COLUMNAR_CACHE_DIR",
+    str(Path(__file__).resolve().parent.parent.parent / "app_settings" / "columnar_cache"),
+))
+ENABLED = os.getenv("COLUMNAR_CACHE_ENABLED", "true").lower() == "true"
+
+_stats = {"hits": 0, "misses": 0, "write_errors": 0, "hashed": 0}
+_digests: Dict[str, Tuple[int, int, str]] = {}  # 元ファイルのパス -> (サイズ, 更新時刻ns, SHA-256)
+
+
+def cache_path(digest: str) -> Path:
+    """元ファイルのSHA-256に対応するキャッシュファイルのパス"""
+    # pandasのメジャーバージョンで文字列列の型が変わるため、バージョンごとに分ける
+    pandas_major = pd.__version__.split(".")[0]
+    return CACHE_DIR / f"pd{pandas_major}" / digest[:2] / f"{digest}.npcol"
+
+
+def _parse(path: Path, content: bytes) -> pd.DataFrame:
+    """元ファイルを解析（拡張子で形式を判定）"""
+    if path.suffix == ".xlsx":
+        return pd.read_excel(io.BytesIO(content))
+    return pd.read_csv(io.BytesIO(content), encoding="utf-8-sig")
+
+
+def _narrow_dtype(values: np.ndarray) -> np.dtype:
+    """整数列は値が収まる最小の型で保存する（読み込み時に元の型へ戻す）"""
+    if values.dtype.kind not in "iu" or not len(values):
+        return values.dtype
+    low, high = values.min(), values.max()
+    for candidate in (np.int8, np.int16, np.int32) if values.dtype.kind == "i" else (np.uint8, np.uint16, np.uint32):
+        info = np.iinfo(candidate)
+        if info.min <= low and high <= info.max:
+            return np.dtype(candidate).newbyteorder("<")
+    return values.dtype
+
+
+def _encode_columns(df: pd.DataFrame):
+    """列ごとのメタデータとバイト列（メモリマップでそのまま読める形）に変換する"""
+    columns: List[Dict] = []
+    buffers: List[bytes] = []
+    for name, series in df.items():
+        if not isinstance(name, (str, int)):
+            raise ValueError(f"unsupported column name: {name!r}")
+        dtype = series.dtype
+        if isinstance(dtype, np.dtype) and dtype.kind in "biufM":
+            values = series.to_numpy()
+            stored = _narrow_dtype(values)
+            columns.append({"name": name, "kind": "array", "dtype": values.dtype.str, "stored": stored.str})
+            buffers.append(np.ascontiguousarray(values, dtype=stored).tobytes())
+        else:
+            values = series.to_numpy(dtype=object)
+            nulls = series.isna().to_numpy()
+            present = values[~nulls]
+            if not all(isinstance(value, str) and "\x00" not in value for value in present):
+                raise ValueError(f"column '{name}' is not a plain string column")
+            text = "\x00".join(np.where(nulls, "", values).tolist()).encode("utf-8")
+            columns.append({"name": name, "kind": "str", "dtype": str(dtype), "bytes": len(text)})
+            buffers.append(text)
+            buffers.append(nulls.astype(np.uint8).tobytes())
+    return columns, buffers
+
+
+def _save(path: Path, df: pd.DataFrame, source: Path) -> None:
+    """一時ファイルに書き出してから置き換える（書き込み途中のファイルを他Workerに読ませない）"""
+    columns, buffers = _encode_columns(df)
+    header = json.dumps({"source": source.name, "rows": len(df), "columns": columns}, ensure_ascii=False).encode("utf-8")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(MAGIC + struct.pack("<Q", len(header)) + header)
+            for buffer in buffers:
+                f.write(b"\x00" * (-f.tell() % ALIGNMENT))
+                f.write(buffer)
+        os.replace(temp_path, path)
+    finally:
+        temp_path.unlink(missing_ok=True)
+
+
+def _load(path: Path) -> pd.DataFrame:
+    """キャッシュファイルをメモリマップし、列ごとに配列として読み出す（DataFrameの作成時にコピーされる）"""
+    mapped = np.memmap(path, dtype=np.uint8, mode="r")
+    if mapped[:len(MAGIC)].tobytes() != MAGIC:
+        raise ValueError("unknown format")
+    header_length = struct.unpack("<Q", mapped[len(MAGIC):len(MAGIC) + 8].tobytes())[0]
+    offset = len(MAGIC) + 8
+    meta = json.loads(mapped[offset:offset + header_length].tobytes().decode("utf-8"))
+    offset += header_length
+    rows = meta["rows"]
+
+    def take(size: int) -> np.ndarray:
+        nonlocal offset
+        offset += -offset % ALIGNMENT
+        chunk = mapped[offset:offset + size]
+        if len(chunk) != size:
+            raise ValueError("truncated file")
+        offset += size
+        return chunk
+
+    data = {}
+    for column in meta["columns"]:
+        if column["kind"] == "array":
+            stored = np.dtype(column["stored"])
+            values = take(stored.itemsize * rows).view(stored)
+            dtype = np.dtype(column["dtype"])
+            data[column["name"]] = values if stored == dtype else values.astype(dtype)
+            continue
+        text = take(column["bytes"]).tobytes().decode("utf-8")
+        nulls = take(rows).view(np.bool_)
+        strings = np.array(text.split("\x00") if rows else [], dtype=object)
+        strings[nulls] = np.nan
+        if column["dtype"] == "object":
+            data[column["name"]] = strings
+        else:
+            data[column["name"]] = pd.Series(strings, dtype=pd.api.types.pandas_dtype(column["dtype"]))
+    return pd.DataFrame(data)
+
+
+def _digest(path: Path, content: Optional[bytes]) -> str:
+    """元ファイルのSHA-256（サイズ・更新時刻が前回と同じならハッシュを計算し直さない。rag_manifest と同じ考え方）"""
+    stat = path.stat()
+    key = str(path.resolve())
+    known = _digests.get(key)
+    if known and known[:2] == (stat.st_size, stat.st_mtime_ns):
+        return known[2]
+    digest = hashlib.sha256(path.read_bytes() if content is None else content).hexdigest()
+    _stats["hashed"] += 1
+    _digests[key] = (stat.st_size, stat.st_mtime_ns, digest)
+    return digest
+
+
+def read_table(path: Path, content: Optional[bytes] = None) -> pd.DataFrame:
+    """
+    CSV/Excelファイルを読み込む（変換済みならキャッシュから、未変換なら解析して保存する）
+
+    Args:
+        path: 元ファイルのパス
+        content: 読み込み済みのファイル内容（ハッシュ計算用。省略時はファイルから読む）
+
+    Returns:
+        pd.read_csv / pd.read_excel と同じ列・型のDataFrame
+    """
+    path = Path(path)
+    if not ENABLED:
+        return _parse(path, path.read_bytes() if content is None else content)
+
+    cached = cache_path(_digest(path, content))
+    if cached.exists():
+        try:
+            df = _load(cached)
+            _stats["hits"] += 1
+            return df
+        except Exception as e:
+            print(f"[ColumnarCache] Broken cache for {path.name}, converting again: {e}")
+
+    _stats["misses"] += 1
+    df = _parse(path, path.read_bytes() if content is None else content)
+    try:
+        _save(cached, df, path)
+    except Exception as e:
+        # 保存できなくても読み込み結果はそのまま返す（読み取り専用ディスク・未対応の列型など）
+        _stats["write_errors"] += 1
+        print(f"[ColumnarCache] Failed to cache {path.name}: {e}")
+    return df
+
+
+def get_stats() -> Dict:
+    """このWorkerプロセスでのキャッシュのヒット数・変換数・ハッシュ計算数"""
+    return {"enabled": ENABLED, "cache_dir": str(CACHE_DIR), **_stats}
@@ -4,6 +4,7 @@ from pathlib import Path
 from typing import Dict, Union
 
 from backend.models.schemas import AdminSettings, ModelSettings
+from backend.services import offload
 
 # 永続ディスクのマウントパス (Renderで設定したものに合わせる)
 # /var/app_settings で設定済みとのこと
@@ -54,6 +55,10 @@ def read_settings() -> AdminSettings:
         write_settings(DEFAULT_SETTINGS)
         return DEFAULT_SETTINGS
 
+async def read_settings_async() -> AdminSettings:
+    """read_settings をイベントループ外（I/Oスレッドプール）で実行する"""
+    return await offload.run_io(read_settings)
+
 def write_settings(settings_data: Union[AdminSettings, Dict]) -> bool:
     """Writes admin settings to the JSON file."""
     ensure_settings_dir_exists()
@@ -0,0 +1,164 @@
+"""
+ペルソナ生成結果の永続キャッシュ
+正規化したプロンプト・モデル名・文字数制限のハッシュをキーに、生成テキストをSQLiteに保存する
+（永続ディスク上の同じファイルを使うため、全Gunicorn Workerで共有され、再デプロイ後も残る）
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from backend.services.crud import PERSISTENT_DISK_MOUNT_PATH
+
+CACHE_DB_PATH = Path(os.getenv("GENERATION_CACHE_DB", str(PERSISTENT_DISK_MOUNT_PATH / "generation_cache.db")))
+CACHE_ENABLED = os.getenv("GENERATION_CACHE_ENABLED", "true").lower() == "true"
+CACHE_TTL = int(os.getenv("GENERATION_CACHE_TTL", str(7 * 24 * 3600)))  # デフォルト7日
+CACHE_MAX_ENTRIES = int(os.getenv("GENERATION_CACHE_MAX_ENTRIES", "2000"))
+
+_conn: Optional[sqlite3.Connection] = None
+_conn_pid: Optional[int] = None
+_lock = threading.Lock()
+
+
+def _get_connection() -> sqlite3.Connection:
+    """プロセスごとに1本の接続を使い回す（fork後は開き直す）"""
+    global _conn, _conn_pid
+    if _conn is None or _conn_pid != os.getpid():
+        CACHE_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(CACHE_DB_PATH), timeout=30.0, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS generation_cache (
+                cache_key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response_text TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_accessed REAL NOT NULL,
+                hit_count INTEGER DEFAULT 0
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_generation_cache_accessed ON generation_cache(last_accessed)")
+        conn.commit()
+        _conn = conn
+        _conn_pid = os.getpid()
+    return _conn
+
+
+def normalize_prompt(prompt_text: str) -> str:
+    """空白の揺れを吸収したプロンプト文字列を返す"""
+    lines = [re.sub(r'[ \t　]+', ' ', line).strip() for line in prompt_text.strip().splitlines()]
+    return "\n".join(line for line in lines if line)
+
+
+def make_cache_key(prompt_text: str, model_name: str, char_limits: Optional[Dict[str, str]] = None) -> str:
+    """プロンプト・モデル名・文字数制限からキャッシュキー（SHA-256）を作成"""
+    payload = json.dumps({
+        "prompt": normalize_prompt(prompt_text),
+        "model": model_name,
+        "limits": {k: str(v) for k, v in sorted((char_limits or {}).items())}
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get(cache_key: str) -> Optional[str]:
+    """キャッシュされた生成テキストを取得（期限切れ・未登録ならNone）"""
+    if not CACHE_ENABLED:
+        return None
+    try:
+        with _lock:
+            conn = _get_connection()
+            row = conn.execute(
+                "SELECT response_text, created_at FROM generation_cache WHERE cache_key = ?",
+                (cache_key,)
+            ).fetchone()
+            if not row:
+                return None
+            now = time.time()
+            if now - row[1] >= CACHE_TTL:
+                conn.execute("DELETE FROM generation_cache WHERE cache_key = ?", (cache_key,))
+                conn.commit()
+                return None
+            # LRU用にアクセス時刻を更新
+            conn.execute(
+                "UPDATE generation_cache SET last_accessed = ?, hit_count = hit_count + 1 WHERE cache_key = ?",
+                (now, cache_key)
+            )
+            conn.commit()
+            return row[0]
+    except Exception as e:
+        print(f"[GenCache] Lookup failed: {e}")
+        return None
+
+
+def set(cache_key: str, model_name: str, response_text: str) -> None:
+    """生成テキストを保存し、期限切れ・上限超過分を削除する"""
+    if not CACHE_ENABLED or not response_text:
+        return
+    try:
+        with _lock:
+            conn = _get_connection()
+            now = time.time()
+            conn.execute('''
+                INSERT OR REPLACE INTO generation_cache
+                    (cache_key, model, response_text, created_at, last_accessed, hit_count)
+                VALUES (?, ?, ?, ?, ?, 0)
+            ''', (cache_key, model_name, response_text, now, now))
+            _evict(conn, now)
+            conn.commit()
+    except Exception as e:
+        print(f"[GenCache] Store failed: {e}")
+
+
+def _evict(conn: sqlite3.Connection, now: float) -> None:
+    """TTL切れのエントリと、上限を超えた最も古いアクセスのエントリを削除"""
+    conn.execute("DELETE FROM generation_cache WHERE created_at <= ?", (now - CACHE_TTL,))
+    count = conn.execute("SELECT COUNT(*) FROM generation_cache").fetchone()[0]
+    if count > CACHE_MAX_ENTRIES:
+        conn.execute('''
+            DELETE FROM generation_cache WHERE cache_key IN (
+                SELECT cache_key FROM generation_cache ORDER BY last_accessed ASC LIMIT ?
+            )
+        ''', (count - CACHE_MAX_ENTRIES,))
+
+
+def invalidate(model_name: Optional[str] = None) -> int:
+    """キャッシュを無効化（モデル指定時はそのモデルのみ）し、削除件数を返す"""
+    with _lock:
+        conn = _get_connection()
+        if model_name:
+            cursor = conn.execute("DELETE FROM generation_cache WHERE model = ?", (model_name,))
+        else:
+            cursor = conn.execute("DELETE FROM generation_cache")
+        conn.commit()
+        print(f"[GenCache] Invalidated {cursor.rowcount} entries")
+        return cursor.rowcount
+
+
+def get_stats() -> Dict:
+    """キャッシュ統計情報を取得"""
+    with _lock:
+        conn = _get_connection()
+        count, hits = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(hit_count), 0) FROM generation_cache"
+        ).fetchone()
+        by_model = {
+            model: model_count for model, model_count in conn.execute(
+                "SELECT model, COUNT(*) FROM generation_cache GROUP BY model"
+            ).fetchall()
+        }
+    return {
+        "enabled": CACHE_ENABLED,
+        "database_path": str(CACHE_DB_PATH),
+        "entries": count,
+        "total_hits": hits,
+        "max_entries": CACHE_MAX_ENTRIES,
+        "ttl_seconds": CACHE_TTL,
+        "entries_by_model": by_model
+    }
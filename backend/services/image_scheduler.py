@@ -0,0 +1,159 @@
+"""
+画像生成スケジューラー
+画像生成APIの呼び出しをモデルごとの同時実行数で制限し、超えた分は到着順（FIFO）で待たせる
+（待ち時間が IMAGE_QUEUE_TIMEOUT を超えたら諦め、呼び出し元がキャンセルされたら待ち行列から外す）
+"""
+import asyncio
+import os
+import statistics
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict
+
+DEFAULT_CONCURRENCY = int(os.getenv("IMAGE_MODEL_CONCURRENCY", "2"))  # Workerプロセスごと・モデルごとの同時実行数
+QUEUE_TIMEOUT = float(os.getenv("IMAGE_QUEUE_TIMEOUT", "60"))  # 実行枠を待つ上限（秒）
+WAIT_WINDOW = 200
+
+
+def _parse_limits(value: str) -> Dict[str, int]:
+    """モデル別同時実行数（例: dall-e-3=2,gemini-2.0-flash-exp=4）を読み取る"""
+    limits = {}
+    for item in value.split(","):
+        model, _, limit = item.partition("=")
+        if model.strip() and limit.strip().isdigit():
+            limits[model.strip()] = max(int(limit), 1)
+    return limits
+
+
+MODEL_CONCURRENCY = _parse_limits(os.getenv("IMAGE_MODEL_LIMITS", ""))
+
+
+class ImageQueueTimeout(Exception):
+    """実行枠が空くのを待つ間にタイムアウトした"""
+
+    def __init__(self, model: str, waited: float):
+        self.model = model
+        self.waited = waited
+        super().__init__(f"Image generation queue for {model} timed out after {waited:.1f}s")
+
+
+class _ModelLane:
+    """1モデル分の実行枠と待ち行列"""
+
+    def __init__(self, model: str, limit: int):
+        self.model = model
+        self.limit = limit
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.wait_times: Deque[float] = deque(maxlen=WAIT_WINDOW)
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.cancelled = 0
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    async def acquire(self, timeout: float) -> None:
+        if self.active < self.limit and not self.queued:
+            self.active += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except BaseException:
+            if waiter.done():
+                # 枠を渡された直後にタイムアウト・キャンセルされた場合は次の待ちに譲る
+                self.release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self) -> None:
+        # 空いた枠は active を減らさずに先頭の待ちへ直接渡す（後から来た呼び出しに追い越させない）
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self.wait_times)
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued": self.queued,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "cancelled": self.cancelled,
+            "wait_seconds": {
+                "mean": round(statistics.mean(waits), 3) if waits else 0.0,
+                "p95": round(waits[min(int(len(waits) * 0.95), len(waits) - 1)], 3) if waits else 0.0,
+                "max": round(waits[-1], 3) if waits else 0.0,
+                "samples": len(waits),
+            },
+        }
+
+
+_lanes: Dict[str, _ModelLane] = {}
+
+
+def _lane(model: str) -> _ModelLane:
+    if model not in _lanes:
+        _lanes[model] = _ModelLane(model, MODEL_CONCURRENCY.get(model, DEFAULT_CONCURRENCY))
+    return _lanes[model]
+
+
+async def run(model: str, factory: Callable[[], Awaitable[Any]], timeout: float = QUEUE_TIMEOUT) -> Any:
+    """
+    モデルの実行枠を取得してから画像生成を実行する
+
+    Args:
+        model: 画像生成モデル名（同時実行数の単位）
+        factory: 画像生成APIを呼び出すコルーチンを返す関数
+        timeout: 実行枠を待つ上限（秒）
+
+    Raises:
+        ImageQueueTimeout: 待ち時間が timeout を超えた場合
+    """
+    lane = _lane(model)
+    queued_at = time.monotonic()
+    try:
+        await lane.acquire(timeout)
+    except asyncio.TimeoutError:
+        lane.timeouts += 1
+        raise ImageQueueTimeout(model, time.monotonic() - queued_at) from None
+    except asyncio.CancelledError:
+        lane.cancelled += 1
+        raise
+    waited = time.monotonic() - queued_at
+    lane.wait_times.append(waited)
+    if waited >= 1.0:
+        print(f"[ImageScheduler] {model} waited {waited:.2f}s for a slot ({lane.queued} still queued)")
+    try:
+        result = await factory()
+    except asyncio.CancelledError:
+        lane.cancelled += 1
+        raise
+    except Exception:
+        lane.failed += 1
+        raise
+    finally:
+        lane.release()
+    lane.completed += 1
+    return result
+
+
+def get_stats() -> Dict[str, Any]:
+    """モデルごとの実行中・待ち行列の件数と待ち時間（このWorkerプロセス分）"""
+    return {
+        "pid": os.getpid(),
+        "default_concurrency": DEFAULT_CONCURRENCY,
+        "queue_timeout": QUEUE_TIMEOUT,
+        "models": {model: lane.stats() for model, lane in _lanes.items()},
+    }
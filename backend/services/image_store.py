@@ -0,0 +1,106 @@
+"""
+生成画像のコンテンツアドレス型ストア
+画像は内容のSHA-256をキーに永続ディスクへ1回だけ保存し（WebP版も作成）、/api/images/{hash} で配信する
+（APIレスポンスやPDF/PPT出力リクエストにBase64の画像データを載せずに済む）
+"""
+import hashlib
+import io
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Optional, Tuple
+
+from backend.services.crud import PERSISTENT_DISK_MOUNT_PATH
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+IMAGE_STORE_DIR = Path(os.getenv("IMAGE_STORE_DIR", str(PERSISTENT_DISK_MOUNT_PATH / "images")))
+WEBP_QUALITY = int(os.getenv("IMAGE_STORE_WEBP_QUALITY", "85"))
+URL_PREFIX = "/api/images/"
+
+_EXTENSIONS = {"image/png": ".png", "image/jpeg": ".jpg", "image/webp": ".webp"}
+_MEDIA_TYPES = {extension: mime_type for mime_type, extension in _EXTENSIONS.items()}
+_HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+def _directory(image_hash: str) -> Path:
+    # 1ディレクトリのファイル数が増えすぎないよう先頭2文字で分ける
+    return IMAGE_STORE_DIR / image_hash[:2]
+
+
+def _write_atomic(path: Path, content: bytes) -> None:
+    # 同じ画像を複数Worker・スレッドが同時に保存しても一時ファイルが衝突しないよう、PIDとスレッドIDを付ける
+    temp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        temp_path.write_bytes(content)
+        os.replace(temp_path, path)
+    finally:
+        temp_path.unlink(missing_ok=True)
+
+
+def _to_webp(image_bytes: bytes) -> Optional[bytes]:
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            buffer = io.BytesIO()
+            image.save(buffer, format="WEBP", quality=WEBP_QUALITY)
+            return buffer.getvalue()
+    except Exception as e:
+        print(f"[ImageStore] WebP conversion failed: {e}")
+        return None
+
+
+def save(image_bytes: bytes, mime_type: str = "image/png") -> str:
+    """画像を保存してハッシュを返す（同じ内容が保存済みなら書き込まない。ファイル書き込みとWebP変換を行うため、イベントループからは offload.run_io 経由で呼ぶ）"""
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    directory = _directory(image_hash)
+    original_path = directory / f"{image_hash}{_EXTENSIONS.get(mime_type, '.png')}"
+    if original_path.exists():
+        return image_hash
+    directory.mkdir(parents=True, exist_ok=True)
+    _write_atomic(original_path, image_bytes)
+    webp_path = directory / f"{image_hash}.webp"
+    if not webp_path.exists():
+        webp_bytes = _to_webp(image_bytes)
+        if webp_bytes:
+            _write_atomic(webp_path, webp_bytes)
+    print(f"[ImageStore] Stored image {image_hash[:12]} ({len(image_bytes)} bytes)")
+    return image_hash
+
+
+def url_for(image_hash: str) -> str:
+    return f"{URL_PREFIX}{image_hash}"
+
+
+def hash_from_url(image_url: Optional[str]) -> Optional[str]:
+    """/api/images/{hash} 形式のURL（ホスト付きも可）からハッシュを取り出す"""
+    if not image_url or URL_PREFIX not in image_url:
+        return None
+    image_hash = image_url.split(URL_PREFIX, 1)[1].split("?", 1)[0].split("/", 1)[0]
+    return image_hash if _HASH_PATTERN.match(image_hash) else None
+
+
+def resolve(image_hash: str, prefer_webp: bool = False) -> Tuple[Optional[Path], Optional[str]]:
+    """ハッシュに対応するファイルとMIMEタイプ（prefer_webp ならWebP版を優先）"""
+    if not _HASH_PATTERN.match(image_hash or ""):
+        return None, None
+    directory = _directory(image_hash)
+    extensions = [".webp", ".png", ".jpg"] if prefer_webp else [".png", ".jpg", ".webp"]
+    for extension in extensions:
+        path = directory / f"{image_hash}{extension}"
+        if path.exists():
+            return path, _MEDIA_TYPES[extension]
+    return None, None
+
+
+def local_path(image_url: Optional[str]) -> Optional[Path]:
+    """ストアの画像URLならローカルの元画像ファイルのパス（PDF/PPT出力用）"""
+    image_hash = hash_from_url(image_url)
+    if image_hash is None:
+        return None
+    return resolve(image_hash)[0]
@@ -0,0 +1,303 @@
+"""
+ペルソナ生成ジョブキュー
+リクエストはジョブIDを即座に返し、生成は各Workerの少数のバックグラウンドタスクで実行する
+（キューはSQLiteに置くため、全Gunicorn Workerで共有され、投入順に公平に処理される）
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from backend.services import offload
+from backend.services.crud import PERSISTENT_DISK_MOUNT_PATH
+
+JOB_DB_PATH = Path(os.getenv("JOB_QUEUE_DB", str(PERSISTENT_DISK_MOUNT_PATH / "job_queue.db")))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))  # Workerプロセスごとの同時実行数
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "900"))  # 実行中ジョブを他Workerが引き継ぐまでの時間
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", "3600"))  # 完了ジョブの保持時間
+POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))  # SSEでの状態確認の間隔
+IDLE_POLL_INTERVAL = float(os.getenv("JOB_IDLE_POLL_INTERVAL", "5"))  # 待機中の確認間隔（同じWorkerへの投入は即座に起こす）
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))  # リース切れで引き継ぐ回数の上限（Workerを異常終了させるジョブ対策）
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED_STATES = (SUCCEEDED, FAILED)
+
+Handler = Callable[[Dict[str, Any], Optional[str]], Awaitable[Any]]
+
+_handlers: Dict[str, Handler] = {}
+_worker_tasks: List[asyncio.Task] = []
+_wakeup: Optional[asyncio.Event] = None
+_conn: Optional[sqlite3.Connection] = None
+_conn_pid: Optional[int] = None
+_lock = threading.Lock()
+_last_cleanup = 0.0
+
+
+def _get_connection() -> sqlite3.Connection:
+    """プロセスごとに1本の接続を使い回す（fork後は開き直す）"""
+    global _conn, _conn_pid
+    if _conn is None or _conn_pid != os.getpid():
+        JOB_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(JOB_DB_PATH), timeout=30.0, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                username TEXT,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER DEFAULT 0,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                lease_expires_at REAL
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs(status, created_at)")
+        conn.commit()
+        _conn = conn
+        _conn_pid = os.getpid()
+    return _conn
+
+
+def register_handler(kind: str, handler: Handler) -> None:
+    """ジョブ種別ごとの実行関数を登録（handler(payload, username) -> JSON化可能な結果）"""
+    _handlers[kind] = handler
+
+
+def _insert(job_id: str, kind: str, payload: Dict[str, Any], username: Optional[str]) -> None:
+    with _lock:
+        conn = _get_connection()
+        conn.execute(
+            "INSERT INTO jobs (job_id, kind, username, payload, status, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, kind, username, json.dumps(payload, ensure_ascii=False), QUEUED, time.time())
+        )
+        conn.commit()
+
+
+async def submit(kind: str, payload: Dict[str, Any], username: Optional[str] = None) -> str:
+    """ジョブをキューに追加してジョブIDを返す（SQLiteへの書き込みはイベントループ外で行う）"""
+    job_id = uuid.uuid4().hex
+    await offload.run_io(_insert, job_id, kind, payload, username)
+    if _wakeup is not None:
+        _wakeup.set()
+    print(f"[JobQueue] Submitted {kind} job {job_id}")
+    return job_id
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """ジョブの状態と結果を取得（未登録ならNone）"""
+    with _lock:
+        conn = _get_connection()
+        row = conn.execute(
+            "SELECT kind, username, status, result, error, created_at, started_at, finished_at "
+            "FROM jobs WHERE job_id = ?",
+            (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        kind, username, status, result, error, created_at, started_at, finished_at = row
+        position = None
+        if status == QUEUED:
+            position = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at <= ?",
+                (QUEUED, created_at)
+            ).fetchone()[0]
+    return {
+        "job_id": job_id,
+        "kind": kind,
+        "username": username,
+        "status": status,
+        "queue_position": position,
+        "result": json.loads(result) if result else None,
+        "error": json.loads(error) if error else None,
+        "created_at": created_at,
+        "started_at": started_at,
+        "finished_at": finished_at,
+    }
+
+
+async def get_job_async(job_id: str) -> Optional[Dict[str, Any]]:
+    """get_job をイベントループ外で実行する"""
+    return await offload.run_io(get_job, job_id)
+
+
+def _claim_next() -> Optional[Dict[str, Any]]:
+    """
+    最も古い待機中ジョブ（またはリース切れの実行中ジョブ）を取得して実行中にする
+
+    対象が無い間は読み取りだけで済ませ、書き込みロックを取らない。
+    JOB_MAX_ATTEMPTS 回実行してもリース切れになったジョブは引き継がずに失敗にする
+    """
+    with _lock:
+        conn = _get_connection()
+        now = time.time()
+        kinds = list(_handlers.keys())
+        if not kinds:
+            return None
+        placeholders = ",".join("?" for _ in kinds)
+        pending = conn.execute(
+            f"SELECT 1 FROM jobs WHERE kind IN ({placeholders}) "
+            f"AND (status = ? OR (status = ? AND lease_expires_at < ?)) LIMIT 1",
+            (*kinds, QUEUED, RUNNING, now)
+        ).fetchone()
+        if pending is None:
+            return None
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            abandoned = conn.execute(
+                f"UPDATE jobs SET status = ?, error = ?, finished_at = ?, lease_expires_at = NULL "
+                f"WHERE kind IN ({placeholders}) AND status = ? AND lease_expires_at < ? AND attempts >= ?",
+                (
+                    FAILED,
+                    json.dumps({"error": f"Job did not finish after {JOB_MAX_ATTEMPTS} attempts", "error_type": "JobAbandoned"}),
+                    now, *kinds, RUNNING, now, JOB_MAX_ATTEMPTS
+                )
+            ).rowcount
+            if abandoned:
+                print(f"[JobQueue] Gave up on {abandoned} job(s) after {JOB_MAX_ATTEMPTS} attempts")
+            row = conn.execute(
+                f"SELECT job_id, kind, username, payload FROM jobs "
+                f"WHERE kind IN ({placeholders}) "
+                f"AND (status = ? OR (status = ? AND lease_expires_at < ?)) "
+                f"ORDER BY created_at LIMIT 1",
+                (*kinds, QUEUED, RUNNING, now)
+            ).fetchone()
+            if row is None:
+                conn.commit()
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, started_at = ?, lease_expires_at = ?, attempts = attempts + 1 "
+                "WHERE job_id = ?",
+                (RUNNING, now, now + JOB_LEASE_SECONDS, row[0])
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    job_id, kind, username, payload = row
+    return {"job_id": job_id, "kind": kind, "username": username, "payload": json.loads(payload)}
+
+
+def _finish(job_id: str, status: str, result: Any = None, error: Optional[Dict[str, Any]] = None) -> None:
+    with _lock:
+        conn = _get_connection()
+        conn.execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_expires_at = NULL "
+            "WHERE job_id = ?",
+            (
+                status,
+                json.dumps(result, ensure_ascii=False) if result is not None else None,
+                json.dumps(error, ensure_ascii=False) if error is not None else None,
+                time.time(),
+                job_id
+            )
+        )
+        conn.commit()
+
+
+def _cleanup() -> None:
+    """保持時間を過ぎた完了ジョブを削除（1分に1回まで）"""
+    global _last_cleanup
+    now = time.time()
+    if now - _last_cleanup < 60:
+        return
+    _last_cleanup = now
+    with _lock:
+        conn = _get_connection()
+        conn.execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+            (*FINISHED_STATES, now - JOB_RESULT_TTL)
+        )
+        conn.commit()
+
+
+async def _run_job(job: Dict[str, Any]) -> None:
+    job_id = job["job_id"]
+    start = time.time()
+    print(f"[JobQueue] Running {job['kind']} job {job_id}")
+    try:
+        result = await _handlers[job["kind"]](job["payload"], job["username"])
+    except asyncio.CancelledError:
+        # シャットダウン時はリース切れ後に他Workerが再実行する
+        raise
+    except Exception as e:
+        print(f"[JobQueue] Job {job_id} failed: {type(e).__name__}: {e}")
+        await offload.run_io(_finish, job_id, FAILED, error={"error": str(e), "error_type": type(e).__name__})
+        return
+    await offload.run_io(_finish, job_id, SUCCEEDED, result=result)
+    print(f"[JobQueue] Job {job_id} completed in {time.time() - start:.2f} seconds")
+
+
+async def _worker_loop(index: int) -> None:
+    while True:
+        try:
+            # SQLiteの読み書き（busy_timeout で待つ場合がある）はイベントループ外で行う
+            await offload.run_io(_cleanup)
+            job = await offload.run_io(_claim_next)
+        except Exception as e:
+            print(f"[JobQueue] Worker {index} failed to claim a job: {e}")
+            job = None
+        if job is None:
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=IDLE_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            _wakeup.clear()
+            continue
+        try:
+            await _run_job(job)
+        except Exception as e:
+            # 結果の保存に失敗しても（JSON化できない結果・database is locked など）Workerは止めない
+            print(f"[JobQueue] Worker {index} failed to finish job {job['job_id']}: {type(e).__name__}: {e}")
+            try:
+                await offload.run_io(
+                    _finish, job["job_id"], FAILED,
+                    error={"error": f"Failed to store the job result: {e}", "error_type": type(e).__name__}
+                )
+            except Exception as finish_error:
+                # 失敗として記録できない場合はリース切れ後に再実行される（JOB_MAX_ATTEMPTS まで）
+                print(f"[JobQueue] Could not mark job {job['job_id']} as failed: {finish_error}")
+
+
+def start() -> None:
+    """バックグラウンドのジョブ実行タスクを起動（アプリ起動時に1回）"""
+    global _wakeup
+    if _worker_tasks:
+        return
+    _wakeup = asyncio.Event()
+    for index in range(JOB_WORKERS):
+        _worker_tasks.append(asyncio.create_task(_worker_loop(index)))
+    print(f"[JobQueue] Started {JOB_WORKERS} job workers (pid {os.getpid()})")
+
+
+async def stop() -> None:
+    """ジョブ実行タスクを停止（アプリ終了時）"""
+    for task in _worker_tasks:
+        task.cancel()
+    await asyncio.gather(*_worker_tasks, return_exceptions=True)
+    _worker_tasks.clear()
+
+
+def get_stats() -> Dict[str, Any]:
+    """状態ごとのジョブ数"""
+    with _lock:
+        conn = _get_connection()
+        rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+    return {
+        "counts": {status: count for status, count in rows},
+        "workers_per_process": JOB_WORKERS,
+    }
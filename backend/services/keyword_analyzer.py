@@ -1,46 +1,93 @@
 """
 キーワード分析のためのユーティリティ関数
 """
-from typing import List, Dict, Tuple
+from collections import Counter
+from typing import Dict, Iterable, List, Set, Tuple
 import re
 
+# カテゴリ判定のキーワードパターン（上から順に優先。どれにも当たらなければ OTHER_CATEGORY）
+CATEGORY_PATTERNS = {
+    "症状・不安": ["症状", "痛み", "つらい", "不安", "心配", "怖い", "悪化"],
+    "原因・理解": ["原因", "なぜ", "理由", "メカニズム", "仕組み", "とは"],
+    "治療・対策": ["治療", "手術", "薬", "改善", "対策", "方法", "治す"],
+    "医療機関": ["病院", "クリニック", "医院", "名医", "評判", "どこ"],
+    "費用・保険": ["費用", "料金", "保険", "値段", "価格", "いくら"],
+    "体験談・口コミ": ["体験", "口コミ", "評価", "ブログ", "感想", "レビュー"],
+    "予防・生活習慣": ["予防", "運動", "食事", "生活", "習慣", "ケア"]
+}
+OTHER_CATEGORY = "その他"
+EMOTIONAL_PATTERNS = [
+    "不安", "心配", "怖い", "つらい", "痛い", "苦しい",
+    "悩み", "ストレス", "うつ", "イライラ", "焦り",
+    "希望", "安心", "改善", "治る", "良くなる"
+]
+_EMOTIONAL_LABEL = ""  # カテゴリ名と重ならない感情パターンの印
+
+
+def _build_matcher() -> Tuple["re.Pattern", Dict[str, Set[str]]]:
+    """
+    カテゴリ・感情の全パターンを1つの正規表現にまとめる
+
+    先読みで全位置のマッチを取り（同じ位置では長いパターン優先）、
+    マッチしたパターンに含まれる短いパターンのラベルもまとめて付けるため、
+    キーワードに含まれる全パターンを1回の走査で求められる
+    """
+    labels: Dict[str, Set[str]] = {}
+    for category, pattern_list in CATEGORY_PATTERNS.items():
+        for pattern in pattern_list:
+            labels.setdefault(pattern, set()).add(category)
+    for pattern in EMOTIONAL_PATTERNS:
+        labels.setdefault(pattern, set()).add(_EMOTIONAL_LABEL)
+    closure = {
+        pattern: set().union(*(labels[other] for other in labels if other in pattern))
+        for pattern in labels
+    }
+    alternatives = "|".join(re.escape(pattern) for pattern in sorted(labels, key=len, reverse=True))
+    return re.compile(f"(?=({alternatives}))"), closure
+
+_MATCHER, _PATTERN_LABELS = _build_matcher()
+
+
+def classify_keyword(keyword: str) -> Tuple[str, bool]:
+    """キーワードの (カテゴリ, 感情的なキーワードか) を判定"""
+    labels: Set[str] = set()
+    for match in _MATCHER.finditer(keyword or ""):
+        labels |= _PATTERN_LABELS[match.group(1)]
+    category = next((category for category in CATEGORY_PATTERNS if category in labels), OTHER_CATEGORY)
+    return category, _EMOTIONAL_LABEL in labels
+
+
+def classify_keywords(keywords: Iterable[str]) -> Tuple[List[str], List[bool]]:
+    """キーワード列をまとめて判定（CSVの取り込み時に列として保存する用）"""
+    categories: List[str] = []
+    emotional: List[bool] = []
+    for keyword in keywords:
+        category, is_emotional = classify_keyword(keyword if isinstance(keyword, str) else "")
+        categories.append(category)
+        emotional.append(is_emotional)
+    return categories, emotional
+
+
+def _category_of(keyword_data: Dict) -> str:
+    # 取り込み時に判定済みのカテゴリがあればそれを使う
+    category = keyword_data.get('category')
+    if category in CATEGORY_PATTERNS or category == OTHER_CATEGORY:
+        return category
+    return classify_keyword(keyword_data.get('keyword', ''))[0]
+
+
+def _is_emotional(keyword_data: Dict) -> bool:
+    emotional = keyword_data.get('emotional')
+    if isinstance(emotional, bool):
+        return emotional
+    return classify_keyword(keyword_data.get('keyword', ''))[1]
+
+
 def categorize_keywords(keywords: List[Dict]) -> Dict[str, List[Dict]]:
     """検索キーワードをカテゴリ別に分類"""
-    categories = {
-        "症状・不安": [],
-        "原因・理解": [],
-        "治療・対策": [],
-        "医療機関": [],
-        "費用・保険": [],
-        "体験談・口コミ": [],
-        "予防・生活習慣": [],
-        "その他": []
-    }
-    
-    # カテゴリ判定のキーワードパターン
-    patterns = {
-        "症状・不安": ["症状", "痛み", "つらい", "不安", "心配", "怖い", "悪化"],
-        "原因・理解": ["原因", "なぜ", "理由", "メカニズム", "仕組み", "とは"],
-        "治療・対策": ["治療", "手術", "薬", "改善", "対策", "方法", "治す"],
-        "医療機関": ["病院", "クリニック", "医院", "名医", "評判", "どこ"],
-        "費用・保険": ["費用", "料金", "保険", "値段", "価格", "いくら"],
-        "体験談・口コミ": ["体験", "口コミ", "評価", "ブログ", "感想", "レビュー"],
-        "予防・生活習慣": ["予防", "運動", "食事", "生活", "習慣", "ケア"]
-    }
-    
+    categories = {category: [] for category in [*CATEGORY_PATTERNS, OTHER_CATEGORY]}
     for keyword_data in keywords:
-        keyword = keyword_data.get('keyword', '')
-        categorized = False
-        
-        for category, pattern_list in patterns.items():
-            if any(pattern in keyword for pattern in pattern_list):
-                categories[category].append(keyword_data)
-                categorized = True
-                break
-        
-        if not categorized:
-            categories["その他"].append(keyword_data)
-    
+        categories[_category_of(keyword_data)].append(keyword_data)
     return categories
 
 def calculate_demographic_match(keywords: List[Dict], target_gender: str, target_age: str) -> float:
@@ -83,8 +130,11 @@ def calculate_demographic_match(keywords: List[Dict], target_gender: str, target
 
 def analyze_search_patterns(pre_keywords: List[Dict], post_keywords: List[Dict]) -> Dict:
     """診断前後の検索パターンを分析"""
-    pre_categories = categorize_keywords(pre_keywords)
-    post_categories = categorize_keywords(post_keywords)
+    # 判定済みのカテゴリで件数を集計する
+    pre_categories = Counter({category: 0 for category in [*CATEGORY_PATTERNS, OTHER_CATEGORY]})
+    pre_categories.update(_category_of(keyword_data) for keyword_data in pre_keywords)
+    post_categories = Counter({category: 0 for category in [*CATEGORY_PATTERNS, OTHER_CATEGORY]})
+    post_categories.update(_category_of(keyword_data) for keyword_data in post_keywords)
     
     analysis = {
         "pre_diagnosis_focus": [],
@@ -95,19 +145,19 @@ def analyze_search_patterns(pre_keywords: List[Dict], post_keywords: List[Dict])
     }
     
     # 診断前の主要な関心事を特定
-    for category, keywords in pre_categories.items():
-        if len(keywords) > len(pre_keywords) * 0.2:  # 20%以上を占める
+    for category, count in pre_categories.items():
+        if count > len(pre_keywords) * 0.2:  # 20%以上を占める
             analysis["pre_diagnosis_focus"].append(category)
     
     # 診断後の主要な関心事を特定
-    for category, keywords in post_categories.items():
-        if len(keywords) > len(post_keywords) * 0.2:
+    for category, count in post_categories.items():
+        if count > len(post_keywords) * 0.2:
             analysis["post_diagnosis_focus"].append(category)
     
     # カテゴリシフトを計算
     for category in pre_categories.keys():
-        pre_ratio = len(pre_categories[category]) / max(len(pre_keywords), 1)
-        post_ratio = len(post_categories[category]) / max(len(post_keywords), 1)
+        pre_ratio = pre_categories[category] / max(len(pre_keywords), 1)
+        post_ratio = post_categories[category] / max(len(post_keywords), 1)
         shift = post_ratio - pre_ratio
         if abs(shift) > 0.1:  # 10%以上の変化
             analysis["category_shift"][category] = shift
@@ -121,7 +171,7 @@ def analyze_search_patterns(pre_keywords: List[Dict], post_keywords: List[Dict])
             analysis["urgency_level"] = "medium"
     
     # 解決志向度を計算
-    solution_keywords = len(post_categories["治療・対策"]) + len(post_categories["医療機関"])
+    solution_keywords = post_categories["治療・対策"] + post_categories["医療機関"]
     if post_keywords:
         analysis["solution_seeking_rate"] = solution_keywords / len(post_keywords)
     
@@ -129,18 +179,4 @@ def analyze_search_patterns(pre_keywords: List[Dict], post_keywords: List[Dict])
 
 def extract_emotional_keywords(keywords: List[Dict]) -> List[str]:
     """感情的なキーワードを抽出"""
-    emotional_patterns = [
-        "不安", "心配", "怖い", "つらい", "痛い", "苦しい",
-        "悩み", "ストレス", "うつ", "イライラ", "焦り",
-        "希望", "安心", "改善", "治る", "良くなる"
-    ]
-    
-    emotional_keywords = []
-    for keyword_data in keywords:
-        keyword = keyword_data.get('keyword', '')
-        for pattern in emotional_patterns:
-            if pattern in keyword:
-                emotional_keywords.append(keyword)
-                break
-    
-    return emotional_keywords
\ No newline at end of file
+    return [keyword_data.get('keyword', '') for keyword_data in keywords if _is_emotional(keyword_data)]
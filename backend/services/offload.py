@@ -0,0 +1,134 @@
+"""
+同期処理のイベントループ外での実行
+ファイル・DB読み込みなどのI/Oはスレッドプール、PDF/PPT作成などCPU負荷の高い処理は専用のプールで実行し、
+1件の重い処理が同じWorkerの他のリクエストを止めないようにする
+（CPU用のプールは既定でスレッド。OFFLOAD_CPU_MODE=process ではspawnした子プロセスを使うが、
+子プロセスは呼び出す関数のモジュール（backend.main など）を読み込み直すため、Workerと同程度のメモリを追加で使う）
+（イベントループが OFFLOAD_LOOP_BLOCK_MS 以上止まった場合は、処理中だったリクエストと一緒にログに出す）
+"""
+import asyncio
+import contextvars
+import functools
+import multiprocessing
+import os
+import pickle
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Deque, Dict, Optional
+
+IO_THREADS = int(os.getenv("OFFLOAD_IO_THREADS", "16"))  # Workerプロセスごとのスレッド数
+CPU_PROCESSES = int(os.getenv("OFFLOAD_CPU_PROCESSES", "1"))  # Workerプロセスごとのプロセス数
+CPU_MODE = os.getenv("OFFLOAD_CPU_MODE", "thread").lower()  # thread / process（メモリに余裕がある環境向け）
+LOOP_BLOCK_MS = float(os.getenv("OFFLOAD_LOOP_BLOCK_MS", "100"))  # これ以上イベントループが止まったらログに出す
+LOOP_MONITOR_INTERVAL = 0.05
+RECENT_BLOCKS = 50
+
+_io_executor: Optional[ThreadPoolExecutor] = None
+_cpu_executor = None
+_executor_pid: Optional[int] = None
+_in_flight: Counter = Counter()
+_blocks: Deque[Dict[str, Any]] = deque(maxlen=RECENT_BLOCKS)
+_stats = {"io_calls": 0, "cpu_calls": 0, "cpu_fallbacks": 0, "loop_blocks": 0, "max_block_ms": 0.0}
+
+
+def _executors():
+    """プロセスごとにプールを作成（fork後は作り直す）"""
+    global _io_executor, _cpu_executor, _executor_pid
+    if _executor_pid != os.getpid():
+        _io_executor = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="offload-io")
+        if CPU_MODE == "process":
+            # Workerはスレッドを持つためforkせず、spawnで起動した子プロセスを使い回す
+            _cpu_executor = ProcessPoolExecutor(
+                max_workers=CPU_PROCESSES, mp_context=multiprocessing.get_context("spawn")
+            )
+        else:
+            _cpu_executor = ThreadPoolExecutor(max_workers=CPU_PROCESSES, thread_name_prefix="offload-cpu")
+        _executor_pid = os.getpid()
+    return _io_executor, _cpu_executor
+
+
+async def run_io(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """ブロッキングI/O（ファイル・SQLite・同期HTTP）をスレッドプールで実行する"""
+    io_executor, _ = _executors()
+    _stats["io_calls"] += 1
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(io_executor, call)
+
+
+async def run_cpu(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    CPU負荷の高い処理をCPU用のプールで実行する
+
+    プロセスモードでは func と引数・戻り値はpickleできること（モジュールのトップレベル関数）。
+    pickleできない呼び出しはI/Oスレッドプールで実行する
+    """
+    global _cpu_executor
+    _, cpu_executor = _executors()
+    _stats["cpu_calls"] += 1
+    call = functools.partial(func, *args, **kwargs)
+    if isinstance(cpu_executor, ProcessPoolExecutor):
+        try:
+            # 子プロセスに渡せない呼び出しは送る前に判定する（処理中の例外と区別するため）
+            pickle.dumps(call)
+        except Exception as e:
+            print(f"[Offload] {getattr(func, '__name__', func)} cannot run in a subprocess, using a thread: {e}")
+            _stats["cpu_fallbacks"] += 1
+            return await run_io(func, *args, **kwargs)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(cpu_executor, call)
+    except BrokenProcessPool as e:
+        # 子プロセスが異常終了した場合は次の呼び出しのためにプールを作り直す
+        print(f"[Offload] Process pool broken, recreating it: {e}")
+        _cpu_executor = ProcessPoolExecutor(max_workers=CPU_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+        raise
+
+
+class InFlightRequestsMiddleware:
+    """処理中のリクエスト（メソッド・パス）を記録するASGIミドルウェア（イベントループ停止時のログ用）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        key = f"{scope['method']} {scope['path']}"
+        _in_flight[key] += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _in_flight[key] -= 1
+            if _in_flight[key] <= 0:
+                del _in_flight[key]
+
+
+async def monitor_event_loop(threshold_ms: float = LOOP_BLOCK_MS) -> None:
+    """イベントループの遅延を計測し、threshold_ms を超えたら処理中のリクエストと一緒に記録する"""
+    while True:
+        expected = time.monotonic() + LOOP_MONITOR_INTERVAL
+        await asyncio.sleep(LOOP_MONITOR_INTERVAL)
+        blocked_ms = (time.monotonic() - expected) * 1000
+        if blocked_ms < threshold_ms:
+            continue
+        requests = sorted(_in_flight)
+        _stats["loop_blocks"] += 1
+        _stats["max_block_ms"] = max(_stats["max_block_ms"], round(blocked_ms, 1))
+        _blocks.append({"at": time.time(), "blocked_ms": round(blocked_ms, 1), "in_flight": requests})
+        print(f"[Offload] Event loop blocked for {blocked_ms:.0f}ms (in flight: {', '.join(requests) or 'none'})")
+
+
+def get_stats() -> Dict[str, Any]:
+    """プールの設定とイベントループの停止回数（このWorkerプロセス分）"""
+    return {
+        "pid": os.getpid(),
+        "io_threads": IO_THREADS,
+        "cpu_mode": CPU_MODE,
+        "cpu_processes": CPU_PROCESSES,
+        "loop_block_threshold_ms": LOOP_BLOCK_MS,
+        **_stats,
+        "in_flight": dict(_in_flight),
+        "recent_blocks": list(_blocks),
+    }
@@ -0,0 +1,197 @@
+"""
+ペルソナ画像（顔写真）ライブラリ
+画像プロンプトは年齢・性別・職業だけで決まるため、（年代・性別・職業区分）ごとに生成済みの画像を保存し、
+十分な枚数が揃った区分では画像生成APIを呼ばずにその中からランダムに再利用する
+（画像本体は image_store、メタデータはSQLiteで永続ディスクに置くため、全Gunicorn Workerで共有され、再デプロイ後も残る）
+"""
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from backend.services import image_store
+from backend.services.crud import PERSISTENT_DISK_MOUNT_PATH
+
+LIBRARY_DB_PATH = Path(os.getenv("PORTRAIT_LIBRARY_DB", str(PERSISTENT_DISK_MOUNT_PATH / "portrait_library.db")))
+LIBRARY_ENABLED = os.getenv("PORTRAIT_LIBRARY_ENABLED", "true").lower() == "true"
+MIN_VARIANTS = int(os.getenv("PORTRAIT_MIN_VARIANTS", "5"))  # この枚数に満たない区分は新規生成して追加する
+
+# 職業区分（上から順に判定）: (区分, 判定キーワード, 画像プロンプト用の説明)
+OCCUPATION_CLASSES: List[Tuple[str, Tuple[str, ...], str]] = [
+    ("doctor", ("医師", "医者", "doctor"), "a doctor"),
+    ("nurse", ("看護", "nurse"), "a nurse"),
+    ("student", ("学生", "生徒", "student"), "a student"),
+    ("homemaker", ("主婦", "主夫", "専業", "homemaker"), "a homemaker"),
+    ("retired", ("無職", "退職", "年金", "retired"), "a retiree"),
+    ("self_employed", ("自営", "経営", "個人事業", "フリーランス", "freelance"), "a self-employed business owner"),
+    ("manual", ("工", "建設", "運転", "ドライバー", "農", "漁", "製造", "作業"), "a manual worker"),
+    ("service", ("販売", "店", "接客", "飲食", "サービス", "介護", "美容"), "a service industry worker"),
+    ("office", ("会社員", "公務員", "事務", "営業", "社員", "管理職", "エンジニア", "office"), "an office worker"),
+]
+OTHER_OCCUPATION = ("other", "")
+
+_conn: Optional[sqlite3.Connection] = None
+_conn_pid: Optional[int] = None
+_lock = threading.Lock()
+
+
+def _get_connection() -> sqlite3.Connection:
+    """プロセスごとに1本の接続を使い回す（fork後は開き直す）"""
+    global _conn, _conn_pid
+    if _conn is None or _conn_pid != os.getpid():
+        LIBRARY_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(LIBRARY_DB_PATH), timeout=30.0, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS portraits (
+                portrait_id TEXT PRIMARY KEY,
+                age_bucket TEXT NOT NULL,
+                gender TEXT NOT NULL,
+                occupation_class TEXT NOT NULL,
+                model TEXT NOT NULL,
+                image_hash TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                use_count INTEGER DEFAULT 0
+            )
+        ''')
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_portraits_bucket ON portraits(age_bucket, gender, occupation_class)"
+        )
+        conn.commit()
+        _conn = conn
+        _conn_pid = os.getpid()
+    return _conn
+
+
+def age_bucket(age) -> str:
+    """年齢入力（"45", "45y3m", 45 など）を年代（"40s"）に変換。不明なら "unknown" """
+    match = re.search(r'(\d+)', str(age or ""))
+    if not match:
+        return "unknown"
+    decade = min(max(int(match.group(1)) // 10, 1), 7)
+    return f"{decade * 10}s"
+
+
+def normalize_gender(gender) -> str:
+    value = str(gender or "").strip().lower()
+    if value in ("male", "man", "男性", "男"):
+        return "male"
+    if value in ("female", "woman", "女性", "女"):
+        return "female"
+    return "other"
+
+
+def occupation_class(occupation) -> Tuple[str, str]:
+    """職業の自由入力を (職業区分, 画像プロンプト用の説明) に分類"""
+    text = str(occupation or "").lower()
+    if text:
+        for name, keywords, description in OCCUPATION_CLASSES:
+            if any(keyword.lower() in text for keyword in keywords):
+                return name, description
+    return OTHER_OCCUPATION
+
+
+def bucket_for(data: Dict) -> Tuple[str, str, str]:
+    """入力データから (年代, 性別, 職業区分) のライブラリ区分を作成"""
+    return age_bucket(data.get("age")), normalize_gender(data.get("gender")), occupation_class(data.get("occupation"))[0]
+
+
+def pick(bucket: Tuple[str, str, str]) -> Optional[str]:
+    """
+    区分の画像をランダムに1枚選んで /api/images/{hash} のURLで返す
+
+    保存枚数が MIN_VARIANTS 未満の区分、または画像ファイルが見つからない場合はNone（新規生成させる）
+    """
+    if not LIBRARY_ENABLED:
+        return None
+    try:
+        with _lock:
+            conn = _get_connection()
+            rows = conn.execute(
+                "SELECT portrait_id, image_hash FROM portraits "
+                "WHERE age_bucket = ? AND gender = ? AND occupation_class = ?",
+                bucket
+            ).fetchall()
+        if len(rows) < MIN_VARIANTS:
+            print(f"[Portraits] Bucket {bucket} has {len(rows)}/{MIN_VARIANTS} variants, generating a new one")
+            return None
+        portrait_id, image_hash = random.choice(rows)
+        if image_store.resolve(image_hash)[0] is None:
+            print(f"[Portraits] Image for portrait {portrait_id} is missing, generating a new one")
+            return None
+        with _lock:
+            conn = _get_connection()
+            conn.execute("UPDATE portraits SET use_count = use_count + 1 WHERE portrait_id = ?", (portrait_id,))
+            conn.commit()
+        print(f"[Portraits] Reusing portrait {portrait_id} for {bucket}")
+        return image_store.url_for(image_hash)
+    except Exception as e:
+        print(f"[Portraits] Lookup failed, generating a new image: {e}")
+        return None
+
+
+def add(bucket: Tuple[str, str, str], model: str, image_hash: str) -> Optional[str]:
+    """image_store に保存済みの生成画像をライブラリに追加してIDを返す（失敗時はNone）"""
+    if not LIBRARY_ENABLED:
+        return None
+    portrait_id = uuid.uuid4().hex
+    try:
+        with _lock:
+            conn = _get_connection()
+            conn.execute(
+                "INSERT INTO portraits (portrait_id, age_bucket, gender, occupation_class, model, image_hash, "
+                "created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (portrait_id, *bucket, model, image_hash, time.time())
+            )
+            conn.commit()
+        print(f"[Portraits] Added portrait {portrait_id} to {bucket}")
+        return portrait_id
+    except Exception as e:
+        print(f"[Portraits] Failed to store portrait: {e}")
+        return None
+
+
+def get_stats() -> Dict:
+    """区分ごとの保存枚数と再利用回数"""
+    with _lock:
+        conn = _get_connection()
+        rows = conn.execute(
+            "SELECT age_bucket, gender, occupation_class, COUNT(*), SUM(use_count) FROM portraits "
+            "GROUP BY age_bucket, gender, occupation_class ORDER BY age_bucket, gender, occupation_class"
+        ).fetchall()
+    return {
+        "enabled": LIBRARY_ENABLED,
+        "min_variants": MIN_VARIANTS,
+        "total_portraits": sum(row[3] for row in rows),
+        "total_reuses": sum(row[4] or 0 for row in rows),
+        "buckets": [
+            {"age_bucket": age, "gender": gender, "occupation_class": occupation, "count": count, "reuses": reuses or 0}
+            for age, gender, occupation, count, reuses in rows
+        ]
+    }
+
+
+def delete(age: Optional[str] = None, gender: Optional[str] = None, occupation: Optional[str] = None) -> int:
+    """
+    条件に一致する画像をライブラリから外し（条件なしで全件）、件数を返す
+
+    画像ファイルは生成済みペルソナから参照されている可能性があるため image_store に残す
+    """
+    conditions, params = [], []
+    for column, value in (("age_bucket", age), ("gender", gender), ("occupation_class", occupation)):
+        if value:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    with _lock:
+        conn = _get_connection()
+        cursor = conn.execute(f"DELETE FROM portraits{where}", params)
+        conn.commit()
+    return cursor.rowcount
@@ -0,0 +1,81 @@
+"""
+RAGデータの上位キーワードの並べ替え
+診療科（診療科_主訴）1つ分の列をNumPy配列にして特徴度・検索ボリュームの降順に並べ、
+年代・性別の絞り込みをベクトル演算のマスク、上位k件を先頭からのスライスで求める
+（取り込み時の rag_topk の作成と、rag_topk より多い件数の検索で使う）
+"""
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+AGE_GROUPS = ("10s", "20s", "30s", "40s", "50s", "60s", "70s")
+AGE_THRESHOLD = 15  # 該当年代の割合(%)がこの値を超えるキーワードに絞る
+
+# SpecialtyIndex に渡す行の列順（rag_data テーブルの列名）
+COLUMNS = (
+    "keyword", "search_volume", "male_ratio", "female_ratio",
+    "age_10s", "age_20s", "age_30s", "age_40s", "age_50s", "age_60s", "age_70s",
+    "category", "distinctiveness",
+)
+
+
+class SpecialtyIndex:
+    """1診療科分のキーワード列（特徴度・検索ボリュームの降順）"""
+
+    __slots__ = ("keywords", "search_volume", "male_ratio", "female_ratio", "ages", "categories", "distinctiveness")
+
+    def __init__(self, rows: Sequence[Sequence[Any]]):
+        columns = list(zip(*rows)) if rows else [()] * len(COLUMNS)
+
+        def numbers(values, dtype):
+            return np.array([value or 0 for value in values], dtype=dtype)
+
+        search_volume = numbers(columns[1], np.int64)
+        distinctiveness = numbers(columns[12], np.float64)
+        keywords = np.array(columns[0], dtype=object)
+        # 特徴度・検索ボリュームが同じ場合はキーワード順（DBの読み出し順によらず結果を一定にする）
+        order = np.lexsort((keywords.astype(str), -search_volume, -distinctiveness))
+        self.keywords = keywords[order]
+        self.search_volume = search_volume[order]
+        self.male_ratio = numbers(columns[2], np.int16)[order]
+        self.female_ratio = numbers(columns[3], np.int16)[order]
+        self.ages = np.column_stack([numbers(columns[4 + i], np.int16) for i in range(len(AGE_GROUPS))])[order]
+        self.categories = np.array([value or "" for value in columns[11]], dtype=object)[order]
+        self.distinctiveness = distinctiveness[order]
+
+    def __len__(self) -> int:
+        return len(self.keywords)
+
+    def search(self, age_group: Optional[str] = None, gender: Optional[str] = None, limit: int = 10) -> List[Dict]:
+        """search_rag_data と同じ条件・順序で上位 limit 件を返す"""
+        mask = None
+        if age_group in AGE_GROUPS:
+            mask = self.ages[:, AGE_GROUPS.index(age_group)] > AGE_THRESHOLD
+        if gender in ("male", "female"):
+            gender_mask = self.male_ratio > self.female_ratio if gender == "male" else self.female_ratio > self.male_ratio
+            mask = gender_mask if mask is None else mask & gender_mask
+        if mask is None:
+            positions = np.arange(min(limit, len(self)))
+        else:
+            positions = np.flatnonzero(mask)[:limit]
+
+        results = []
+        for keyword, volume, male, female, ages, category, distinctiveness in zip(
+            self.keywords[positions].tolist(),
+            self.search_volume[positions].tolist(),
+            self.male_ratio[positions].tolist(),
+            self.female_ratio[positions].tolist(),
+            self.ages[positions].tolist(),
+            self.categories[positions].tolist(),
+            self.distinctiveness[positions].tolist(),
+        ):
+            results.append({
+                "keyword": keyword,
+                "search_volume": volume,
+                "male_ratio": male,
+                "female_ratio": female,
+                "age_demographics": dict(zip(AGE_GROUPS, ages)),
+                "category": category,
+                "distinctiveness": distinctiveness,
+            })
+        return results
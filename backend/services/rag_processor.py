@@ -1,4 +1,5 @@
 import sqlite3
+import numpy as np
 import pandas as pd
 import os
 from pathlib import Path
@@ -7,6 +8,10 @@ from typing import List, Dict, Optional
 import json
 import glob
 import platform
+import threading
+from contextlib import contextmanager
+
+from backend.services import columnar_cache, keyword_analyzer, offload, rag_index
 
 # 診療科の英語→日本語マッピング
 DEPARTMENT_MAP = {
@@ -31,9 +36,99 @@ DEPARTMENT_MAP = {
 PERSISTENT_DISK_MOUNT_PATH = Path("./app_settings")
 RAG_DB_PATH = PERSISTENT_DISK_MOUNT_PATH / "rag_data.db"
 
+# デプロイ時に manage_rag_data.py build で作成する読み取り専用のRAG DB（全CSVを取り込み・インデックス作成済み）
+# 存在する場合は検索にこれを使い、起動時の書き込みとリクエスト中のCSV遅延読み込みを行わない
+RAG_ARTIFACT_PATH = Path(os.getenv("RAG_ARTIFACT_PATH", str(PERSISTENT_DISK_MOUNT_PATH / "rag_data.prebuilt.db")))
+
 # 本番環境でもローカルDBを使用することを明示
 print(f"[RAG] Using code-based database at: {RAG_DB_PATH}")
 
+RAG_SCHEMA = (
+    # RAGデータテーブル
+    '''
+    CREATE TABLE IF NOT EXISTS rag_data (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        specialty TEXT NOT NULL,
+        rank_order INTEGER,
+        keyword TEXT NOT NULL,
+        search_volume INTEGER,
+        duplicate_volume INTEGER,
+        distinctiveness REAL,
+        time_difference REAL,
+        male_ratio INTEGER,
+        female_ratio INTEGER,
+        age_10s INTEGER,
+        age_20s INTEGER,
+        age_30s INTEGER,
+        age_40s INTEGER,
+        age_50s INTEGER,
+        age_60s INTEGER,
+        age_70s INTEGER,
+        category TEXT,
+        uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(specialty, keyword)
+    )
+    ''',
+    # アップロード履歴テーブル
+    '''
+    CREATE TABLE IF NOT EXISTS upload_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        specialty TEXT NOT NULL,
+        filename TEXT NOT NULL,
+        file_size INTEGER,
+        record_count INTEGER,
+        uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    # 取り込み済みCSVの一覧（パスは rag/各診療科 からの相対パス）
+    '''
+    CREATE TABLE IF NOT EXISTS rag_manifest (
+        path TEXT PRIMARY KEY,
+        specialty TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mtime REAL NOT NULL,
+        sha256 TEXT NOT NULL,
+        row_count INTEGER NOT NULL
+    )
+    ''',
+    # 年代・性別ごとの上位キーワード（取り込み時に作成。age_group / gender は絞り込みなしを空文字で表す）
+    '''
+    CREATE TABLE IF NOT EXISTS rag_topk (
+        specialty TEXT NOT NULL,
+        age_group TEXT NOT NULL,
+        gender TEXT NOT NULL,
+        keyword_count INTEGER NOT NULL,
+        results TEXT NOT NULL,
+        PRIMARY KEY (specialty, age_group, gender)
+    ) WITHOUT ROWID
+    ''',
+)
+
+# rag_topk に保存する件数（これ以下の limit の検索は rag_topk の1行で返す）
+RAG_TOPK_LIMIT = int(os.getenv("RAG_TOPK_LIMIT", "10"))
+RAG_TOPK_GENDERS = ("male", "female")
+
+# 読み取り専用DBで追加するインデックス（検索順の並び替えをインデックスで済ませる）
+RAG_ARTIFACT_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_rag_data_ranking ON rag_data(specialty, distinctiveness DESC, search_volume DESC)",
+)
+
+def _artifact_version():
+    """読み取り専用DBの (inode, 更新時刻)。無ければNone（差し替えの検知に使う）"""
+    try:
+        stat = RAG_ARTIFACT_PATH.stat()
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns)
+
+def use_artifact() -> bool:
+    """デプロイ時に作成した読み取り専用DBを使うか"""
+    return _artifact_version() is not None
+
+def active_database_path() -> Path:
+    """検索に使うDBファイルのパス"""
+    return RAG_ARTIFACT_PATH if use_artifact() else RAG_DB_PATH
+
 def ensure_rag_directories():
     """RAG関連のディレクトリを確保"""
     try:
@@ -43,46 +138,79 @@ def ensure_rag_directories():
         print(f"Error creating RAG directories: {e}")
         raise
 
-def create_connection():
-    """WALモードを有効にしたデータベース接続を作成"""
-    import time
-    max_retries = 5
-    retry_delay = 0.5
-    
-    for attempt in range(max_retries):
-        try:
-            conn = sqlite3.connect(str(RAG_DB_PATH), timeout=30.0, check_same_thread=False)
-            # WAL（Write-Ahead Logging）モードを有効化 - 読み書きの同時実行を可能にする
-            # 複数ワーカー対応のため、WALモードの設定を慎重に行う
-            try:
-                conn.execute("PRAGMA journal_mode=WAL")
-            except sqlite3.OperationalError as e:
-                if "database is locked" in str(e) and attempt < max_retries - 1:
-                    print(f"[RAG] Database locked, retrying... (attempt {attempt + 1}/{max_retries})")
-                    conn.close()
-                    time.sleep(retry_delay * (attempt + 1))
-                    continue
-                # WALモードが既に設定されている場合は無視
-                pass
-            
-            # 同期モードをNORMALに設定（パフォーマンスと安全性のバランス）
-            conn.execute("PRAGMA synchronous=NORMAL")
-            # キャッシュサイズを増やす（パフォーマンス向上）
-            conn.execute("PRAGMA cache_size=-64000")  # 64MB
-            # ビジータイムアウトを設定
-            conn.execute("PRAGMA busy_timeout=30000")  # 30秒
-            return conn
-        except sqlite3.OperationalError as e:
-            if "database is locked" in str(e) and attempt < max_retries - 1:
-                print(f"[RAG] Database locked, retrying... (attempt {attempt + 1}/{max_retries})")
-                time.sleep(retry_delay * (attempt + 1))
-                continue
-            raise
-    
-    raise sqlite3.OperationalError("Failed to connect to database after multiple retries")
+# 接続プール: 読み取りはスレッドごとに1本、書き込み（CSV取り込み）はプロセスで1本を使い回す
+# （ページキャッシュ・プリペアドステートメントキャッシュを接続と一緒にリクエスト間で保持する）
+# ページキャッシュは接続ごとに確保されるため、Workerあたり最大で 接続数（≒ OFFLOAD_IO_THREADS + 数本）× この値 になる
+# （既定の2MB×16スレッドで約40MB。検索は rag_topk の主キー参照が中心で、残りはOSのページキャッシュから読む）
+READ_CACHE_SIZE_KB = int(os.getenv("RAG_READ_CACHE_SIZE_KB", "2000"))
+WRITE_CACHE_SIZE_KB = 64000  # 書き込み接続はプロセスで1本
+STATEMENT_CACHE_SIZE = 256
+_read_local = threading.local()
+_writer: Optional[sqlite3.Connection] = None
+_writer_pid: Optional[int] = None
+_write_lock = threading.RLock()
+
+def _open_connection(read_only: bool, artifact: bool = False) -> sqlite3.Connection:
+    if artifact:
+        # 変更されないファイルなのでロック・変更検知を省略して開く（immutable）
+        conn = sqlite3.connect(
+            f"{RAG_ARTIFACT_PATH.resolve().as_uri()}?mode=ro&immutable=1",
+            uri=True, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE
+        )
+        conn.execute(f"PRAGMA cache_size=-{READ_CACHE_SIZE_KB}")
+        return conn
+    conn = sqlite3.connect(
+        str(RAG_DB_PATH), timeout=30.0, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE
+    )
+    # ビジータイムアウトを先に設定（他Workerが書き込み中でもリトライせずに待つ）
+    conn.execute("PRAGMA busy_timeout=30000")  # 30秒
+    # 接続ごとのページキャッシュ（スレッド数分確保されるため小さめ。書き込み接続は1本なので取り込み用に大きめ）
+    conn.execute(f"PRAGMA cache_size=-{READ_CACHE_SIZE_KB if read_only else WRITE_CACHE_SIZE_KB}")
+    if read_only:
+        conn.execute("PRAGMA query_only=ON")
+    else:
+        # WAL（Write-Ahead Logging）モードを有効化 - 読み書きの同時実行を可能にする
+        conn.execute("PRAGMA journal_mode=WAL")
+        # 同期モードをNORMALに設定（パフォーマンスと安全性のバランス）
+        conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def get_read_connection() -> sqlite3.Connection:
+    """
+    スレッドごとの読み取り専用接続を取得（close しないこと）
+
+    初回のみ開き、fork後や読み取り専用DBの作成・差し替え後は開き直す
+    """
+    artifact_version = _artifact_version()
+    conn = getattr(_read_local, "conn", None)
+    if conn is None or _read_local.pid != os.getpid() or _read_local.artifact_version != artifact_version:
+        if conn is not None and _read_local.pid == os.getpid():
+            conn.close()
+        conn = _open_connection(read_only=True, artifact=artifact_version is not None)
+        _read_local.conn = conn
+        _read_local.pid = os.getpid()
+        _read_local.artifact_version = artifact_version
+    return conn
+
+@contextmanager
+def write_connection():
+    """書き込み用の接続を排他的に使う（プロセスで1本。close しないこと）"""
+    global _writer, _writer_pid
+    with _write_lock:
+        if _writer is None or _writer_pid != os.getpid():
+            _writer = _open_connection(read_only=False)
+            _writer_pid = os.getpid()
+        yield _writer
 
 def init_rag_database():
     """RAGデータベースの初期化"""
+    if use_artifact():
+        # 読み取り専用DBを使う場合は書き込み用DBに触れない（Worker間のロック競合なし）
+        print("="*60)
+        print(f"[RAG] Using prebuilt read-only database: {RAG_ARTIFACT_PATH}")
+        print("="*60)
+        return
+    
     ensure_rag_directories()
     
     # 使用するデータベースパスを明示的にログ出力
@@ -91,63 +219,14 @@ def init_rag_database():
     print(f"[RAG] Using {'LOCAL' if 'app_settings' in str(RAG_DB_PATH) else 'RENDER'} database")
     print("="*60)
     
-    # 複数ワーカーの同時初期化を防ぐためのシンプルなアプローチ
-    import time
-    import random
-    
-    # ワーカーIDを取得（プロセスIDを使用）
-    import os
-    worker_id = os.getpid()
-    
-    # ランダムな待機時間でワーカーの衝突を回避
-    wait_time = random.uniform(0.1, 0.5) * (worker_id % 10)
-    print(f"[RAG] Worker {worker_id} waiting {wait_time:.2f}s before initializing database")
-    time.sleep(wait_time)
-    
     try:
-        conn = create_connection()
-        cursor = conn.cursor()
-        
-        # RAGデータテーブル作成
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS rag_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                specialty TEXT NOT NULL,
-                rank_order INTEGER,
-                keyword TEXT NOT NULL,
-                search_volume INTEGER,
-                duplicate_volume INTEGER,
-                distinctiveness REAL,
-                time_difference REAL,
-                male_ratio INTEGER,
-                female_ratio INTEGER,
-                age_10s INTEGER,
-                age_20s INTEGER,
-                age_30s INTEGER,
-                age_40s INTEGER,
-                age_50s INTEGER,
-                age_60s INTEGER,
-                age_70s INTEGER,
-                category TEXT,
-                uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(specialty, keyword)
-            )
-        ''')
-        
-        # アップロード履歴テーブル作成
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS upload_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                specialty TEXT NOT NULL,
-                filename TEXT NOT NULL,
-                file_size INTEGER,
-                record_count INTEGER,
-                uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        # 複数ワーカーが同時に初期化しても busy_timeout で順番に待つ
+        with write_connection() as conn:
+            for statement in RAG_SCHEMA:
+                conn.execute(statement)
+            conn.commit()
+            _backfill_topk(conn)
+            _backfill_categories(conn)
         print(f"RAG database initialized at: {RAG_DB_PATH}")
         
         # 遅延読み込みモードを有効化 - 初回起動時は何もロードしない
@@ -157,189 +236,281 @@ def init_rag_database():
         print(f"Error initializing RAG database: {e}")
         raise
 
-def _save_rag_data_internal(specialty: str, df: pd.DataFrame, original_filename: str) -> Dict:
-    """内部使用のみ: CSVファイルからRAGデータをデータベースに保存"""
-    conn = None
+# CSVの列名 → rag_data の列名
+RAG_CSV_COLUMNS = {
+    '順位': 'rank_order',
+    '出力キーワード': 'keyword',
+    '検索ボリューム(人)': 'search_volume',
+    '重複ボリューム(人)': 'duplicate_volume',
+    '特徴度': 'distinctiveness',
+    '検索時間差(日)': 'time_difference',
+    '男性割合(%)': 'male_ratio',
+    '女性割合(%)': 'female_ratio',
+    '10代（13歳〜）割合(%)': 'age_10s',
+    '20代割合(%)': 'age_20s',
+    '30代割合(%)': 'age_30s',
+    '40代割合(%)': 'age_40s',
+    '50代割合(%)': 'age_50s',
+    '60代割合(%)': 'age_60s',
+    '70代以上割合(%)': 'age_70s',
+}
+RAG_REAL_COLUMNS = ('distinctiveness', 'time_difference')
+RAG_INSERT_COLUMNS = ('specialty', *RAG_CSV_COLUMNS.values(), 'category')
+
+def _prepare_rag_rows(specialty: str, df: pd.DataFrame):
+    """
+    CSVのDataFrameを rag_data の挿入行に列単位で変換する
+
+    欠損値は数値列を0（順位はNULL）、キーワードを空文字にする。
+    数値に変換できない値を含む行はスキップする。
+
+    Returns:
+        (挿入行のリスト, スキップした行数)
+    """
+    columns = {'specialty': specialty}
+    invalid = np.zeros(len(df), dtype=bool)
+    for csv_column, column in RAG_CSV_COLUMNS.items():
+        raw = df[csv_column] if csv_column in df.columns else pd.Series(np.nan, index=df.index)
+        present = raw.notna().to_numpy()
+        if column == 'keyword':
+            columns[column] = np.where(present, raw.astype(str).to_numpy(), '')
+            continue
+        values = pd.to_numeric(raw, errors='coerce').to_numpy(dtype=float)
+        if column in RAG_REAL_COLUMNS:
+            invalid |= present & np.isnan(values)
+            columns[column] = np.where(np.isnan(values), 0.0, values)
+        else:
+            # 整数列は無限大も変換できない値として扱う
+            finite = np.isfinite(values)
+            invalid |= present & ~finite
+            columns[column] = np.trunc(values) if column == 'rank_order' else np.where(finite, np.trunc(values), 0)
+    # キーワードのカテゴリ（症状・不安 / 治療・対策 など）は取り込み時に判定して保存する
+    columns['category'] = np.array(keyword_analyzer.classify_keywords(columns['keyword'].tolist())[0], dtype=object)
+
+    keep = ~invalid
+    row_count = int(keep.sum())
+    column_values = []
+    for column in RAG_INSERT_COLUMNS:
+        value = columns[column]
+        if isinstance(value, str):
+            column_values.append([value] * row_count)
+        elif column == 'rank_order':
+            column_values.append([None if np.isnan(rank) else int(rank) for rank in value[keep].tolist()])
+        elif column in RAG_REAL_COLUMNS or column in ('keyword', 'category'):
+            column_values.append(value[keep].tolist())
+        else:
+            column_values.append(value[keep].astype(np.int64).tolist())
+    return list(zip(*column_values)), int(invalid.sum())
+
+def _save_rag_data_internal(specialty: str, df: pd.DataFrame, original_filename: str, manifest: Dict = None) -> Dict:
+    """
+    内部使用のみ: CSVファイルからRAGデータをデータベースに保存
+
+    manifest（_manifest_entry の戻り値）を渡すと、同じトランザクションで rag_manifest も更新する
+    """
     try:
-        # データベース接続
-        conn = create_connection()
-        cursor = conn.cursor()
-        
-        # トランザクション開始
-        conn.execute("BEGIN TRANSACTION")
-        
-        # 既存データの削除（同じ診療科の古いデータを置換）
-        cursor.execute("DELETE FROM rag_data WHERE specialty = ?", (specialty,))
-        
-        # 新しいデータの挿入
-        inserted_count = 0
-        skipped_count = 0
-        
-        for _, row in df.iterrows():
-            try:
-                # CSVの列名を予想されるものにマッピング
-                data_to_insert = {
-                    'specialty': specialty,
-                    'rank_order': int(row.get('順位', 0)) if pd.notna(row.get('順位')) else None,
-                    'keyword': str(row.get('出力キーワード', '')) if pd.notna(row.get('出力キーワード')) else '',
-                    'search_volume': int(row.get('検索ボリューム(人)', 0)) if pd.notna(row.get('検索ボリューム(人)')) else 0,
-                    'duplicate_volume': int(row.get('重複ボリューム(人)', 0)) if pd.notna(row.get('重複ボリューム(人)')) else 0,
-                    'distinctiveness': float(row.get('特徴度', 0.0)) if pd.notna(row.get('特徴度')) else 0.0,
-                    'time_difference': float(row.get('検索時間差(日)', 0.0)) if pd.notna(row.get('検索時間差(日)')) else 0.0,
-                    'male_ratio': int(row.get('男性割合(%)', 0)) if pd.notna(row.get('男性割合(%)')) else 0,
-                    'female_ratio': int(row.get('女性割合(%)', 0)) if pd.notna(row.get('女性割合(%)')) else 0,
-                    'age_10s': int(row.get('10代（13歳〜）割合(%)', 0)) if pd.notna(row.get('10代（13歳〜）割合(%)')) else 0,
-                    'age_20s': int(row.get('20代割合(%)', 0)) if pd.notna(row.get('20代割合(%)')) else 0,
-                    'age_30s': int(row.get('30代割合(%)', 0)) if pd.notna(row.get('30代割合(%)')) else 0,
-                    'age_40s': int(row.get('40代割合(%)', 0)) if pd.notna(row.get('40代割合(%)')) else 0,
-                    'age_50s': int(row.get('50代割合(%)', 0)) if pd.notna(row.get('50代割合(%)')) else 0,
-                    'age_60s': int(row.get('60代割合(%)', 0)) if pd.notna(row.get('60代割合(%)')) else 0,
-                    'age_70s': int(row.get('70代以上割合(%)', 0)) if pd.notna(row.get('70代以上割合(%)')) else 0,
-                    'category': ''  # カテゴリーカラムは存在しない場合は空文字
-                }
-                
-                cursor.execute('''
-                    INSERT INTO rag_data (
-                        specialty, rank_order, keyword, search_volume, duplicate_volume,
-                        distinctiveness, time_difference, male_ratio, female_ratio,
-                        age_10s, age_20s, age_30s, age_40s, age_50s, age_60s, age_70s, category
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    data_to_insert['specialty'], data_to_insert['rank_order'], 
-                    data_to_insert['keyword'], data_to_insert['search_volume'],
-                    data_to_insert['duplicate_volume'], data_to_insert['distinctiveness'],
-                    data_to_insert['time_difference'], data_to_insert['male_ratio'],
-                    data_to_insert['female_ratio'], data_to_insert['age_10s'],
-                    data_to_insert['age_20s'], data_to_insert['age_30s'],
-                    data_to_insert['age_40s'], data_to_insert['age_50s'],
-                    data_to_insert['age_60s'], data_to_insert['age_70s'],
-                    data_to_insert['category']
-                ))
-                inserted_count += 1
-                
-            except Exception as row_error:
-                print(f"Error inserting row: {row_error}")
-                skipped_count += 1
-                continue
-        
-        # アップロード履歴を記録
-        cursor.execute('''
-            INSERT INTO upload_history (specialty, filename, file_size, record_count)
-            VALUES (?, ?, ?, ?)
-        ''', (specialty, original_filename, len(df) * 100, inserted_count))  # 概算ファイルサイズ
-        
-        conn.commit()
-        conn.close()
-        
-        return {
-            "success": True,
-            "inserted_count": inserted_count,
-            "skipped_count": skipped_count,
-            "specialty": specialty
-        }
-        
+        # 変換は書き込みロックの外で行い、ロック中は1回の executemany だけにする
+        rows, skipped_count = _prepare_rag_rows(specialty, df)
     except Exception as e:
-        print(f"Error saving RAG data: {e}")
-        # ロールバック
-        if conn:
-            conn.rollback()
-            conn.close()
+        print(f"Error preparing RAG data: {e}")
         return {
             "success": False,
             "error": str(e)
         }
+    
+    with write_connection() as conn:
+        try:
+            # トランザクション開始
+            conn.execute("BEGIN TRANSACTION")
+            
+            # 既存データの削除（同じ診療科の古いデータを置換）
+            conn.execute("DELETE FROM rag_data WHERE specialty = ?", (specialty,))
+            
+            # 新しいデータの一括挿入（同じキーワードの重複行は最初の1行だけ残す）
+            changes_before = conn.total_changes
+            conn.executemany(
+                f"INSERT OR IGNORE INTO rag_data ({', '.join(RAG_INSERT_COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in RAG_INSERT_COLUMNS)})",
+                rows
+            )
+            inserted_count = conn.total_changes - changes_before
+            skipped_count += len(rows) - inserted_count
+            _materialize_topk(conn, specialty)
+            
+            # アップロード履歴を記録
+            conn.execute('''
+                INSERT INTO upload_history (specialty, filename, file_size, record_count)
+                VALUES (?, ?, ?, ?)
+            ''', (specialty, original_filename, manifest["size"] if manifest else len(df) * 100, inserted_count))  # 概算ファイルサイズ
+            
+            if manifest:
+                conn.execute(
+                    "INSERT OR REPLACE INTO rag_manifest (path, specialty, size, mtime, sha256, row_count) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (manifest["path"], specialty, manifest["size"], manifest["mtime"], manifest["sha256"], inserted_count)
+                )
+            
+            conn.commit()
+            
+            return {
+                "success": True,
+                "inserted_count": inserted_count,
+                "skipped_count": skipped_count,
+                "specialty": specialty
+            }
+            
+        except Exception as e:
+            print(f"Error saving RAG data: {e}")
+            # ロールバック
+            conn.rollback()
+            return {
+                "success": False,
+                "error": str(e)
+            }
 
-def search_rag_data(specialty: str, age_group: str = None, gender: str = None, chief_complaint: str = None, limit: int = 10) -> List[Dict]:
-    """RAGデータから関連キーワードを検索（主訴を考慮）"""
+def _materialize_topk(conn: sqlite3.Connection, specialty: str) -> None:
+    """診療科の rag_topk を作り直す（呼び出し元のトランザクション内で実行）"""
+    rows = conn.execute(
+        f"SELECT {', '.join(rag_index.COLUMNS)} FROM rag_data WHERE specialty = ?", (specialty,)
+    ).fetchall()
+    index = rag_index.SpecialtyIndex(rows)
+    conn.execute("DELETE FROM rag_topk WHERE specialty = ?", (specialty,))
+    conn.executemany(
+        "INSERT INTO rag_topk (specialty, age_group, gender, keyword_count, results) VALUES (?, ?, ?, ?, ?)",
+        [
+            (specialty, age_group, gender, len(index), json.dumps(
+                index.search(age_group or None, gender or None, RAG_TOPK_LIMIT), ensure_ascii=False, separators=(",", ":")
+            ))
+            for age_group in ("", *rag_index.AGE_GROUPS)
+            for gender in ("", *RAG_TOPK_GENDERS)
+        ]
+    )
+
+def _backfill_topk(conn: sqlite3.Connection) -> None:
+    """rag_topk が無い（この機能の追加前に取り込んだ）診療科の分を作成"""
+    specialties = [row[0] for row in conn.execute(
+        "SELECT DISTINCT specialty FROM rag_data WHERE specialty NOT IN (SELECT specialty FROM rag_topk)"
+    )]
+    if not specialties:
+        return
     try:
+        for specialty in specialties:
+            _materialize_topk(conn, specialty)
+        conn.commit()
+        print(f"[RAG] Precomputed top keywords for {len(specialties)} existing specialties")
+    except Exception:
+        conn.rollback()
+        raise
+
+def _backfill_categories(conn: sqlite3.Connection) -> None:
+    """カテゴリが空の（この機能の追加前に取り込んだ）行を判定し、その診療科の rag_topk を作り直す"""
+    rows = conn.execute("SELECT id, specialty, keyword FROM rag_data WHERE category IS NULL OR category = ''").fetchall()
+    if not rows:
+        return
+    categories, _ = keyword_analyzer.classify_keywords([keyword for _, _, keyword in rows])
+    specialties = sorted({specialty for _, specialty, _ in rows})
+    try:
+        conn.executemany(
+            "UPDATE rag_data SET category = ? WHERE id = ?",
+            [(category, row_id) for (row_id, _, _), category in zip(rows, categories)]
+        )
+        for specialty in specialties:
+            _materialize_topk(conn, specialty)
+        conn.commit()
+        print(f"[RAG] Classified {len(rows)} existing keywords in {len(specialties)} specialties")
+    except Exception:
+        conn.rollback()
+        raise
+
+def _lookup_topk(specialty: str, age_group: str = None, gender: str = None):
+    """rag_topk から (キーワード総数, 上位キーワードのJSON) を主キーで取得（未作成ならNone）"""
+    return get_read_connection().execute(
+        "SELECT keyword_count, results FROM rag_topk WHERE specialty = ? AND age_group = ? AND gender = ?",
+        (
+            specialty,
+            age_group if age_group in rag_index.AGE_GROUPS else "",
+            gender if gender in RAG_TOPK_GENDERS else "",
+        )
+    ).fetchone()
+
+def _search_topk(specialty: str, age_group: str, gender: str, chief_complaint: str, limit: int) -> List[Dict]:
+    """取り込み時に作成した rag_topk で検索（RAGデータの取り込み時に全診療科分を作成するため、行が無ければデータ無し）"""
+    specialty_with_cc = f"{specialty}_{chief_complaint}" if chief_complaint else None
+    cc_row = _lookup_topk(specialty_with_cc, age_group, gender) if specialty_with_cc else None
+    row = cc_row if cc_row and cc_row[0] > 0 else _lookup_topk(specialty, age_group, gender)
+    if row is None:
         # 必要に応じて該当診療科のデータを遅延読み込み
         ensure_department_data_loaded(specialty, chief_complaint)
+        cc_row = _lookup_topk(specialty_with_cc, age_group, gender) if specialty_with_cc else None
+        row = cc_row if cc_row and cc_row[0] > 0 else _lookup_topk(specialty, age_group, gender)
+        if row is None:
+            return []
+    
+    if specialty_with_cc:
+        print("="*60)
+        if row is cc_row:
+            print(f"[RAG] ✓ Chief complaint specific data found!")
+            print(f"[RAG] Using: {specialty_with_cc}")
+            print(f"[RAG] Records available: {row[0]}")
+        else:
+            print(f"[RAG] ℹ Chief complaint specific data not found")
+            print(f"[RAG] Falling back to department data: {specialty}")
+        print("="*60)
+    return json.loads(row[1])[:limit]
+
+def _search_full(specialty: str, chief_complaint: str, age_group: str, gender: str, limit: int) -> List[Dict]:
+    """rag_topk より多い件数の検索（該当診療科の行を読み、rag_topk と同じ条件・順序で並べる）"""
+    specialty_with_cc = f"{specialty}_{chief_complaint}" if chief_complaint else None
+    
+    # 必要に応じて該当診療科のデータを遅延読み込み
+    ensure_department_data_loaded(specialty, chief_complaint)
+    
+    def load(name: str) -> rag_index.SpecialtyIndex:
+        return rag_index.SpecialtyIndex(get_read_connection().execute(
+            f"SELECT {', '.join(rag_index.COLUMNS)} FROM rag_data WHERE specialty = ?", [name]
+        ).fetchall())
+    
+    index = None
+    # 主訴がある場合は、主訴別のデータを優先的に検索
+    if specialty_with_cc:
+        # まず主訴別のデータを検索（例：アレルギー科_アトピー性皮膚炎）
+        cc_index = load(specialty_with_cc)
+        # 主訴別データが存在する場合はそれを使用
+        if len(cc_index) > 0:
+            print("="*60)
+            print(f"[RAG] ✓ Chief complaint specific data found!")
+            print(f"[RAG] Using: {specialty_with_cc}")
+            print(f"[RAG] Records available: {len(cc_index)}")
+            print("="*60)
+            index = cc_index
+        else:
+            print("="*60)
+            print(f"[RAG] ℹ Chief complaint specific data not found")
+            print(f"[RAG] Falling back to department data: {specialty}")
+            print("="*60)
+    
+    if index is None:
+        index = load(specialty)
+    
+    # 年代（該当年代の割合が15%超）・性別で絞り込み、特徴度と検索ボリュームの順で上位を返す
+    return index.search(age_group, gender, limit)
+
+def search_rag_data(specialty: str, age_group: str = None, gender: str = None, chief_complaint: str = None, limit: int = 10) -> List[Dict]:
+    """RAGデータから関連キーワードを検索（主訴を考慮）"""
+    try:
+        # 通常の件数なら取り込み時に作成した上位キーワードを主キーで1行取得するだけ
+        if limit <= RAG_TOPK_LIMIT:
+            return _search_topk(specialty, age_group, gender, chief_complaint, limit)
         
-        conn = create_connection()
-        cursor = conn.cursor()
-        
-        # 主訴がある場合は、主訴別のデータを優先的に検索
-        if chief_complaint:
-            # まず主訴別のデータを検索（例：アレルギー科_アトピー性皮膚炎）
-            specialty_with_cc = f"{specialty}_{chief_complaint}"
-            cursor.execute('''
-                SELECT COUNT(*) FROM rag_data 
-                WHERE specialty = ?
-            ''', [specialty_with_cc])
-            
-            count = cursor.fetchone()[0]
-            # 主訴別データが存在する場合はそれを使用
-            if count > 0:
-                print("="*60)
-                print(f"[RAG] ✓ Chief complaint specific data found!")
-                print(f"[RAG] Using: {specialty_with_cc}")
-                print(f"[RAG] Records available: {count}")
-                print("="*60)
-                specialty = specialty_with_cc  # 主訴別のspecialtyを使用
-            else:
-                print("="*60)
-                print(f"[RAG] ℹ Chief complaint specific data not found")
-                print(f"[RAG] Falling back to department data: {specialty}")
-                print("="*60)
-        
-        # 基本クエリ
-        base_query = '''
-            SELECT keyword, search_volume, male_ratio, female_ratio,
-                   age_10s, age_20s, age_30s, age_40s, age_50s, age_60s, age_70s,
-                   category, distinctiveness
-            FROM rag_data 
-            WHERE specialty = ?
-        '''
-        
-        params = [specialty]
-        
-        # 年代フィルタリング（該当年代の割合が平均以上）
-        if age_group:
-            age_column_map = {
-                "10s": "age_10s", "20s": "age_20s", "30s": "age_30s",
-                "40s": "age_40s", "50s": "age_50s", "60s": "age_60s", "70s": "age_70s"
-            }
-            if age_group in age_column_map:
-                base_query += f" AND {age_column_map[age_group]} > 15"  # 15%以上の割合
-        
-        # 性別フィルタリング
-        if gender:
-            if gender == "male":
-                base_query += " AND male_ratio > female_ratio"
-            elif gender == "female":
-                base_query += " AND female_ratio > male_ratio"
-        
-        # 検索ボリュームと特徴度で並び替え
-        base_query += " ORDER BY distinctiveness DESC, search_volume DESC LIMIT ?"
-        params.append(limit)
-        
-        cursor.execute(base_query, params)
-        
-        results = []
-        for row in cursor.fetchall():
-            results.append({
-                "keyword": row[0],
-                "search_volume": row[1],
-                "male_ratio": row[2],
-                "female_ratio": row[3],
-                "age_demographics": {
-                    "10s": row[4], "20s": row[5], "30s": row[6],
-                    "40s": row[7], "50s": row[8], "60s": row[9], "70s": row[10]
-                },
-                "category": row[11],
-                "distinctiveness": row[12]
-            })
-        
-        conn.close()
-        return results
+        return _search_full(specialty, chief_complaint, age_group, gender, limit)
         
     except Exception as e:
         print(f"Error searching RAG data: {e}")
         return []
 
-
-
-
+async def search_rag_data_async(specialty: str, age_group: str = None, gender: str = None, chief_complaint: str = None, limit: int = 10) -> List[Dict]:
+    """search_rag_data をイベントループ外（I/Oスレッドプール）で実行する（未読み込みの診療科はCSVの取り込みを含むため）"""
+    return await offload.run_io(search_rag_data, specialty, age_group, gender, chief_complaint, limit)
 
 def get_rag_context(department: str) -> str:
     """指定された診療科のRAGコンテキストを取得"""
@@ -347,8 +518,7 @@ def get_rag_context(department: str) -> str:
     department_ja = DEPARTMENT_MAP.get(department, department)
     
     try:
-        conn = create_connection()
-        cursor = conn.cursor()
+        cursor = get_read_connection().cursor()
         
         # テーブル名の生成（診療科名を使用）
         table_name = f"rag_{department_ja.replace('/', '_').replace(' ', '_')}"
@@ -377,193 +547,133 @@ def get_rag_context(department: str) -> str:
     except Exception as e:
         print(f"Error getting RAG context: {e}")
         return ""
-    finally:
-        conn.close()
 
 def get_rag_base_dir():
     """RAGディレクトリパスを取得"""
     # 本番環境ではプロジェクトルートからの相対パスを使用
     return Path("./rag/各診療科")
 
-def load_csv_data_from_directory():
-    """CSVファイルをディレクトリから自動的にロード"""
-    # RAGデータのベースディレクトリ
+def _manifest_entry(csv_path: Path, content: bytes, base_dir: Path = None) -> Dict:
+    """rag_manifest の1行分（パスは rag/各診療科 からの相対パス）"""
+    import hashlib
+    return {
+        "path": csv_path.relative_to(base_dir or get_rag_base_dir()).as_posix(),
+        "size": len(content),
+        "mtime": csv_path.stat().st_mtime,
+        "sha256": hashlib.sha256(content).hexdigest(),
+    }
+
+def _load_csv_file(specialty: str, csv_path: Path, base_dir: Path = None) -> Dict:
+    """CSVファイル1つを取り込み、rag_manifest に記録する（1ファイル1トランザクション）"""
+    content = csv_path.read_bytes()
+    df = columnar_cache.read_table(csv_path, content)
+    return _save_rag_data_internal(specialty, df, csv_path.name, _manifest_entry(csv_path, content, base_dir))
+
+def load_csv_data_from_directory() -> Dict:
+    """
+    rag/各診療科 以下のCSVを rag_manifest と比較して差分だけ取り込む
+
+    サイズ・更新時刻が記録と同じファイルは読まず、異なる場合もSHA-256が同じなら記録の更新のみ。
+    新規・変更されたファイルは取り込み直し、削除されたファイルのデータは消す（いずれも1ファイル1トランザクション）。
+
+    Returns:
+        dict: added / updated / unchanged / removed / failed のファイル数と inserted_count
+    """
+    import hashlib
+    import time
+    start = time.time()
     base_dir = get_rag_base_dir()
+    summary = {"added": 0, "updated": 0, "unchanged": 0, "removed": 0, "failed": 0, "inserted_count": 0}
     
     if not base_dir.exists():
         print(f"RAG directory not found: {base_dir}")
-        return
+        return summary
     
-    # データベース接続
-    conn = sqlite3.connect(str(RAG_DB_PATH))
-    cursor = conn.cursor()
+    with write_connection() as conn:
+        manifest = {
+            path: (specialty, size, mtime, sha256)
+            for path, specialty, size, mtime, sha256 in conn.execute(
+                "SELECT path, specialty, size, mtime, sha256 FROM rag_manifest"
+            )
+        }
     
-    try:
-        # CSVファイルの更新をチェック
-        if should_update_rag_data(conn, base_dir):
-            print("[RAG] CSV files have been updated. Reloading data...")
-            # 既存データをクリア
-            cursor.execute("DELETE FROM rag_data")
-            cursor.execute("DELETE FROM upload_history")
-            conn.commit()
-        else:
-            # 既存のデータがあり、更新も不要な場合
-            cursor.execute("SELECT COUNT(*) FROM rag_data")
-            if cursor.fetchone()[0] > 0:
-                print("[RAG] Data is up to date. Skipping CSV load.")
-                conn.close()
-                return
-        
-        # 各診療科のディレクトリを処理
-        loaded_departments = []
-        for dept_dir in base_dir.iterdir():
-            if dept_dir.is_dir():
-                department_name = dept_dir.name
-                
-                # 1. 診療科全体のCSVファイルを読み込み
-                csv_file = dept_dir / f"{department_name}_全体.csv"
-                if csv_file.exists():
-                    print(f"Loading CSV for department: {department_name}")
-                    try:
-                        # CSVファイルを読み込み
-                        df = pd.read_csv(csv_file, encoding='utf-8-sig')
-                        
-                        # _save_rag_data_internal関数を使用してデータを保存
-                        result = _save_rag_data_internal(department_name, df, csv_file.name)
-                        
-                        if result['success']:
-                            loaded_departments.append({
-                                'department': department_name,
-                                'type': 'department',
-                                'inserted_count': result['inserted_count'],
-                                'skipped_count': result['skipped_count']
-                            })
-                        else:
-                            print(f"Failed to load data for {department_name}: {result.get('error', 'Unknown error')}")
-                            
-                    except Exception as e:
-                        print(f"Error loading CSV file {csv_file}: {e}")
-                        continue
-                
-                # 2. 主訴別のCSVファイルを読み込み
-                chief_complaints_dir = dept_dir / "主訴"
-                if chief_complaints_dir.exists() and chief_complaints_dir.is_dir():
-                    print(f"Loading chief complaint CSVs for {department_name}")
-                    for cc_csv in chief_complaints_dir.glob("*_全体.csv"):
-                        chief_complaint_name = cc_csv.stem.replace("_全体", "")
-                        print(f"  - Loading {chief_complaint_name}")
-                        try:
-                            # CSVファイルを読み込み
-                            df = pd.read_csv(cc_csv, encoding='utf-8-sig')
-                            
-                            # 主訴を含む特別なspecialty名を使用（例：アレルギー科_アトピー性皮膚炎）
-                            specialty_with_cc = f"{department_name}_{chief_complaint_name}"
-                            
-                            # データを保存
-                            result = _save_rag_data_internal(specialty_with_cc, df, cc_csv.name)
-                            
-                            if result['success']:
-                                loaded_departments.append({
-                                    'department': department_name,
-                                    'chief_complaint': chief_complaint_name,
-                                    'type': 'chief_complaint',
-                                    'inserted_count': result['inserted_count'],
-                                    'skipped_count': result['skipped_count']
-                                })
-                            else:
-                                print(f"    Failed to load data for {chief_complaint_name}: {result.get('error', 'Unknown error')}")
-                                
-                        except Exception as e:
-                            print(f"    Error loading CSV file {cc_csv}: {e}")
-                            continue
-        
-        # 成功したロードの概要を表示
-        if loaded_departments:
-            print("\nCSV data loading summary:")
-            dept_count = 0
-            cc_count = 0
-            for dept in loaded_departments:
-                if dept['type'] == 'department':
-                    print(f"  - {dept['department']}: {dept['inserted_count']} records loaded")
-                    dept_count += 1
-                elif dept['type'] == 'chief_complaint':
-                    print(f"    • {dept['department']} - {dept['chief_complaint']}: {dept['inserted_count']} records")
-                    cc_count += 1
-            print(f"\nTotal departments loaded: {dept_count}")
-            print(f"Total chief complaints loaded: {cc_count}")
+    seen = set()
+    for specialty, csv_path in iter_rag_csv_files(base_dir):
+        path = csv_path.relative_to(base_dir).as_posix()
+        seen.add(path)
+        recorded = manifest.get(path)
+        stat = csv_path.stat()
+        if recorded and recorded[1:3] == (stat.st_size, stat.st_mtime):
+            summary["unchanged"] += 1
+            continue
+        try:
+            if recorded and hashlib.sha256(csv_path.read_bytes()).hexdigest() == recorded[3]:
+                # 内容は同じ（タッチ・チェックアウトし直しなど）なので更新時刻だけ記録し直す
+                with write_connection() as conn:
+                    conn.execute("UPDATE rag_manifest SET mtime = ? WHERE path = ?", (stat.st_mtime, path))
+                    conn.commit()
+                summary["unchanged"] += 1
+                continue
+            result = _load_csv_file(specialty, csv_path, base_dir)
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
+        if result["success"]:
+            summary["updated" if recorded else "added"] += 1
+            summary["inserted_count"] += result["inserted_count"]
+            print(f"[RAG] {'Updated' if recorded else 'Loaded'} {specialty}: {result['inserted_count']} records")
         else:
-            print("No CSV data was loaded.")
-            
-    except Exception as e:
-        print(f"Error during CSV loading: {e}")
-        conn.close()
-        raise
-
-def should_update_rag_data(conn, base_dir):
-    """CSVファイルが更新されているかチェック"""
-    cursor = conn.cursor()
+            summary["failed"] += 1
+            print(f"[RAG] Failed to load {csv_path}: {result.get('error', 'Unknown error')}")
     
-    # アップロード履歴から最終更新時刻を取得
-    cursor.execute("""
-        SELECT specialty, uploaded_at 
-        FROM upload_history 
-        ORDER BY uploaded_at DESC 
-        LIMIT 1
-    """)
-    
-    result = cursor.fetchone()
-    if not result:
-        # データがない場合は更新が必要
-        return True
-    
-    # 最後のアップロード時刻を取得
-    last_upload_str = result[1]
-    last_upload = datetime.fromisoformat(last_upload_str.replace(' ', 'T'))
-    
-    # CSVファイルの最終更新時刻をチェック
-    for dept_dir in base_dir.iterdir():
-        if dept_dir.is_dir():
-            csv_file = dept_dir / f"{dept_dir.name}_全体.csv"
-            if csv_file.exists():
-                # ファイルの更新時刻を取得
-                file_mtime = datetime.fromtimestamp(csv_file.stat().st_mtime)
-                
-                # CSVファイルがデータベースより新しい場合
-                if file_mtime > last_upload:
-                    print(f"[RAG] Updated CSV found: {csv_file.name} (modified: {file_mtime})")
-                    return True
+    # CSVが削除された診療科のデータを消す
+    for path in sorted(set(manifest) - seen):
+        specialty = manifest[path][0]
+        with write_connection() as conn:
+            try:
+                conn.execute("BEGIN TRANSACTION")
+                conn.execute("DELETE FROM rag_data WHERE specialty = ?", (specialty,))
+                conn.execute("DELETE FROM rag_topk WHERE specialty = ?", (specialty,))
+                conn.execute("DELETE FROM rag_manifest WHERE path = ?", (path,))
+                conn.commit()
+                summary["removed"] += 1
+                print(f"[RAG] Removed {specialty} (CSV deleted: {path})")
+            except Exception as e:
+                conn.rollback()
+                summary["failed"] += 1
+                print(f"[RAG] Failed to remove data for {path}: {e}")
     
-    return False
+    print(
+        f"[RAG] CSV sync: {summary['added']} added, {summary['updated']} updated, {summary['unchanged']} unchanged, "
+        f"{summary['removed']} removed, {summary['failed']} failed in {time.time() - start:.2f}s"
+    )
+    return summary
+
+def _has_specialty_data(specialty: str) -> bool:
+    """診療科（診療科_主訴）のデータがDBに読み込み済みか"""
+    row = get_read_connection().execute(
+        "SELECT 1 FROM rag_data WHERE specialty = ? LIMIT 1", [specialty]
+    ).fetchone()
+    return row is not None
 
 def ensure_department_data_loaded(department: str, chief_complaint: str = None):
     """指定された診療科のデータが読み込まれていることを確認（遅延読み込み）"""
-    conn = create_connection()
-    cursor = conn.cursor()
-    
+    if use_artifact():
+        return  # 読み取り専用DBには全データが取り込み済み
     try:
         # まず主訴別データの存在確認
-        if chief_complaint:
-            specialty_with_cc = f"{department}_{chief_complaint}"
-            cursor.execute("SELECT COUNT(*) FROM rag_data WHERE specialty = ?", [specialty_with_cc])
-            if cursor.fetchone()[0] > 0:
-                conn.close()
-                return  # 既にデータが存在
+        if chief_complaint and _has_specialty_data(f"{department}_{chief_complaint}"):
+            return  # 既にデータが存在
         
         # 診療科データの存在確認
-        cursor.execute("SELECT COUNT(*) FROM rag_data WHERE specialty = ?", [department])
-        if cursor.fetchone()[0] > 0:
-            conn.close()
+        if _has_specialty_data(department):
             return  # 既にデータが存在
         
-        conn.close()
-        
         # データが存在しない場合は、該当診療科のみ読み込み
         print(f"[RAG] Loading data for department: {department}")
         load_department_csv_data(department, chief_complaint)
         
     except Exception as e:
         print(f"Error ensuring department data: {e}")
-        conn.close()
 
 def load_department_csv_data(department: str, chief_complaint: str = None):
     """特定の診療科のCSVデータのみを読み込み"""
@@ -581,9 +691,7 @@ def load_department_csv_data(department: str, chief_complaint: str = None):
         cc_csv = dept_dir / "主訴" / f"{chief_complaint}_全体.csv"
         if cc_csv.exists():
             try:
-                df = pd.read_csv(cc_csv, encoding='utf-8-sig')
-                specialty_with_cc = f"{department}_{chief_complaint}"
-                result = _save_rag_data_internal(specialty_with_cc, df, cc_csv.name)
+                result = _load_csv_file(f"{department}_{chief_complaint}", cc_csv, base_dir)
                 if result['success']:
                     print(f"[RAG] Loaded {chief_complaint}: {result['inserted_count']} records")
                     loaded_count += result['inserted_count']
@@ -591,18 +699,11 @@ def load_department_csv_data(department: str, chief_complaint: str = None):
                 print(f"[RAG] Error loading chief complaint CSV: {e}")
     
     # 2. 診療科全体のデータが未読み込みの場合は読み込み
-    conn = create_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM rag_data WHERE specialty = ?", [department])
-    dept_data_exists = cursor.fetchone()[0] > 0
-    conn.close()
-    
-    if not dept_data_exists:
+    if not _has_specialty_data(department):
         csv_file = dept_dir / f"{department}_全体.csv"
         if csv_file.exists():
             try:
-                df = pd.read_csv(csv_file, encoding='utf-8-sig')
-                result = _save_rag_data_internal(department, df, csv_file.name)
+                result = _load_csv_file(department, csv_file, base_dir)
                 if result['success']:
                     print(f"[RAG] Loaded {department}: {result['inserted_count']} records")
                     loaded_count += result['inserted_count']
@@ -612,28 +713,129 @@ def load_department_csv_data(department: str, chief_complaint: str = None):
     if loaded_count > 0:
         print(f"[RAG] Total loaded for {department}: {loaded_count} records")
 
-def reload_csv_data():
-    """CSVデータを再ロード（開発/更新用）"""
-    conn = sqlite3.connect(str(RAG_DB_PATH))
-    cursor = conn.cursor()
+def iter_rag_csv_files(base_dir: Path = None):
+    """取り込み対象のCSVを (specialty, CSVパス) で列挙（診療科全体、続いて主訴別）"""
+    base_dir = Path(base_dir or get_rag_base_dir())
+    for dept_dir in sorted(base_dir.iterdir()):
+        if not dept_dir.is_dir():
+            continue
+        csv_file = dept_dir / f"{dept_dir.name}_全体.csv"
+        if csv_file.exists():
+            yield dept_dir.name, csv_file
+        chief_complaints_dir = dept_dir / "主訴"
+        if chief_complaints_dir.is_dir():
+            for cc_csv in sorted(chief_complaints_dir.glob("*_全体.csv")):
+                # 主訴を含む特別なspecialty名を使用（例：アレルギー科_アトピー性皮膚炎）
+                yield f"{dept_dir.name}_{cc_csv.stem.replace('_全体', '')}", cc_csv
+
+def build_rag_artifact(output_path: Path = None, base_dir: Path = None, force: bool = False) -> Dict:
+    """
+    rag/各診療科 以下の全CSVを1つの読み取り専用DBに取り込む（デプロイ時に実行）
+
+    取り込んだCSVのハッシュを rag_manifest に記録し、既存のDBとCSVが一致する場合は作り直さない。
+    一時ファイルに作成してから置き換えるため、実行中のWorkerは古いDBを読み続けられる。
+
+    Returns:
+        dict: built（作成したか）/ files / rows / seconds
+    """
+    import time
+    start = time.time()
+    output_path = Path(output_path or RAG_ARTIFACT_PATH)
+    base_dir = Path(base_dir or get_rag_base_dir())
     
+    sources = []
+    for specialty, csv_path in iter_rag_csv_files(base_dir):
+        content = csv_path.read_bytes()
+        sources.append((specialty, csv_path, content, _manifest_entry(csv_path, content, base_dir)))
+    source_hashes = {manifest["path"]: manifest["sha256"] for _, _, _, manifest in sources}
+    
+    if not force and output_path.exists():
+        try:
+            conn = sqlite3.connect(f"{output_path.resolve().as_uri()}?mode=ro", uri=True)
+            try:
+                built_hashes = dict(conn.execute("SELECT path, sha256 FROM rag_manifest").fetchall())
+                conn.execute("SELECT 1 FROM rag_topk LIMIT 1")  # 古い形式のDBは作り直す
+                unclassified = conn.execute("SELECT 1 FROM rag_data WHERE category = '' LIMIT 1").fetchone()
+            finally:
+                conn.close()
+            if built_hashes == source_hashes and not unclassified:
+                print(f"[RAG] Prebuilt database is up to date ({len(sources)} files): {output_path}")
+                return {"built": False, "files": len(sources), "rows": None, "seconds": round(time.time() - start, 2)}
+        except sqlite3.Error as e:
+            print(f"[RAG] Existing prebuilt database is unreadable, rebuilding: {e}")
+    
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = output_path.with_name(f".{output_path.name}.tmp")
+    temp_path.unlink(missing_ok=True)
+    conn = sqlite3.connect(str(temp_path))
+    total_rows = 0
     try:
-        # 既存のデータを削除
-        cursor.execute("DELETE FROM rag_data")
-        cursor.execute("DELETE FROM upload_history")
+        # 作成中のファイルは他から読まれないため、ジャーナル・同期書き込みを省略する
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        for statement in RAG_SCHEMA:
+            conn.execute(statement)
+        insert_sql = (
+            f"INSERT OR IGNORE INTO rag_data ({', '.join(RAG_INSERT_COLUMNS)}) "
+            f"VALUES ({', '.join('?' for _ in RAG_INSERT_COLUMNS)})"
+        )
+        for specialty, csv_path, content, manifest in sources:
+            df = columnar_cache.read_table(csv_path, content)
+            rows, _ = _prepare_rag_rows(specialty, df)
+            changes_before = conn.total_changes
+            conn.executemany(insert_sql, rows)
+            inserted_count = conn.total_changes - changes_before
+            total_rows += inserted_count
+            _materialize_topk(conn, specialty)
+            conn.execute(
+                "INSERT INTO upload_history (specialty, filename, file_size, record_count) VALUES (?, ?, ?, ?)",
+                (specialty, csv_path.name, len(content), inserted_count)
+            )
+            conn.execute(
+                "INSERT INTO rag_manifest (path, specialty, size, mtime, sha256, row_count) VALUES (?, ?, ?, ?, ?, ?)",
+                (manifest["path"], specialty, manifest["size"], manifest["mtime"], manifest["sha256"], inserted_count)
+            )
+        for statement in RAG_ARTIFACT_INDEXES:
+            conn.execute(statement)
         conn.commit()
-        print("Existing RAG data cleared.")
-        
-    except Exception as e:
-        print(f"Error clearing existing data: {e}")
-        conn.rollback()
-        conn.close()
-        raise
+        conn.execute("ANALYZE")
+        conn.execute("VACUUM")
     finally:
         conn.close()
+    os.replace(temp_path, output_path)
+    
+    seconds = time.time() - start
+    print(f"[RAG] Built prebuilt database: {len(sources)} files, {total_rows} rows in {seconds:.2f}s -> {output_path}")
+    return {"built": True, "files": len(sources), "rows": total_rows, "seconds": round(seconds, 2)}
+
+def reload_csv_data(full: bool = False) -> Dict:
+    """
+    CSVデータを再ロード（開発/更新用）
+
+    通常は rag_manifest との差分だけを取り込む。full=True の場合は既存データを全て削除してから読み込む
+    """
+    if use_artifact():
+        # 読み取り専用DBを使っている場合はDBごと作り直して差し替える
+        return build_rag_artifact(force=full)
+    
+    if full:
+        with write_connection() as conn:
+            try:
+                # 既存のデータを削除
+                conn.execute("DELETE FROM rag_data")
+                conn.execute("DELETE FROM upload_history")
+                conn.execute("DELETE FROM rag_manifest")
+                conn.execute("DELETE FROM rag_topk")
+                conn.commit()
+                print("Existing RAG data cleared.")
+                
+            except Exception as e:
+                print(f"Error clearing existing data: {e}")
+                conn.rollback()
+                raise
     
     # CSVデータを再ロード
-    load_csv_data_from_directory()
+    return load_csv_data_from_directory()
 
 # テスト用関数
 if __name__ == "__main__":
@@ -0,0 +1,202 @@
+"""
+同一リクエストの実行を1回にまとめる（single-flight）
+Worker内はasyncio.Futureで、Gunicorn Worker間はSQLiteのロック行で調整する
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from backend.services import offload
+from backend.services.crud import PERSISTENT_DISK_MOUNT_PATH
+
+LOCK_DB_PATH = Path(os.getenv("SINGLE_FLIGHT_DB", str(PERSISTENT_DISK_MOUNT_PATH / "single_flight.db")))
+LEASE_SECONDS = float(os.getenv("SINGLE_FLIGHT_LEASE", "300"))  # ロック保持の上限（リーダー異常終了時の保険）
+POLL_INTERVAL = float(os.getenv("SINGLE_FLIGHT_POLL_INTERVAL", "0.5"))
+
+_INSTANCE_TOKEN = uuid.uuid4().hex[:8]
+
+_inflight: Dict[str, asyncio.Future] = {}
+_releasing: Set[asyncio.Task] = set()  # 実行中のロック解放（タスクの参照を保持する）
+_conn: Optional[sqlite3.Connection] = None
+_conn_pid: Optional[int] = None
+_lock = threading.Lock()
+
+
+def _owner_id() -> str:
+    """ロック所有者ID（fork後もWorkerごとに異なる値になるようPIDを含める）"""
+    return f"{os.getpid()}-{_INSTANCE_TOKEN}"
+
+
+class FlightAbandoned(Exception):
+    """リーダーが結果を出さずに終了した（キャンセル等）"""
+
+
+def _get_connection() -> sqlite3.Connection:
+    """プロセスごとに1本の接続を使い回す（fork後は開き直す）"""
+    global _conn, _conn_pid
+    if _conn is None or _conn_pid != os.getpid():
+        LOCK_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(LOCK_DB_PATH), timeout=30.0, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS inflight_requests (
+                flight_key TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+        conn.commit()
+        _conn = conn
+        _conn_pid = os.getpid()
+    return _conn
+
+
+def _try_claim(key: str) -> bool:
+    """Worker間ロックの取得を試みる（期限切れのロックは奪う）"""
+    try:
+        with _lock:
+            conn = _get_connection()
+            now = time.time()
+            conn.execute("DELETE FROM inflight_requests WHERE flight_key = ? AND expires_at < ?", (key, now))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO inflight_requests (flight_key, owner, expires_at) VALUES (?, ?, ?)",
+                (key, _owner_id(), now + LEASE_SECONDS)
+            )
+            conn.commit()
+            return cursor.rowcount == 1
+    except Exception as e:
+        # ロックDBが使えない場合はWorker内の集約だけで続行
+        print(f"[SingleFlight] Claim failed, continuing without cross-worker lock: {e}")
+        return True
+
+
+def _release(key: str) -> None:
+    try:
+        with _lock:
+            conn = _get_connection()
+            conn.execute("DELETE FROM inflight_requests WHERE flight_key = ? AND owner = ?", (key, _owner_id()))
+            conn.commit()
+    except Exception as e:
+        print(f"[SingleFlight] Release failed: {e}")
+
+
+def _release_in_background(key: str) -> None:
+    """ロック解放のSQLite書き込みをイベントループ外で行う（完了を待たない）"""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _release(key)
+        return
+    task = loop.create_task(offload.run_io(_release, key))
+    _releasing.add(task)
+    task.add_done_callback(_releasing.discard)
+
+
+class Flight:
+    """リーダーとして実行中の1件。結果を finish() で後続の呼び出し元に渡す"""
+
+    def __init__(self, key: str, future: asyncio.Future, cross_worker: bool):
+        self.key = key
+        self._future = future
+        self._cross_worker = cross_worker
+
+    def finish(self, result: Any = None, error: Optional[BaseException] = None) -> None:
+        if _inflight.get(self.key) is self._future:
+            del _inflight[self.key]
+        if self._cross_worker:
+            _release_in_background(self.key)
+        if self._future.done():
+            return
+        if error is not None:
+            if isinstance(error, asyncio.CancelledError):
+                error = FlightAbandoned(f"Leader for {self.key[:16]} was cancelled")
+            self._future.set_exception(error)
+            # 後続が居ない場合の "exception was never retrieved" 警告を抑止
+            self._future.exception()
+        else:
+            self._future.set_result(result)
+
+
+async def join(
+    key: str,
+    peer_result: Optional[Callable[[], Optional[Any]]] = None
+) -> Tuple[Optional[Flight], Any]:
+    """
+    同じキーの実行中処理に合流する
+
+    Args:
+        key: リクエストを識別するキー（プロンプトのハッシュ等）
+        peer_result: 他Workerの結果を取得する関数（Noneの場合はWorker内のみで集約）
+
+    Returns:
+        (Flight, None)  - 呼び出し元がリーダー。処理後に Flight.finish() を呼ぶこと
+        (None, result)  - 他の呼び出し元の結果
+    """
+    while True:
+        future = _inflight.get(key)
+        if future is not None:
+            print(f"[SingleFlight] Joining in-flight request: {key[:16]}")
+            try:
+                return None, await asyncio.shield(future)
+            except FlightAbandoned:
+                continue  # リーダーがキャンセルされた場合は自分が引き継ぐ
+
+        future = asyncio.get_running_loop().create_future()
+        _inflight[key] = future
+        if peer_result is None:
+            return Flight(key, future, cross_worker=False), None
+
+        flight = Flight(key, future, cross_worker=True)
+        try:
+            deadline = time.time() + LEASE_SECONDS
+            while True:
+                # SQLiteのロック・キャッシュの確認はイベントループ外で行う
+                claimed = await offload.run_io(_try_claim, key)
+                # 他Workerの結果が既にあればそれを使う（ロック取得直前に完了した場合も含む）
+                result = await offload.run_io(peer_result)
+                if result is not None:
+                    print(f"[SingleFlight] Result shared from another worker: {key[:16]}")
+                    flight._cross_worker = claimed
+                    flight.finish(result)
+                    return None, result
+                if claimed:
+                    return flight, None
+                if time.time() >= deadline:
+                    print(f"[SingleFlight] Timed out waiting for another worker: {key[:16]}")
+                    flight._cross_worker = False
+                    return flight, None
+                await asyncio.sleep(POLL_INTERVAL)
+        except BaseException as e:
+            flight._cross_worker = False
+            flight.finish(error=e)
+            raise
+
+
+async def coalesce(
+    key: str,
+    compute: Callable[[], Awaitable[Any]],
+    peer_result: Optional[Callable[[], Optional[Any]]] = None
+) -> Any:
+    """同じキーの処理を1回だけ実行し、同時に来た呼び出し元で結果を共有する（例外は共有しない）"""
+    flight, result = await join(key, peer_result)
+    if flight is None:
+        return result
+    try:
+        result = await compute()
+    except BaseException as e:
+        # 失敗（プロバイダー障害など）は共有せず、待機中の呼び出し元にはそれぞれ実行し直してもらう
+        flight.finish(error=FlightAbandoned(f"Leader for {key[:16]} failed: {type(e).__name__}"))
+        raise
+    flight.finish(result)
+    return result
+
+
+def get_stats() -> Dict[str, Any]:
+    """Worker内で実行中のキー数を取得"""
+    return {"inflight": len(_inflight), "owner": _owner_id()}
@@ -2,16 +2,23 @@
 検索キーワード時系列分析サービス
 """
 
+import numpy as np
 import pandas as pd
 from pathlib import Path
 from typing import Dict, List, Optional
+import json
 import os
-from datetime import datetime, timedelta
+from datetime import timedelta
 
-# メモリキャッシュ用の辞書
-_timeline_cache = {}
-_cache_timestamps = {}
+from backend.services import columnar_cache, keyword_analyzer, offload
+from backend.services.cache_manager import SizedLRUCache
+
+# メモリキャッシュ（主訴ごとのDataFrameと、性別・年代ごとのレスポンスJSONの2段。どちらも合計バイト数で上限を決めるLRU）
 CACHE_DURATION = timedelta(minutes=15)  # 15分間キャッシュを保持
+FRAME_CACHE_MAX_BYTES = int(os.getenv("TIMELINE_CACHE_MAX_MB", "64")) * 1024 * 1024
+RESULT_CACHE_MAX_BYTES = int(os.getenv("TIMELINE_RESULT_CACHE_MAX_MB", "32")) * 1024 * 1024
+_frame_cache = SizedLRUCache(FRAME_CACHE_MAX_BYTES, CACHE_DURATION.total_seconds())
+_result_cache = SizedLRUCache(RESULT_CACHE_MAX_BYTES, CACHE_DURATION.total_seconds())
 
 def get_timeline_csv_path(department: str, chief_complaint: str) -> Path:
     """主訴別CSVまたはExcelファイルのパスを取得"""
@@ -68,92 +75,93 @@ def get_timeline_csv_path(department: str, chief_complaint: str) -> Path:
     print(f"[DEBUG] No file found, returning CSV path: {csv_path.absolute()}")
     return csv_path
 
-def filter_keywords_by_demographics(keywords_df: pd.DataFrame, gender: str, age: str) -> pd.DataFrame:
-    """性別・年齢でキーワードをフィルタリング"""
-    filtered_df = keywords_df.copy()
-    
-    # 性別フィルタ（日本語・英語両方に対応）
+# 年代の指定 → CSVの割合カラム
+AGE_COLUMNS = {
+    "10代": "10代（13歳〜）割合(%)",
+    "20代": "20代割合(%)",
+    "30代": "30代割合(%)",
+    "40代": "40代割合(%)",
+    "50代": "50代割合(%)",
+    "60代": "60代割合(%)",
+    "70代以上": "70代以上割合(%)"
+}
+# レスポンスの age_groups のキー → CSVの割合カラム
+AGE_GROUP_COLUMNS = {
+    "10s": "10代（13歳〜）割合(%)",
+    "20s": "20代割合(%)",
+    "30s": "30代割合(%)",
+    "40s": "40代割合(%)",
+    "50s": "50代割合(%)",
+    "60s": "60代割合(%)",
+    "70s_plus": "70代以上割合(%)"
+}
+FILTER_GENDER_RATIO = 40  # 性別指定時は該当性別の割合がこの値(%)以上のキーワードに絞る
+FILTER_AGE_RATIO = 15  # 年代指定時は該当年代の割合がこの値(%)以上のキーワードに絞る（10代は絞り込まない）
+REQUIRED_COLUMNS = ['出力キーワード', '検索ボリューム(人)', '検索時間差(日)', '特徴度', '男性割合(%)', '女性割合(%)']
+# 読み込み時に keyword_analyzer で判定して追加する列（CSVには無い）
+CATEGORY_COLUMN = '_category'
+EMOTIONAL_COLUMN = '_emotional'
+# レスポンスの表示オプション（parse_view_options）で指定できる値
+VIEW_FIELDS = (
+    "keyword", "search_volume", "duplicate_volume", "estimated_volume", "time_diff_days",
+    "distinctiveness", "male_ratio", "female_ratio", "age_groups", "category", "emotional"
+)
+DOWNSAMPLE_Y_FIELDS = ("duplicate_volume", "estimated_volume", "search_volume")  # 散布図のY軸（既定は重複ボリューム）
+MAX_TIMELINE_BINS = 2000
+
+
+def _gender_column(gender: Optional[str]) -> Optional[str]:
+    # 日本語・英語両方に対応
     if gender in ["male", "男性"]:
-        # 男性比率が40%以上のキーワードを優先
-        filtered_df = filtered_df[filtered_df['男性割合(%)'] >= 40]
-    elif gender in ["female", "女性"]:
-        # 女性比率が40%以上のキーワードを優先
-        filtered_df = filtered_df[filtered_df['女性割合(%)'] >= 40]
-    
-    # 年齢フィルタ
-    age_mapping = {
-        "20代": "20代割合(%)",
-        "30代": "30代割合(%)",
-        "40代": "40代割合(%)",
-        "50代": "50代割合(%)",
-        "60代": "60代割合(%)",
-        "70代以上": "70代以上割合(%)"
-    }
-    
-    if age in age_mapping:
-        age_column = age_mapping[age]
+        return '男性割合(%)'
+    if gender in ["female", "女性"]:
+        return '女性割合(%)'
+    return None
+
+
+def _numeric_column(df: pd.DataFrame, column: str, default: float = np.nan) -> np.ndarray:
+    """カラムを数値のNumPy配列に変換（変換できない値はNaN、カラムが無ければ default で埋める）"""
+    if column not in df.columns:
+        return np.full(len(df), default, dtype=np.float64)
+    return pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=np.float64)
+
+
+def _ratio(values: np.ndarray) -> np.ndarray:
+    """割合(%)を0〜1の比率に変換（欠損・範囲外は1.0 = 補正なし）"""
+    ratio = values / 100
+    return np.where(np.isnan(ratio) | (ratio < 0) | (ratio > 1), 1.0, ratio)
+
+
+def demographic_mask(df: pd.DataFrame, gender: Optional[str], age: Optional[str]) -> np.ndarray:
+    """性別・年齢で残すキーワードのマスク"""
+    mask = np.ones(len(df), dtype=bool)
+    gender_column = _gender_column(gender)
+    if gender_column:
+        # 該当性別の割合が40%以上のキーワードを優先
+        mask &= _numeric_column(df, gender_column) >= FILTER_GENDER_RATIO
+    if age in AGE_COLUMNS and age != "10代":
         # 該当年代の割合が15%以上のキーワードを優先
-        filtered_df = filtered_df[filtered_df[age_column] >= 15]
-    
-    return filtered_df
+        mask &= _numeric_column(df, AGE_COLUMNS[age]) >= FILTER_AGE_RATIO
+    return mask
 
-def calculate_estimated_volume(row: pd.Series, gender: str, age: str) -> int:
-    """性別・年齢を考慮した検索ボリュームを推定"""
-    try:
-        base_volume = float(row.get('検索ボリューム(人)', 0))
-        if pd.isna(base_volume) or base_volume < 0:
-            base_volume = 0
-    except (ValueError, TypeError):
-        base_volume = 0
-    
-    # 性別による調整（日本語・英語両方に対応）
-    try:
-        if gender in ["male", "男性"]:
-            gender_ratio = float(row.get('男性割合(%)', 100)) / 100
-        elif gender in ["female", "女性"]:
-            gender_ratio = float(row.get('女性割合(%)', 100)) / 100
-        else:
-            gender_ratio = 1.0
-        
-        # 比率の妥当性チェック
-        if pd.isna(gender_ratio) or gender_ratio < 0 or gender_ratio > 1:
-            gender_ratio = 1.0
-    except (ValueError, TypeError):
-        gender_ratio = 1.0
-    
-    # 年齢による調整
-    age_mapping = {
-        "10代": "10代（13歳〜）割合(%)",
-        "20代": "20代割合(%)",
-        "30代": "30代割合(%)",
-        "40代": "40代割合(%)",
-        "50代": "50代割合(%)",
-        "60代": "60代割合(%)",
-        "70代以上": "70代以上割合(%)"
-    }
-    
-    try:
-        if age in age_mapping:
-            age_column = age_mapping[age]
-            if age_column in row:
-                age_ratio = float(row.get(age_column, 100)) / 100
-            else:
-                age_ratio = 1.0
-            
-            # 比率の妥当性チェック
-            if pd.isna(age_ratio) or age_ratio < 0 or age_ratio > 1:
-                age_ratio = 1.0
-        else:
-            age_ratio = 1.0
-    except (ValueError, TypeError):
-        age_ratio = 1.0
-    
-    # 推定ボリューム = 基本ボリューム × 性別比率 × 年齢比率
-    try:
-        estimated_volume = int(base_volume * gender_ratio * age_ratio)
-        return max(estimated_volume, 1)  # 最小値は1
-    except (ValueError, TypeError):
-        return 1
+
+def estimate_volumes(df: pd.DataFrame, gender: Optional[str], age: Optional[str]) -> np.ndarray:
+    """
+    性別・年齢を考慮した検索ボリュームの推定値（全行分）
+
+    推定ボリューム = 基本ボリューム × 性別比率 × 年齢比率（切り捨て、最小値は1）
+    """
+    base_volume = np.nan_to_num(_numeric_column(df, '検索ボリューム(人)'), nan=0.0, posinf=0.0, neginf=0.0)
+    base_volume = np.clip(base_volume, 0, None)
+    gender_column = _gender_column(gender)
+    gender_ratio = _ratio(_numeric_column(df, gender_column)) if gender_column else 1.0
+    age_ratio = _ratio(_numeric_column(df, AGE_COLUMNS[age])) if age in AGE_COLUMNS else 1.0
+    return np.maximum(np.floor(base_volume * gender_ratio * age_ratio), 1).astype(np.int64)
+
+
+def _int_list(values: np.ndarray) -> List[int]:
+    # int() と同じく0方向に切り捨て（欠損は0）
+    return np.trunc(np.nan_to_num(values, nan=0.0)).astype(np.int64).tolist()
 
 def analyze_search_timeline(department: str, chief_complaint: str, 
                           gender: Optional[str] = None, 
@@ -163,19 +171,10 @@ def analyze_search_timeline(department: str, chief_complaint: str,
     print(f"[DEBUG] Analyzing timeline for: department='{department}', chief_complaint='{chief_complaint}'")
     
     # キャッシュキーの生成
-    cache_key = f"{department}_{chief_complaint}"
+    cache_key = (department, chief_complaint)
     
-    # キャッシュの有効性チェック
-    if cache_key in _timeline_cache and cache_key in _cache_timestamps:
-        cache_age = datetime.now() - _cache_timestamps[cache_key]
-        if cache_age < CACHE_DURATION:
-            print(f"[CACHE] Using cached data for {cache_key} (age: {cache_age.seconds}s)")
-            df = _timeline_cache[cache_key].copy()
-        else:
-            print(f"[CACHE] Cache expired for {cache_key}, reloading")
-            df = None
-    else:
-        df = None
+    # キャッシュの有効性チェック（期限切れ・上限超過で削除された場合はNone）
+    df = _frame_cache.get(cache_key)  # 読み取り専用で使うためコピーしない
     
     # キャッシュにない場合はファイルから読み込み
     if df is None:
@@ -189,11 +188,9 @@ def analyze_search_timeline(department: str, chief_complaint: str,
             }
         
         try:
-            # ファイル形式に応じて読み込み
-            if csv_path.suffix == '.csv':
-                df = pd.read_csv(csv_path, encoding='utf-8-sig')
-            elif csv_path.suffix == '.xlsx':
-                df = pd.read_excel(csv_path)
+            # ファイル形式に応じて読み込み（変換済みの列指向キャッシュがあればそちらを使う）
+            if csv_path.suffix in ('.csv', '.xlsx'):
+                df = columnar_cache.read_table(csv_path)
             else:
                 return {
                     "error": f"サポートされていないファイル形式: {csv_path.suffix}",
@@ -201,10 +198,14 @@ def analyze_search_timeline(department: str, chief_complaint: str,
                     "summary": {}
                 }
             
+            # キーワードのカテゴリ・感情の判定はファイルの読み込み時に1回だけ行い、列として持つ
+            if '出力キーワード' in df.columns:
+                categories, emotional = keyword_analyzer.classify_keywords(df['出力キーワード'].tolist())
+                df = df.assign(**{CATEGORY_COLUMN: categories, EMOTIONAL_COLUMN: emotional})
+            
             # キャッシュに保存
-            _timeline_cache[cache_key] = df.copy()
-            _cache_timestamps[cache_key] = datetime.now()
-            print(f"[CACHE] Cached data for {cache_key}")
+            if _frame_cache.set(cache_key, df, int(df.memory_usage(deep=True).sum())):
+                print(f"[CACHE] Cached data for {department}_{chief_complaint}")
             
         except Exception as e:
             print(f"[ERROR] Failed to load file: {e}")
@@ -215,15 +216,8 @@ def analyze_search_timeline(department: str, chief_complaint: str,
             }
     
     try:
-        
-        # 性別・年齢でフィルタリング
-        if gender or age:
-            df = filter_keywords_by_demographics(df, gender, age)
-        
         # 必須カラムの存在確認
-        required_columns = ['出力キーワード', '検索ボリューム(人)', '検索時間差(日)', 
-                          '特徴度', '男性割合(%)', '女性割合(%)']
-        missing_columns = [col for col in required_columns if col not in df.columns]
+        missing_columns = [col for col in REQUIRED_COLUMNS if col not in df.columns]
         if missing_columns:
             return {
                 "error": f"必須カラムが不足しています: {', '.join(missing_columns)}",
@@ -231,70 +225,64 @@ def analyze_search_timeline(department: str, chief_complaint: str,
                 "summary": {}
             }
         
-        # 数値カラムの型変換（エラーハンドリング付き）
-        numeric_columns = ['検索ボリューム(人)', '検索時間差(日)', '特徴度', 
-                          '男性割合(%)', '女性割合(%)']
-        for col in numeric_columns:
-            try:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-            except Exception as e:
-                print(f"Warning: Failed to convert column {col} to numeric: {e}")
+        # 数値カラムを列ごとに変換し、性別・年齢の条件と欠損値の除外を1つのマスクにまとめる
+        volume = _numeric_column(df, '検索ボリューム(人)')
+        time_diff = _numeric_column(df, '検索時間差(日)')
+        distinctiveness = _numeric_column(df, '特徴度')
+        male_ratio = _numeric_column(df, '男性割合(%)')
+        female_ratio = _numeric_column(df, '女性割合(%)')
+        keyword_values = df['出力キーワード'].to_numpy()
+        mask = demographic_mask(df, gender, age) if (gender or age) else np.ones(len(df), dtype=bool)
+        mask &= df['出力キーワード'].notna().to_numpy()
+        for values in (volume, time_diff, distinctiveness, male_ratio, female_ratio):
+            mask &= ~np.isnan(values)
         
-        # NaN値を持つ行を除外
-        df = df.dropna(subset=required_columns)
+        # 残った行を時間差で安定ソート（同じ時間差はファイルの順序のまま）
+        rows = np.flatnonzero(mask)
+        rows = rows[np.argsort(time_diff[rows], kind='stable')]
+        time_diff = time_diff[rows]
+        estimated_volume = estimate_volumes(df, gender, age)[rows]
         
-        # 各行に推定ボリュームを追加
-        df['推定検索ボリューム'] = df.apply(
-            lambda row: calculate_estimated_volume(row, gender, age), 
-            axis=1
+        # 結果を列ごとにPythonの値へ変換してから組み立てる
+        columns = zip(
+            keyword_values[rows].tolist(),
+            _int_list(volume[rows]),
+            _int_list(_numeric_column(df, '重複ボリューム(人)', 0)[rows]),  # 重複ボリュームを追加
+            estimated_volume.tolist(),
+            time_diff.tolist(),
+            distinctiveness[rows].tolist(),
+            _int_list(male_ratio[rows]),
+            _int_list(female_ratio[rows]),
+            zip(*[_int_list(_numeric_column(df, column, 0)[rows]) for column in AGE_GROUP_COLUMNS.values()]),
+            df[CATEGORY_COLUMN].to_numpy()[rows].tolist(),
+            df[EMOTIONAL_COLUMN].to_numpy()[rows].tolist(),
         )
+        keywords = [
+            {
+                "keyword": keyword,
+                "search_volume": search_volume,
+                "duplicate_volume": duplicate_volume,
+                "estimated_volume": estimated,
+                "time_diff_days": days,
+                "distinctiveness": distinct,
+                "male_ratio": male,
+                "female_ratio": female,
+                "age_groups": dict(zip(AGE_GROUP_COLUMNS, ages)),
+                "category": category,
+                "emotional": emotional
+            }
+            for keyword, search_volume, duplicate_volume, estimated, days, distinct, male, female, ages, category, emotional
+            in columns
+        ]
         
-        # 時間差でソート
-        df = df.sort_values('検索時間差(日)')
-        
-        # 結果を整形
-        keywords = []
-        for _, row in df.iterrows():
-            keywords.append({
-                "keyword": row['出力キーワード'],
-                "search_volume": int(row['検索ボリューム(人)']),
-                "duplicate_volume": int(row.get('重複ボリューム(人)', 0)),  # 重複ボリュームを追加
-                "estimated_volume": int(row['推定検索ボリューム']),
-                "time_diff_days": float(row['検索時間差(日)']),
-                "distinctiveness": float(row['特徴度']),
-                "male_ratio": int(row['男性割合(%)']),
-                "female_ratio": int(row['女性割合(%)']),
-                "age_groups": {
-                    "10s": int(row.get('10代（13歳〜）割合(%)', 0)),
-                    "20s": int(row.get('20代割合(%)', 0)),
-                    "30s": int(row.get('30代割合(%)', 0)),
-                    "40s": int(row.get('40代割合(%)', 0)),
-                    "50s": int(row.get('50代割合(%)', 0)),
-                    "60s": int(row.get('60代割合(%)', 0)),
-                    "70s_plus": int(row.get('70代以上割合(%)', 0))
-                }
-            })
-        
-        # サマリー情報
-        pre_diagnosis = [k for k in keywords if k['time_diff_days'] < 0]
-        post_diagnosis = [k for k in keywords if k['time_diff_days'] >= 0]
-        
-        # サマリー情報の安全な計算
-        peak_search_day = 0
-        if len(df) > 0 and '推定検索ボリューム' in df.columns:
-            try:
-                # 最大値のインデックスが存在するか確認
-                max_volume = df['推定検索ボリューム'].max()
-                if pd.notna(max_volume) and max_volume > 0:
-                    peak_search_day = float(df.loc[df['推定検索ボリューム'].idxmax()]['検索時間差(日)'])
-            except Exception as e:
-                print(f"Warning: Failed to calculate peak search day: {e}")
-                peak_search_day = 0
+        # サマリー情報（推定ボリュームが最大のキーワードの時間差。同じ値なら時間差の早い方）
+        pre_diagnosis_count = int(np.count_nonzero(time_diff < 0))
+        peak_search_day = float(time_diff[np.argmax(estimated_volume)]) if len(rows) else 0
         
         summary = {
             "total_keywords": len(keywords),
-            "pre_diagnosis_count": len(pre_diagnosis),
-            "post_diagnosis_count": len(post_diagnosis),
+            "pre_diagnosis_count": pre_diagnosis_count,
+            "post_diagnosis_count": len(keywords) - pre_diagnosis_count,
             "peak_search_day": peak_search_day
         }
         
@@ -314,26 +302,206 @@ def analyze_search_timeline(department: str, chief_complaint: str,
             "summary": {}
         }
 
+def parse_view_options(params: Dict) -> Optional[Dict]:
+    """
+    リクエストの表示オプションを検証する（指定が無ければNone。不正な値は ValueError）
+
+    - bin_days: 時間差のヒストグラム（histogram）の幅（日）
+    - top_k: 推定ボリュームの上位k件に絞る
+    - downsample: 散布図用にLTTBで間引く点数（3以上）。Y軸は downsample_y（既定は重複ボリューム）
+    - fields: キーワードごとに返す項目（リストまたはカンマ区切り）
+    - include_keywords: false ならキーワード一覧を返さない（ヒストグラム・サマリーのみ）
+    """
+    options = {}
+    for name, minimum in (("top_k", 0), ("downsample", 3)):
+        value = params.get(name)
+        if value is None or value == "":
+            continue
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} must be an integer")
+        if value < minimum:
+            raise ValueError(f"{name} must be {minimum} or greater")
+        options[name] = value
+    if params.get("bin_days") not in (None, ""):
+        try:
+            bin_days = float(params["bin_days"])
+        except (TypeError, ValueError):
+            raise ValueError("bin_days must be a number")
+        if not bin_days > 0 or bin_days == float("inf"):
+            raise ValueError("bin_days must be greater than 0")
+        options["bin_days"] = bin_days
+    if params.get("fields") not in (None, ""):
+        fields = params["fields"]
+        if isinstance(fields, str):
+            fields = [field.strip() for field in fields.split(",")]
+        elif not isinstance(fields, list) or not all(isinstance(field, str) for field in fields):
+            raise ValueError("fields must be a comma-separated string or a list of strings")
+        unknown = [field for field in fields if field not in VIEW_FIELDS]
+        if unknown:
+            raise ValueError(f"unknown fields: {', '.join(map(str, unknown))}")
+        options["fields"] = fields
+    if params.get("downsample_y") not in (None, ""):
+        if params["downsample_y"] not in DOWNSAMPLE_Y_FIELDS:
+            raise ValueError(f"downsample_y must be one of: {', '.join(DOWNSAMPLE_Y_FIELDS)}")
+        options["downsample_y"] = params["downsample_y"]
+    if params.get("include_keywords") not in (None, ""):
+        value = params["include_keywords"]
+        options["include_keywords"] = value if isinstance(value, bool) else str(value).lower() not in ("false", "0", "no")
+    return options or None
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets で残す点の位置（x の昇順に並んだ点列が対象）
+
+    最初と最後の点は必ず残し、間を threshold - 2 個のバケットに分けて、
+    前に選んだ点と次のバケットの平均点との三角形の面積が最大になる点を各バケットから1つ選ぶ
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    buckets = threshold - 2
+
+    def bound(i: int) -> int:
+        return min(i * (n - 2) // buckets + 1, n)
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(buckets):
+        start, end, next_end = bound(i), bound(i + 1), bound(i + 2)
+        if i == buckets - 1:
+            next_end = n
+        average_x = x[end:next_end].mean()
+        average_y = y[end:next_end].mean()
+        area = np.abs(
+            (x[previous] - average_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (average_y - y[previous])
+        )
+        previous = start + int(np.argmax(area))
+        selected[i + 1] = previous
+    return selected
+
+def time_histogram(keywords: List[Dict], bin_days: float) -> List[Dict]:
+    """時間差を bin_days 日ごとに区切った件数・推定ボリューム・重複ボリュームの合計（空の区間も含め連続）"""
+    if not keywords:
+        return []
+    days = np.array([keyword["time_diff_days"] for keyword in keywords], dtype=np.float64)
+    bins = np.floor(days / bin_days).astype(np.int64)
+    first = int(bins.min())
+    count = int(bins.max()) - first + 1
+    if count > MAX_TIMELINE_BINS:
+        raise ValueError(f"bin_days is too small ({count} bins, maximum {MAX_TIMELINE_BINS})")
+    offsets = bins - first
+
+    def total(field: str) -> List[int]:
+        weights = np.array([keyword[field] for keyword in keywords], dtype=np.float64)
+        return np.bincount(offsets, weights=weights, minlength=count).astype(np.int64).tolist()
+
+    return [
+        {"start": (first + i) * bin_days, "end": (first + i + 1) * bin_days,
+         "count": keyword_count, "estimated_volume": estimated, "duplicate_volume": duplicate}
+        for i, (keyword_count, estimated, duplicate) in enumerate(zip(
+            np.bincount(offsets, minlength=count).tolist(), total("estimated_volume"), total("duplicate_volume")
+        ))
+    ]
+
+def apply_view(result: Dict, view: Dict) -> Dict:
+    """
+    analyze_search_timeline の結果に表示オプションを適用する（元の結果は変更しない）
+
+    ヒストグラムとサマリーは絞り込み前の全キーワードで計算し、キーワード一覧は
+    上位k件 → LTTBでの間引き → 項目の絞り込みの順に適用する（時間差の順序は保つ）
+    """
+    keywords = result["filtered_keywords"]
+    shaped = dict(result)
+    if "bin_days" in view:
+        shaped["histogram"] = time_histogram(keywords, view["bin_days"])
+
+    selected = keywords
+    if "top_k" in view and view["top_k"] < len(selected):
+        volumes = np.array([keyword["estimated_volume"] for keyword in selected], dtype=np.float64)
+        top = np.sort(np.argsort(-volumes, kind="stable")[:view["top_k"]])
+        selected = [selected[i] for i in top]
+    if "downsample" in view and view["downsample"] < len(selected):
+        y_field = view.get("downsample_y", "duplicate_volume")
+        x = np.array([keyword["time_diff_days"] for keyword in selected], dtype=np.float64)
+        y = np.array([keyword[y_field] for keyword in selected], dtype=np.float64)
+        selected = [selected[i] for i in lttb_indices(x, y, view["downsample"])]
+    if not view.get("include_keywords", True):
+        selected = []
+    if "fields" in view:
+        selected = [{field: keyword[field] for field in view["fields"]} for keyword in selected]
+
+    shaped["filtered_keywords"] = selected
+    shaped["view"] = {**view, "total_keywords": len(keywords), "returned_keywords": len(selected)}
+    return shaped
+
+def _result_key(department: str, chief_complaint: str, gender: Optional[str], age: Optional[str],
+                view: Optional[Dict] = None) -> tuple:
+    # リクエストのJSONから来る値のため、文字列以外もハッシュできる形にそろえる
+    values = tuple(None if value is None else str(value) for value in (department, chief_complaint, gender, age))
+    return values + (json.dumps(view, sort_keys=True) if view else None,)
+
+def analyze_search_timeline_json(department: str, chief_complaint: str,
+                                 gender: Optional[str] = None,
+                                 age: Optional[str] = None,
+                                 view: Optional[Dict] = None) -> bytes:
+    """
+    analyze_search_timeline の結果をJSON（UTF-8）で返す
+
+    view（parse_view_options の戻り値）があれば apply_view で集計・間引きしてから変換する。
+    性別・年代・表示オプションの組み合わせごとに変換済みのJSONをキャッシュする（エラーの結果はキャッシュしない）
+    """
+    key = _result_key(department, chief_complaint, gender, age, view)
+    body = _result_cache.get(key)
+    if body is not None:
+        return body
+    return _build_json(key, department, chief_complaint, gender, age, view)
+
+def _build_json(key, department: str, chief_complaint: str, gender: Optional[str],
+                age: Optional[str], view: Optional[Dict]) -> bytes:
+    """結果を集計してJSONに変換し、キャッシュに保存する（キャッシュの確認は呼び出し元で1回だけ行う）"""
+    result = analyze_search_timeline(department, chief_complaint, gender, age)
+    if view and "error" not in result:
+        result = apply_view(result, view)
+    # JSONResponse と同じ形式で変換する
+    body = json.dumps(result, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+    if "error" not in result:
+        _result_cache.set(key, body, len(body))
+    return body
+
+async def analyze_search_timeline_json_async(department: str, chief_complaint: str,
+                                             gender: Optional[str] = None,
+                                             age: Optional[str] = None,
+                                             view: Optional[Dict] = None) -> bytes:
+    """analyze_search_timeline_json をイベントループ外で実行する（キャッシュ済みならそのまま返す）"""
+    key = _result_key(department, chief_complaint, gender, age, view)
+    body = _result_cache.get(key)
+    if body is not None:
+        return body
+    return await offload.run_io(_build_json, key, department, chief_complaint, gender, age, view)
+
+async def analyze_search_timeline_async(department: str, chief_complaint: str,
+                                        gender: Optional[str] = None,
+                                        age: Optional[str] = None) -> Dict:
+    """analyze_search_timeline をイベントループ外（I/Oスレッドプール）で実行する（CSV/Excelの読み込みを含むため）"""
+    return await offload.run_io(analyze_search_timeline, department, chief_complaint, gender, age)
+
 def clear_expired_cache():
     """期限切れのキャッシュをクリア"""
-    now = datetime.now()
-    expired_keys = []
-    
-    for key, timestamp in _cache_timestamps.items():
-        if now - timestamp > CACHE_DURATION:
-            expired_keys.append(key)
-    
-    for key in expired_keys:
-        del _timeline_cache[key]
-        del _cache_timestamps[key]
-        print(f"[CACHE] Cleared expired cache for {key}")
-    
-    return len(expired_keys)
+    count = _frame_cache.cleanup_expired() + _result_cache.cleanup_expired()
+    if count:
+        print(f"[CACHE] Cleared {count} expired entries")
+    return count
 
 def clear_all_cache():
     """すべてのキャッシュをクリア"""
-    count = len(_timeline_cache)
-    _timeline_cache.clear()
-    _cache_timestamps.clear()
+    count = _frame_cache.clear() + _result_cache.clear()
     print(f"[CACHE] Cleared all cache ({count} entries)")
-    return count
\ No newline at end of file
+    return count
+
+def get_cache_stats() -> Dict:
+    """DataFrame・レスポンスJSONそれぞれのキャッシュの件数・バイト数・ヒット数・削除数（このWorkerプロセス分）"""
+    return {"frames": _frame_cache.get_stats(), "results": _result_cache.get_stats()}